@@ -1,29 +1,37 @@
 ﻿from __future__ import annotations
 
 import asyncio
+import hmac
 import json
 import logging
 import random
+import signal
 import sys
 import threading
 from pathlib import Path
-from datetime import datetime, timedelta, time as dt_time
+from datetime import date, datetime, timedelta, time as dt_time
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import numpy as np
 from openpyxl import Workbook
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, TelegramError
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
+from backup import BackupResult, list_snapshots, make_snapshot, prune_snapshots
 from config import load_config
 from menus import (
     MAIN_MENU,
@@ -62,7 +70,25 @@ from menus import (
     quantity_keyboard,
     NAP_OPTIONS,
 )
-from db import Database
+from db import Database, MaintenanceReport
+from db_profile import DbProfiler
+from food_engine import PortionCatalog, optimize_plan, recommend_portions
+from habit_bits import co_occurrence
+from outbound import (
+    DEFERRED_ANSWER,
+    DEFERRED_DELETE,
+    DELETE_BATCH,
+    OutboundLimiter,
+    background,
+    gather_bounded,
+    in_background,
+)
+from persistence import SqlitePersistence
+from profiling import PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, ProfileCapture
+from stats_engine import StatsFrame, category_shares, rolling_max
+from stats_index import StatsIndex
+from recorder import SessionRecorder
+from tracing import Tracer, TracingRequest, span
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 LOGGER = logging.getLogger("lifeos-bot")
@@ -297,12 +323,48 @@ def get_state_int(db: Database, key: str) -> int | None:
 
 
 async def safe_delete_message(bot, chat_id: int, message_id: int | None) -> None:
+    """Best-effort delete. With the outbound limiter it is queued at background priority
+    and the caller does not wait for it; 429s are retried there."""
     if not message_id:
         return
+    if isinstance(getattr(bot, "rate_limiter", None), OutboundLimiter):
+        await bot.delete_message(chat_id, message_id, rate_limit_args=DEFERRED_DELETE)
+        return
     try:
         await bot.delete_message(chat_id, message_id)
-    except Exception:
+    except (BadRequest, Forbidden):
+        return
+    except TelegramError as exc:
+        LOGGER.warning("deleteMessage %s failed: %s", message_id, exc)
+
+
+async def delete_messages(bot, chat_id: int, message_ids) -> None:
+    """Best-effort delete of several messages with as few ``deleteMessages`` calls as possible."""
+    ids = sorted({message_id for message_id in message_ids if message_id})
+    if len(ids) <= 1:
+        await safe_delete_message(bot, chat_id, ids[0] if ids else None)
+        return
+    deferred = isinstance(getattr(bot, "rate_limiter", None), OutboundLimiter)
+    for start in range(0, len(ids), DELETE_BATCH):
+        batch = ids[start : start + DELETE_BATCH]
+        if deferred:
+            await bot.delete_messages(chat_id, batch, rate_limit_args=DEFERRED_DELETE)
+            continue
+        try:
+            await bot.delete_messages(chat_id, batch)
+        except (BadRequest, Forbidden):
+            continue
+        except TelegramError as exc:
+            LOGGER.warning("deleteMessages %s failed: %s", batch, exc)
+
+
+async def answer_query(query) -> None:
+    """Answer a button press; with the outbound limiter the answer goes out alongside the edit."""
+    bot = query.get_bot()
+    if isinstance(getattr(bot, "rate_limiter", None), OutboundLimiter):
+        await bot.answer_callback_query(query.id, rate_limit_args=DEFERRED_ANSWER)
         return
+    await query.answer()
 
 
 async def ensure_single_summary_message(
@@ -311,15 +373,17 @@ async def ensure_single_summary_message(
     current_message_id: int,
 ) -> None:
     db = get_sheets(context)
+    stale = []
     stored_summary_id = get_state_int(db, summary_state_key(chat_id))
     if stored_summary_id and stored_summary_id != current_message_id:
-        await safe_delete_message(context.bot, chat_id, stored_summary_id)
+        stale.append(stored_summary_id)
     db.set_state(summary_state_key(chat_id), str(current_message_id))
 
     prompt_id = get_state_int(db, prompt_state_key(chat_id))
     if prompt_id and prompt_id != current_message_id:
-        await safe_delete_message(context.bot, chat_id, prompt_id)
+        stale.append(prompt_id)
         db.set_state(prompt_state_key(chat_id), None)
+    await delete_messages(context.bot, chat_id, stale)
 
 
 async def send_or_edit_summary(
@@ -366,22 +430,28 @@ async def send_or_edit_prompt(
     return sent.message_id
 
 
-async def clear_prompt(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
-    db = get_sheets(context)
+def take_stale_prompt(db: Database, chat_id: int) -> int | None:
+    """Forget the prompt message; its id if it is a separate message that should be deleted."""
     msg_id = get_state_int(db, prompt_state_key(chat_id))
-    if msg_id:
-        summary_id = get_state_int(db, summary_state_key(chat_id))
-        if summary_id != msg_id:
-            await safe_delete_message(context.bot, chat_id, msg_id)
-        db.set_state(prompt_state_key(chat_id), None)
+    if not msg_id:
+        return None
+    db.set_state(prompt_state_key(chat_id), None)
+    summary_id = get_state_int(db, summary_state_key(chat_id))
+    return msg_id if summary_id != msg_id else None
+
+
+async def clear_prompt(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+    await safe_delete_message(context.bot, chat_id, take_stale_prompt(get_sheets(context), chat_id))
 
 
 async def render_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int, date_str: str | None = None) -> None:
     if date_str is None:
         date_str = get_active_date(context)
-    summary = await build_daily_summary(context, date_str)
-    daily = get_daily_data(context, date_str)
-    await send_or_edit_summary(context, chat_id, summary, build_main_menu_keyboard(daily))
+    with span("render.summary"):
+        summary = await build_daily_summary(context, date_str)
+        daily = get_daily_data(context, date_str)
+        keyboard = build_main_menu_keyboard(daily)
+    await send_or_edit_summary(context, chat_id, summary, keyboard)
 
 
 async def safe_render_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int, date_str: str | None = None) -> None:
@@ -399,20 +469,46 @@ async def safe_render_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
 
 
 async def finalize_input(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_message_id: int) -> None:
-    await clear_prompt(context, chat_id)
-    await safe_delete_message(context.bot, chat_id, user_message_id)
-    await safe_render_summary(context, chat_id, get_view_date(context))
+    stale = [take_stale_prompt(get_sheets(context), chat_id), user_message_id]
+    await gather_bounded(
+        delete_messages(context.bot, chat_id, stale),
+        safe_render_summary(context, chat_id, get_view_date(context)),
+    )
 
 
-def build_stats_keyboard(selected: str) -> InlineKeyboardMarkup:
+def build_stats_keyboard(selected: str, today: date) -> InlineKeyboardMarkup:
+    kind, _, start, end = parse_stats_period(selected, today)
+    month_arg = (start if kind == "m" else today).strftime("%Y-%m")
+    year_arg = start.year if kind == "y" else today.year
     rows = [
         [
-            InlineKeyboardButton(("✅ " if selected == "all" else "") + "Все", callback_data="stats:all"),
-            InlineKeyboardButton(("✅ " if selected == "month" else "") + "30д", callback_data="stats:month"),
-            InlineKeyboardButton(("✅ " if selected == "week" else "") + "7д", callback_data="stats:week"),
+            InlineKeyboardButton(("✅ " if kind == "all" else "") + "Все", callback_data="stats:all"),
+            InlineKeyboardButton(("✅ " if kind == "month" else "") + "30д", callback_data="stats:month"),
+            InlineKeyboardButton(("✅ " if kind == "week" else "") + "7д", callback_data="stats:week"),
+        ],
+        [
+            InlineKeyboardButton(("✅ " if kind == "m" else "") + "Месяц", callback_data=f"stats:m:{month_arg}"),
+            InlineKeyboardButton(("✅ " if kind == "y" else "") + "Год", callback_data=f"stats:y:{year_arg}"),
+            InlineKeyboardButton(("✅ " if kind == "last" else "") + "N дней", callback_data="stats:ask_days"),
+            InlineKeyboardButton(("✅ " if kind == "range" else "") + "Период", callback_data="stats:ask_range"),
         ],
-        [InlineKeyboardButton("⬅️ К сводке", callback_data="stats:back")],
     ]
+    nav: list[InlineKeyboardButton] = []
+    if kind == "m":
+        if start > STATS_FIRST_DAY:
+            prev_month = (start - timedelta(days=1)).strftime("%Y-%m")
+            nav.append(InlineKeyboardButton(f"◀️ {prev_month}", callback_data=f"stats:m:{prev_month}"))
+        if end < STATS_LAST_DAY:
+            next_month = (end + timedelta(days=1)).strftime("%Y-%m")
+            nav.append(InlineKeyboardButton(f"{next_month} ▶️", callback_data=f"stats:m:{next_month}"))
+    elif kind == "y":
+        if year_arg > STATS_FIRST_DAY.year:
+            nav.append(InlineKeyboardButton(f"◀️ {year_arg - 1}", callback_data=f"stats:y:{year_arg - 1}"))
+        if year_arg < STATS_LAST_DAY.year:
+            nav.append(InlineKeyboardButton(f"{year_arg + 1} ▶️", callback_data=f"stats:y:{year_arg + 1}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton("⬅️ К сводке", callback_data="stats:back")])
     return InlineKeyboardMarkup(rows)
 
 
@@ -422,21 +518,83 @@ def avg_value(total: float, count: int, digits: int = 0) -> str:
     return fmt_num(total / count, digits)
 
 
-def stats_period_dates(dates: list[str], period: str, tz_name: str) -> tuple[str, list[str]]:
-    today = get_now(tz_name).date()
+MONTH_NAMES = (
+    "январь",
+    "февраль",
+    "март",
+    "апрель",
+    "май",
+    "июнь",
+    "июль",
+    "август",
+    "сентябрь",
+    "октябрь",
+    "ноябрь",
+    "декабрь",
+)
+STATS_MAX_DAYS = 3660
+# Calendar periods are clamped to these days, so month/year arithmetic never leaves the date range.
+STATS_FIRST_DAY = date(1900, 1, 1)
+STATS_LAST_DAY = date(2100, 12, 31)
+
+
+def parse_stats_period(period: str, today: date) -> tuple[str, str, date | None, date | None]:
+    """Kind, label and inclusive bounds of a stats period (``None``: open end).
+
+    Periods: ``week``/``month``/``all``, ``last:<N>`` days, calendar ``m:YYYY-MM`` and
+    ``y:YYYY``, and ``range:YYYY-MM-DD:YYYY-MM-DD``. Calendar dates are clamped to
+    ``STATS_FIRST_DAY``..``STATS_LAST_DAY``; malformed values fall back to all time.
+    """
     if period == "week":
-        start = today - timedelta(days=6)
-        label = "7 дней"
-    elif period == "month":
-        start = today - timedelta(days=29)
-        label = "30 дней"
-    else:
-        start = None
-        label = "всё время"
-    if start is None:
-        return label, dates
-    start_str = start.isoformat()
-    return label, [d for d in dates if d >= start_str]
+        return "week", "7 дней", today - timedelta(days=6), None
+    if period == "month":
+        return "month", "30 дней", today - timedelta(days=29), None
+    kind, _, arg = period.partition(":")
+    try:
+        if kind == "last":
+            days = max(1, min(int(arg), STATS_MAX_DAYS))
+            return kind, f"последние {days} дн.", today - timedelta(days=days - 1), None
+        if kind == "m":
+            first = datetime.strptime(arg, "%Y-%m").date()
+            first = min(max(first, STATS_FIRST_DAY), STATS_LAST_DAY.replace(day=1))
+            last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            return kind, f"{MONTH_NAMES[first.month - 1]} {first.year}", first, last
+        if kind == "y":
+            year = min(max(int(arg), STATS_FIRST_DAY.year), STATS_LAST_DAY.year)
+            return kind, f"{year} год", date(year, 1, 1), date(year, 12, 31)
+        if kind == "range":
+            start_arg, _, end_arg = arg.partition(":")
+            start, end = (
+                min(max(datetime.strptime(value, "%Y-%m-%d").date(), STATS_FIRST_DAY), STATS_LAST_DAY)
+                for value in (start_arg, end_arg)
+            )
+            if start > end:
+                start, end = end, start
+            return kind, f"{start.isoformat()} — {end.isoformat()}", start, end
+    except (ValueError, OverflowError):
+        pass
+    return "all", "всё время", None, None
+
+
+def stats_period_range(period: str, tz_name: str) -> tuple[str, str | None, str | None]:
+    """Label and inclusive ISO date bounds of a stats period (see :func:`parse_stats_period`)."""
+    _, label, start, end = parse_stats_period(period, get_now(tz_name).date())
+    return label, start.isoformat() if start else None, end.isoformat() if end else None
+
+
+def stats_shot_window(period: str, start: str | None, end: str | None, active: date, first: date) -> tuple[date, date]:
+    """Days the shooting block covers: rolling periods end at the active day, calendar ones are clipped to it."""
+    if period == "week":
+        return active - timedelta(days=6), active
+    if period == "month":
+        return active - timedelta(days=29), active
+    kind, _, arg = period.partition(":")
+    if kind == "last" and start:
+        days = max(1, min(int(arg), STATS_MAX_DAYS))
+        return active - timedelta(days=days - 1), active
+    if start and end:
+        return datetime.fromisoformat(start).date(), min(datetime.fromisoformat(end).date(), active)
+    return min(first, active), active
 
 
 def shooting_activity_label(last7_total: int, last7_shot_days: int) -> str:
@@ -453,33 +611,114 @@ def shooting_activity_label(last7_total: int, last7_shot_days: int) -> str:
     return "нет активности"
 
 
-def date_series(start_date, end_date) -> list[str]:
-    if end_date < start_date:
-        return []
-    days = (end_date - start_date).days
-    return [(start_date + timedelta(days=i)).isoformat() for i in range(days + 1)]
+STATS_EXPENSE_COLUMNS = {label: f"expense:{label}" for label in EXPENSE_HEADER_BY_LABEL}
+STATS_COLUMNS = (
+    "sleep",
+    "steps",
+    "kcal",
+    "protein",
+    "fat",
+    "carb",
+    "english",
+    "ml",
+    "algos",
+    "uni",
+    "shots",
+    "study",
+    "kbju",
+    "quality",
+    "day",
+    "expense",
+    *STATS_EXPENSE_COLUMNS.values(),
+)
 
 
-def rolling_window_max(values: list[int], window: int) -> int:
-    if not values:
-        return 0
-    if window <= 1:
-        return max(values)
-    current = sum(values[:window])
-    best = current
-    for idx in range(window, len(values)):
-        current += values[idx] - values[idx - window]
-        if current > best:
-            best = current
-    return best
+def load_stats_frame(db: Database, start: str, end: str) -> StatsFrame:
+    start_date = datetime.fromisoformat(start).date()
+    end_date = datetime.fromisoformat(end).date()
+    rows = db.get_daily_rows(start, end)
+    expenses = db.get_expense_totals_range(start, end)
+    day_indices: list[int] = []
+    statuses: list[str] = []
+    values: dict[str, list[float]] = {name: [] for name in STATS_COLUMNS}
+    for row in rows:
+        try:
+            day = datetime.fromisoformat(row["date"]).date()
+        except ValueError:
+            continue
+        data = {header: row.get(db_key) for db_key, header in DB_TO_HEADER.items()}
+        totals = expenses.get(row["date"], {})
+        day_indices.append((day - start_date).days)
+        statuses.append(row.get("completion_status") or "")
+
+        sleep = parse_sleep_hours(data.get("Сон_часы")) or 0.0
+        nap = parse_sheet_number(data.get("Сон_дневной"))
+        values["sleep"].append(sleep + max(0.0, nap))
+        values["steps"].append(steps_value(data))
+        for name, header in (("kcal", "Еда_ккал"), ("protein", "Еда_Б"), ("fat", "Еда_Ж"), ("carb", "Еда_У")):
+            raw = data.get(header)
+            values[name].append(parse_sheet_number(raw) if is_set(raw) else float("nan"))
+        for name, header in (("english", "Английский_мин"), ("ml", "ML_мин"), ("algos", "Алгосы_мин"), ("uni", "ВУЗ_мин")):
+            values[name].append(int(parse_sheet_number(data.get(header))))
+        values["shots"].append(int(parse_sheet_number(data.get("Стрельнул_раз"))))
+        values["study"].append(sum(values[name][-1] for name in ("english", "ml", "algos", "uni")))
+        values["kbju"].append(
+            1.0 if any(not np.isnan(values[name][-1]) for name in ("kcal", "protein", "fat", "carb")) else float("nan")
+        )
+        quality = row.get("quality")
+        values["quality"].append(float(quality) if quality is not None else float("nan"))
+        values["day"].append(1.0)
+        values["expense"].append(totals.get("total", 0.0))
+        for label, column in STATS_EXPENSE_COLUMNS.items():
+            values[column].append(totals.get(label, 0.0))
+    return StatsFrame.from_rows(start_date, end_date, day_indices, statuses, values)
+
+
+def get_stats_index(context: ContextTypes.DEFAULT_TYPE, until: str) -> StatsIndex:
+    bot_data = context.application.bot_data
+    db = get_sheets(context)
+    index = bot_data.get("stats_index")
+    if index is None:
+        index = StatsIndex()
+        db.add_change_listener(index.mark_dirty)
+        bot_data["stats_index"] = index
+    sync_stats_index(db, index, until)
+    return index
+
+
+def sync_stats_index(db: Database, index: StatsIndex, until: str) -> None:
+    """Full build on first use, afterwards re-read only the days written since the last call."""
+    dirty = index.take_dirty()
+    if index.ready and not dirty:
+        index.grow_to(datetime.fromisoformat(until).date())
+        return
+    first_day, last_day = db.get_daily_date_bounds()
+    if not first_day:
+        index.reset()
+        return
+    end_day = max(last_day, until)
+    if not index.ready or first_day < index.start.isoformat():
+        refresh_scores(db)
+        index.build(load_stats_frame(db, first_day, end_day))
+        return
+    for date_str in sorted(dirty):
+        try:
+            day = datetime.fromisoformat(date_str).date()
+        except ValueError:
+            continue
+        if day < index.start:
+            continue
+        load_daily_data(db, date_str)
+        index.update_day(load_stats_frame(db, date_str, date_str))
+    index.grow_to(datetime.fromisoformat(end_day).date())
 
 
 def build_stats_summary(context: ContextTypes.DEFAULT_TYPE, period: str) -> str:
     cfg = context.application.bot_data["config"]
     db = get_sheets(context)
-    all_dates = db.get_daily_dates()
-    label, dates = stats_period_dates(all_dates, period, cfg.timezone)
-    if not dates:
+    label, start, end = stats_period_range(period, cfg.timezone)
+    first_day, last_day = db.get_daily_date_bounds()
+    if not first_day:
         return f"📊 Статистика ({label})\nНет данных."
 
     active_day = db.get_state(STATE_ACTIVE_DAY) or today_str(cfg.timezone)
@@ -489,117 +728,65 @@ def build_stats_summary(context: ContextTypes.DEFAULT_TYPE, period: str) -> str:
         active_day = today_str(cfg.timezone)
         active_date = datetime.fromisoformat(active_day).date()
 
-    full = partial = none = tracked = 0
-    quality_sum = quality_count = 0
-    sleep_sum = sleep_count = 0
-    steps_sum = steps_count = 0
-    kcal_sum = prot_sum = fat_sum = carb_sum = 0.0
-    kbju_count = 0
-    eng_sum = eng_count = 0
-    ml_sum = ml_count = 0
-    alg_sum = alg_count = 0
-    uni_sum = uni_count = 0
-    shots_by_date: dict[str, int] = {}
-    last_shot_date: str | None = None
-    expense_total_sum = 0.0
-    expense_days = 0
-    expense_max_day = 0.0
-    expense_max_date = ""
-    expense_by_category: dict[str, float] = {label: 0.0 for label in EXPENSE_HEADER_BY_LABEL}
-    paused_days = 0
-    paused_reasons: dict[str, int] = {}
-    paused_timeline: list[tuple[str, str]] = []
-
-    for date_str in all_dates:
-        data = get_daily_data(context, date_str)
-        shots = int(parse_sheet_number(data.get("Стрельнул_раз")))
-        shots_by_date[date_str] = shots
-        if shots > 0:
-            last_shot_date = date_str
-
-    for date_str in dates:
-        data = get_daily_data(context, date_str)
-        day_status = normalize_choice(data.get("Статус_дня"))
-        status = day_completion_status(data)
-        if status == "paused":
-            paused_days += 1
-            reason = day_status or "без причины"
-            paused_reasons[reason] = paused_reasons.get(reason, 0) + 1
-            paused_timeline.append((date_str, reason))
-            continue
-        if status == "empty":
-            continue
-        tracked += 1
-        if status == "full":
-            full += 1
-        elif status == "partial":
-            partial += 1
-        else:
-            none += 1
+    period_start = max(start, first_day) if start else first_day
+    period_end = min(end, last_day) if end else last_day
+    if period_start > period_end:
+        return f"📊 Статистика ({label})\nНет данных."
 
-        quality = compute_quality(data)
-        if quality is not None:
-            quality_sum += quality
-            quality_count += 1
+    index = get_stats_index(context, active_day)
+    history = index.frame
+    lo = datetime.fromisoformat(period_start).date()
+    hi = datetime.fromisoformat(period_end).date()
+    period_span = index.range_count("day", lo, hi)
+    if period_span == 0:
+        return f"📊 Статистика ({label})\nНет данных."
 
-        sleep = parse_sleep_hours(data.get("Сон_часы")) or 0.0
-        nap = parse_sheet_number(data.get("Сон_дневной"))
-        sleep_total = sleep + max(0.0, nap)
-        if sleep_total > 0:
-            sleep_sum += sleep_total
-            sleep_count += 1
-
-        steps = steps_value(data)
-        if steps > 0:
-            steps_sum += steps
-            steps_count += 1
-
-        kcal = data.get("Еда_ккал")
-        protein = data.get("Еда_Б")
-        fat = data.get("Еда_Ж")
-        carbs = data.get("Еда_У")
-        if any(is_set(v) for v in (kcal, protein, fat, carbs)):
-            kcal_sum += parse_sheet_number(kcal)
-            prot_sum += parse_sheet_number(protein)
-            fat_sum += parse_sheet_number(fat)
-            carb_sum += parse_sheet_number(carbs)
-            kbju_count += 1
-
-        english = int(parse_sheet_number(data.get("Английский_мин")))
-        if english > 0:
-            eng_sum += english
-            eng_count += 1
-        ml = int(parse_sheet_number(data.get("ML_мин")))
-        if ml > 0:
-            ml_sum += ml
-            ml_count += 1
-        algos = int(parse_sheet_number(data.get("Алгосы_мин")))
-        if algos > 0:
-            alg_sum += algos
-            alg_count += 1
-        uni = int(parse_sheet_number(data.get("ВУЗ_мин")))
-        if uni > 0:
-            uni_sum += uni
-            uni_count += 1
-
-        day_expense = parse_sheet_number(data.get("Траты_всего"))
-        if day_expense > 0:
-            expense_days += 1
-            if day_expense > expense_max_day:
-                expense_max_day = day_expense
-                expense_max_date = date_str
-        expense_total_sum += day_expense
-        for category_label, header in EXPENSE_HEADER_BY_LABEL.items():
-            expense_by_category[category_label] += parse_sheet_number(data.get(header))
+    scores = db.get_score_summary(period_start, period_end)
+    status_counts = scores["counts"]
+    full = status_counts.get("full", 0)
+    partial = status_counts.get("partial", 0)
+    none = status_counts.get("none", 0)
+    tracked = full + partial + none
+    paused_days = status_counts.get("paused", 0)
+    paused_reasons: dict[str, int] = {}
+    paused_timeline: list[tuple[str, str]] = []
+    for date_str, day_status in scores["paused"]:
+        reason = normalize_choice(day_status) or "без причины"
+        paused_reasons[reason] = paused_reasons.get(reason, 0) + 1
+        paused_timeline.append((date_str, reason))
 
     if tracked == 0 and paused_days == 0:
         return f"📊 Статистика ({label})\nНет данных."
 
+    def tracked_stats(name: str) -> tuple[float, int]:
+        return (
+            index.range_sum(name, lo, hi, tracked=True),
+            index.range_count(name, lo, hi, tracked=True, positive=True),
+        )
+
+    sleep_sum, sleep_count = tracked_stats("sleep")
+    steps_sum, steps_count = tracked_stats("steps")
+    kbju_count = index.range_count("kbju", lo, hi, tracked=True)
+    kcal_sum = index.range_sum("kcal", lo, hi, tracked=True)
+    prot_sum = index.range_sum("protein", lo, hi, tracked=True)
+    fat_sum = index.range_sum("fat", lo, hi, tracked=True)
+    carb_sum = index.range_sum("carb", lo, hi, tracked=True)
+    eng_sum, eng_count = tracked_stats("english")
+    ml_sum, ml_count = tracked_stats("ml")
+    alg_sum, alg_count = tracked_stats("algos")
+    uni_sum, uni_count = tracked_stats("uni")
+
+    expense_total_sum, expense_days = tracked_stats("expense")
+    expense_max_day, expense_max_date = index.range_max("expense", lo, hi) or (0.0, "")
+    expense_by_category = {
+        category: index.range_sum(column, lo, hi, tracked=True) for category, column in STATS_EXPENSE_COLUMNS.items()
+    }
+
     full_pct = int(round(full / tracked * 100)) if tracked > 0 else 0
     partial_pct = int(round(partial / tracked * 100)) if tracked > 0 else 0
     none_pct = int(round(none / tracked * 100)) if tracked > 0 else 0
 
-    avg_quality = avg_value(quality_sum, quality_count, 0)
+    avg_quality = avg_value(scores["quality_sum"], scores["quality_count"], 0)
     avg_sleep = avg_value(sleep_sum, sleep_count, 1)
     avg_steps = avg_value(steps_sum, steps_count, 0)
     if kbju_count:
@@ -617,98 +804,46 @@ def build_stats_summary(context: ContextTypes.DEFAULT_TYPE, period: str) -> str:
         f"вуз {avg_value(uni_sum, uni_count, 0)}м"
     )
 
-    period_span = len(dates)
-    if period == "week":
-        shot_period_dates = date_series(active_date - timedelta(days=6), active_date)
-    elif period == "month":
-        shot_period_dates = date_series(active_date - timedelta(days=29), active_date)
-    else:
-        if all_dates:
-            try:
-                first_date = datetime.fromisoformat(all_dates[0]).date()
-            except ValueError:
-                first_date = active_date
-            if first_date > active_date:
-                first_date = active_date
-        else:
-            first_date = active_date
-        shot_period_dates = date_series(first_date, active_date)
-
-    shot_values = [shots_by_date.get(day, 0) for day in shot_period_dates]
-    shot_period_span = len(shot_period_dates)
-    shots_period_total = sum(shot_values)
-    shots_days_count = sum(1 for value in shot_values if value > 0)
+    shot_start, shot_end = stats_shot_window(period, start, end, active_date, history.start)
+    shot_period_span = max(0, (shot_end - shot_start).days + 1)
+    shots_period_total = int(index.range_sum("shots", shot_start, shot_end))
+    shots_days_count = index.range_count("shots", shot_start, shot_end, positive=True)
     shot_freq_pct = int(round((shots_days_count / shot_period_span) * 100)) if shot_period_span > 0 else 0
     shots_avg_day = fmt_num(shots_period_total / shot_period_span, 1) if shot_period_span > 0 else "—"
     shots_avg_active_day = fmt_num(shots_period_total / shots_days_count, 1) if shots_days_count > 0 else "—"
 
-    shot_best_day = max(shot_values) if shot_values else 0
-    shot_best_day_date = ""
-    if shot_best_day > 0 and shot_period_dates:
-        shot_best_day_date = shot_period_dates[shot_values.index(shot_best_day)]
+    shot_best_day, shot_best_day_date = index.range_max("shots", shot_start, shot_end) or (0.0, "")
+    shot_best_day = int(shot_best_day)
 
-    if last_shot_date:
-        days_no_shot = max(
-            0,
-            (active_date - datetime.fromisoformat(last_shot_date).date()).days,
-        )
+    shot_runs = index.runs["shots"]
+    last_shot = shot_runs.last_active()
+    if last_shot is not None:
+        days_no_shot = max(0, active_date.toordinal() - last_shot)
     else:
         days_no_shot = shot_period_span
 
-    streak_current = 0
-    cursor = active_date
-    while shots_by_date.get(cursor.isoformat(), 0) > 0:
-        streak_current += 1
-        cursor -= timedelta(days=1)
-
-    streak_best_period = 0
-    streak = 0
-    for value in shot_values:
-        if value > 0:
-            streak += 1
-            if streak > streak_best_period:
-                streak_best_period = streak
-        else:
-            streak = 0
-
-    if all_dates:
-        series_start = datetime.fromisoformat(all_dates[0]).date()
-        series_end = active_date
-        span = (series_end - series_start).days + 1
-        by_day = [0] * max(1, span)
-        for day_str, value in shots_by_date.items():
-            idx = (datetime.fromisoformat(day_str).date() - series_start).days
-            if 0 <= idx < len(by_day):
-                by_day[idx] = value
-        max_week = rolling_window_max(by_day, 7)
-        max_month = rolling_window_max(by_day, 30)
-        max_all = sum(by_day)
-    else:
-        max_week = max_month = max_all = 0
-
-    last7_start = active_date - timedelta(days=6)
-    last7_total = 0
-    last7_days = 0
-    for i in range(7):
-        day = (last7_start + timedelta(days=i)).isoformat()
-        value = shots_by_date.get(day, 0)
-        last7_total += value
-        if value > 0:
-            last7_days += 1
-    shoot_activity = shooting_activity_label(last7_total, last7_days)
+    streak_current = shot_runs.current(active_date.toordinal())
+    streak_best_period = shot_runs.best(shot_start.toordinal(), shot_end.toordinal())
+
+    by_day = history.values_between("shots", history.start, active_date)
+    if not len(by_day):
+        by_day = np.zeros(1)
+    max_week = int(rolling_max(by_day, 7))
+    max_month = int(rolling_max(by_day, 30))
+    max_all = int(by_day.sum())
+
+    week_start = active_date - timedelta(days=6)
+    shoot_activity = shooting_activity_label(
+        int(index.range_sum("shots", week_start, active_date)),
+        index.range_count("shots", week_start, active_date, positive=True),
+    )
 
     expense_avg_day = expense_total_sum / period_span if period_span > 0 else 0.0
     expense_avg_spend_day = expense_total_sum / expense_days if expense_days > 0 else 0.0
-    expense_cat_parts: list[str] = []
-    if expense_total_sum > 0:
-        ranked = sorted(expense_by_category.items(), key=lambda x: x[1], reverse=True)
-        for label_name, value in ranked:
-            if value <= 0:
-                continue
-            share = int(round((value / expense_total_sum) * 100))
-            expense_cat_parts.append(f"{label_name.lower()} {fmt_money(value)}₽ ({share}%)")
-            if len(expense_cat_parts) >= 4:
-                break
+    expense_cat_parts = [
+        f"{label_name.lower()} {fmt_money(value)}₽ ({share}%)"
+        for label_name, value, share in category_shares(expense_by_category, expense_total_sum)
+    ]
     paused_reason_parts: list[str] = []
     if paused_reasons:
         ranked_reasons = sorted(paused_reasons.items(), key=lambda x: (-x[1], x[0]))
@@ -760,8 +895,9 @@ def build_stats_summary(context: ContextTypes.DEFAULT_TYPE, period: str) -> str:
 
 
 async def render_stats(context: ContextTypes.DEFAULT_TYPE, chat_id: int, period: str = "week") -> None:
+    cfg = context.application.bot_data["config"]
     text = build_stats_summary(context, period)
-    await send_or_edit_summary(context, chat_id, text, build_stats_keyboard(period))
+    await send_or_edit_summary(context, chat_id, text, build_stats_keyboard(period, get_now(cfg.timezone).date()))
 
 
 async def send_quote_job(context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -796,7 +932,7 @@ def schedule_quote_jobs(app, config) -> None:
         tz = None
     for hour, minute in QUOTE_DEFAULT_TIMES:
         app.job_queue.run_daily(
-            send_quote_job,
+            in_background(send_quote_job),
             time=dt_time(hour=hour, minute=minute, tzinfo=tz),
             name=f"quote_{hour:02d}{minute:02d}",
             chat_id=chat_id,
@@ -804,6 +940,141 @@ def schedule_quote_jobs(app, config) -> None:
     LOGGER.info("Quote jobs scheduled at %s", ", ".join(f"{h:02d}:{m:02d}" for h, m in QUOTE_DEFAULT_TIMES))
 
 
+def db_jobs_lock(application) -> asyncio.Lock:
+    """Keeps backups and maintenance from running at the same time."""
+    return application.bot_data.setdefault("db_jobs_lock", asyncio.Lock())
+
+
+def backup_dir(config) -> Path:
+    path = Path(config.backup_dir)
+    return path if path.is_absolute() else BASE_DIR / path
+
+
+async def run_backup(application) -> BackupResult | None:
+    """Snapshot and prune in a worker thread; ``None`` if a backup or maintenance is running."""
+    lock = db_jobs_lock(application)
+    if lock.locked():
+        return None
+    config = application.bot_data["config"]
+    db: Database = application.bot_data["db"]
+    target = backup_dir(config)
+
+    def work() -> BackupResult:
+        result = make_snapshot(db.path, target)
+        if result.ok:
+            prune_snapshots(
+                target,
+                keep_last=config.backup_keep_last,
+                keep_daily=config.backup_keep_daily,
+                keep_weekly=config.backup_keep_weekly,
+            )
+        return result
+
+    async with lock:
+        return await asyncio.to_thread(work)
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        result = await run_backup(context.application)
+    except Exception:
+        LOGGER.exception("Backup failed")
+        message = "⚠️ Бэкап базы не удался, подробности в логе."
+    else:
+        if result is None:
+            return
+        if result.ok:
+            LOGGER.info("Backup %s: %d bytes in %.2fs", result.path.name, result.size, result.seconds)
+            return
+        LOGGER.error("Backup %s failed integrity check: %s", result.path.name, result.message)
+        message = f"⚠️ Бэкап {result.path.name} не прошёл проверку целостности: {result.message}"
+    chat_id = context.application.bot_data.get("allowed_user_id")
+    if chat_id:
+        await context.bot.send_message(chat_id=chat_id, text=message)
+
+
+def schedule_backup_job(app, config) -> None:
+    if not app.job_queue:
+        LOGGER.warning("JobQueue недоступен: автоматические бэкапы выключены.")
+        return
+    if config.backup_interval_hours <= 0:
+        LOGGER.info("BACKUP_INTERVAL_HOURS=0: автоматические бэкапы выключены.")
+        return
+    app.job_queue.run_repeating(
+        in_background(backup_job),
+        interval=timedelta(hours=config.backup_interval_hours),
+        first=timedelta(minutes=5),
+        name="backup",
+    )
+    LOGGER.info("Backups every %sh into %s", config.backup_interval_hours, backup_dir(config))
+
+
+def fmt_size(size: int) -> str:
+    return f"{size / 1_000_000:.1f} МБ"
+
+
+def format_maintenance_report(report: MaintenanceReport) -> str:
+    lines = [
+        "🧹 Обслуживание базы",
+        f"• База: {fmt_size(report.db_before)} → {fmt_size(report.db_after)}",
+        f"• WAL: {fmt_size(report.wal_before)} → {fmt_size(report.wal_after)}",
+        f"• Освобождено страниц: {report.free_pages}",
+        f"• Время: {report.seconds:.2f} с",
+    ]
+    if report.checkpoint_busy:
+        lines.append("⚠️ WAL занят читателем, обрезан не полностью.")
+    return "\n".join(lines)
+
+
+async def run_maintenance(application) -> MaintenanceReport | None:
+    lock = db_jobs_lock(application)
+    if lock.locked():
+        return None
+    db: Database = application.bot_data["db"]
+    async with lock:
+        return await asyncio.to_thread(db.maintenance)
+
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        report = await run_maintenance(context.application)
+    except Exception:
+        LOGGER.exception("DB maintenance failed")
+        return
+    if report is None:
+        return
+    LOGGER.info(
+        "DB maintenance: db %d -> %d, wal %d -> %d bytes, %d free pages, %.2fs",
+        report.db_before,
+        report.db_after,
+        report.wal_before,
+        report.wal_after,
+        report.free_pages,
+        report.seconds,
+    )
+
+
+def schedule_maintenance_job(app, config) -> None:
+    if not app.job_queue:
+        LOGGER.warning("JobQueue недоступен: обслуживание базы выключено.")
+        return
+    try:
+        hour, minute = (int(part) for part in config.maintenance_time.split(":"))
+    except ValueError:
+        LOGGER.info("MAINTENANCE_TIME не задан: обслуживание базы выключено.")
+        return
+    try:
+        tz = ZoneInfo(config.timezone)
+    except Exception:
+        tz = None
+    app.job_queue.run_daily(
+        maintenance_job,
+        time=dt_time(hour=hour, minute=minute, tzinfo=tz),
+        name="db_maintenance",
+    )
+    LOGGER.info("DB maintenance scheduled at %02d:%02d", hour, minute)
+
+
 def build_main_menu_keyboard(data: dict) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
     viewing_date = str(data.get("Дата") or "")
@@ -889,14 +1160,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     old_summary_id = get_state_int(db, summary_state_key(chat_id))
     if old_summary_id:
-        await safe_delete_message(context.bot, chat_id, old_summary_id)
         db.set_state(summary_state_key(chat_id), None)
-    await safe_render_summary(context, chat_id, date_str)
-    await safe_delete_message(context.bot, update.effective_chat.id, update.message.message_id)
+    await gather_bounded(
+        delete_messages(context.bot, chat_id, [old_summary_id, update.message.message_id]),
+        safe_render_summary(context, chat_id, date_str),
+    )
 
 
 async def show_menu(query, title: str, buttons, back_to: str = "menu:main", cols: int = 2) -> None:
-    await query.answer()
+    await answer_query(query)
     await query.edit_message_text(title, reply_markup=build_keyboard(buttons, cols=cols, back=("⬅️ Назад", back_to)))
 
 
@@ -1015,8 +1287,8 @@ async def send_quote_message(
 
 
 def end_day_feedback(data: dict) -> str:
-    quality = compute_quality(data) or 0
-    status = day_completion_status(data)
+    quality = parse_sheet_number(data.get("Качество_дня"))
+    status = data.get("_status") or day_completion_status(data)
     if status == "paused":
         reason = normalize_choice(data.get("Статус_дня")) or "перерыв"
         return f"⏸ День помечен: {reason}. Продолжаем дальше."
@@ -1308,6 +1580,11 @@ def bonus_linear(value: float, min_val: float, max_val: float, max_bonus: float)
     return (value - min_val) / (max_val - min_val) * max_bonus
 
 
+# Bump whenever compute_quality / day_completion_status / compute_missing change,
+# so rows scored under the old rules get recomputed on next read.
+SCORE_VERSION = 1
+
+
 def compute_quality(data: dict) -> int | None:
     min_ok, context = day_minimum_met(data)
     if context["any_data"] is False:
@@ -1484,7 +1761,10 @@ def mark_choice_buttons(buttons: list[tuple[str, str]], current_value: object, p
 
 
 def get_daily_data(context: ContextTypes.DEFAULT_TYPE, date_str: str) -> dict:
-    db = get_sheets(context)
+    return load_daily_data(get_sheets(context), date_str)
+
+
+def load_daily_data(db: Database, date_str: str) -> dict:
     row = db.get_daily_row(date_str)
     if not row:
         return {}
@@ -1544,14 +1824,34 @@ def get_daily_data(context: ContextTypes.DEFAULT_TYPE, date_str: str) -> dict:
     data["_sleep_start_day"] = db.get_state(STATE_SLEEP_START_DAY)
     data["_active_day"] = db.get_state(STATE_ACTIVE_DAY)
 
-    quality = compute_quality(data)
+    if row.get("score_version") == SCORE_VERSION and row.get("score_rev") == row.get("rev"):
+        quality = row.get("quality")
+        status = row.get("completion_status") or ""
+        missing = row.get("missing")
+    else:
+        quality = compute_quality(data)
+        status = day_completion_status(data)
+        missing = compute_missing(data)
+        db.store_day_scores(date_str, row.get("rev"), quality, status, missing, SCORE_VERSION)
     data["Качество_дня"] = quality if quality is not None else ""
     data["Коэффициент_дня"] = data["Качество_дня"]
-    missing = compute_missing(data)
     data["Не_заполнено"] = missing or ""
+    data["_status"] = status
     return data
 
 
+def refresh_scores(db: Database, start: str | None = None) -> int:
+    stale = db.get_stale_score_dates(SCORE_VERSION, start)
+    for date_str in stale:
+        load_daily_data(db, date_str)
+    return len(stale)
+
+
+def recompute_all_scores(db: Database) -> int:
+    db.invalidate_scores()
+    return refresh_scores(db)
+
+
 def normalize_choice(value: object) -> str:
     if value is None:
         return ""
@@ -1759,6 +2059,8 @@ async def build_habits_menu(context: ContextTypes.DEFAULT_TYPE, date_str: str) -
     habits = sheets.get_habits()
     daily = get_daily_data(context, date_str)
     completed = set(parse_habits_value(daily.get("Привычки")))
+    # A streak stays alive until the day after the last mark is missed.
+    streaks = sheets.get_habit_streaks(datetime.fromisoformat(date_str).date(), grace=1)
 
     total = len(habits)
     done = sum(1 for habit in habits if habit in completed)
@@ -1772,10 +2074,14 @@ async def build_habits_menu(context: ContextTypes.DEFAULT_TYPE, date_str: str) -
     max_items = 10
     for idx, habit in enumerate(habits[:max_items]):
         status = "✅" if habit in completed else "⬜"
-        buttons.append((f"{status} {habit}", f"habit:toggle:{idx}"))
+        streak = streaks.get(habit, 0)
+        label = f"{status} {habit} 🔥{streak}" if streak > 1 else f"{status} {habit}"
+        buttons.append((label, f"habit:toggle:{idx}"))
     if len(habits) > max_items:
         header = f"{header}\n… ещё {len(habits) - max_items} привычек не показаны"
 
+    if habits:
+        buttons.append(("📈 Динамика", "habit:stats"))
     buttons.append(("➕ Добавить привычку", "habit:add"))
     if completed:
         buttons.append(("🧹 Сбросить отметки", "habit:clear"))
@@ -1783,6 +2089,57 @@ async def build_habits_menu(context: ContextTypes.DEFAULT_TYPE, date_str: str) -
     return header, buttons
 
 
+HABIT_STATS_DAYS = 28
+WEEKDAY_SHORT = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+
+
+def heat_cell(rate: float) -> str:
+    if rate >= 0.7:
+        return "🟩"
+    if rate >= 0.4:
+        return "🟨"
+    if rate > 0:
+        return "🟥"
+    return "⬜"
+
+
+def build_habit_stats_text(context: ContextTypes.DEFAULT_TYPE, date_str: str) -> str:
+    bitmaps = get_sheets(context).get_habit_bitmaps()
+    end = datetime.fromisoformat(date_str).date()
+    start = end - timedelta(days=HABIT_STATS_DAYS - 1)
+    week_start = end - timedelta(days=6)
+    if not bitmaps:
+        return "📈 Привычки: пока нет списка"
+
+    lines = [f"📈 Привычки: 7д / {HABIT_STATS_DAYS}д (до {date_str})"]
+    for name, bitmap in bitmaps.items():
+        week_pct = int(round(bitmap.rate(week_start, end) * 100))
+        month_pct = int(round(bitmap.rate(start, end) * 100))
+        lines.append(f"• {name}: {week_pct}% / {month_pct}%")
+
+    weeks = HABIT_STATS_DAYS // 7
+    lines.append("")
+    lines.append(f"🗓 По дням недели ({' '.join(WEEKDAY_SHORT)}):")
+    for name, bitmap in bitmaps.items():
+        cells = "".join(heat_cell(count / weeks) for count in bitmap.weekday_counts(start, end))
+        lines.append(f"{cells} {name}")
+
+    names = list(bitmaps)
+    pairs = []
+    for i, first in enumerate(names):
+        for second in names[i + 1 :]:
+            both = co_occurrence(bitmaps[first], bitmaps[second], start, end)
+            if both:
+                pairs.append((both, first, second))
+    if pairs:
+        pairs.sort(key=lambda item: (-item[0], item[1], item[2]))
+        lines.append("")
+        lines.append("🤝 Чаще вместе:")
+        for both, first, second in pairs[:3]:
+            lines.append(f"• {first} + {second}: {both} дн.")
+    return "\n".join(lines)
+
+
 def sync_code_fields(sheets: Database, date_str: str) -> None:
     sessions = sheets.get_sessions(date_str, category="Код")
     if not sessions:
@@ -1870,72 +2227,6 @@ async def show_study_menu(query, context: ContextTypes.DEFAULT_TYPE, date_str: s
     await show_menu(query, "Учеба:", build_study_menu(daily))
 
 
-def recommend_portions(
-    current: dict,
-    target_mid: dict,
-    portions: list[dict],
-    *,
-    eaten_products: set[str],
-    max_items: int = 3,
-) -> list[dict]:
-    weights = {"kcal": 1.0, "protein": 1.3, "fat": 0.8, "carb": 1.0}
-
-    def deficit(vec):
-        return {
-            key: max(0.0, target_mid[key] - vec.get(key, 0.0))
-            for key in target_mid
-        }
-
-    base_def = deficit(current)
-    base_score = sum((base_def[k] ** 2) * weights[k] for k in base_def)
-
-    scored = []
-    for portion in portions:
-        new_vec = {
-            key: current.get(key, 0.0) + portion["macros"].get(key, 0.0)
-            for key in target_mid
-        }
-        new_def = deficit(new_vec)
-        new_score = sum((new_def[k] ** 2) * weights[k] for k in new_def)
-        improvement = base_score - new_score
-        if improvement <= 0:
-            continue
-        penalty = 0.6 if portion["product"] in eaten_products else 1.0
-        scored.append((improvement * penalty, portion))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [item for _, item in scored[:max_items]]
-
-
-def build_plan(
-    current: dict,
-    target_mid: dict,
-    portions: list[dict],
-    *,
-    eaten_products: set[str],
-    max_steps: int = 4,
-) -> list[dict]:
-    plan: list[dict] = []
-    temp = current.copy()
-    used_products: set[str] = set()
-    for _ in range(max_steps):
-        candidates = recommend_portions(
-            temp,
-            target_mid,
-            portions,
-            eaten_products=eaten_products.union(used_products),
-            max_items=1,
-        )
-        if not candidates:
-            break
-        choice = candidates[0]
-        plan.append(choice)
-        used_products.add(choice["product"])
-        for key in target_mid:
-            temp[key] = temp.get(key, 0.0) + choice["macros"].get(key, 0.0)
-    return plan
-
-
 def menu_config(menu_key: str, data: dict) -> tuple[str, list[tuple[str, str]], str, int]:
     if menu_key == "sport":
         return ("Спорт:", build_sport_menu(data), "menu:main", 2)
@@ -2009,7 +2300,7 @@ async def confirm_override(
     }
     buttons = [("✅ Да", "confirm:yes"), ("↩️ Нет", "confirm:no")]
     back_cb = return_menu if return_menu.startswith("menu:") else f"menu:{return_menu}"
-    await query.answer()
+    await answer_query(query)
     await query.edit_message_text(
         f"⚠️ {label}\nСейчас: {current_display}\nЗаменить на: {new_display}?",
         reply_markup=build_keyboard(buttons, cols=2, back=("⬅️ Назад", back_cb)),
@@ -2029,22 +2320,22 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     sheets.ensure_daily_row(date_str)
 
     if data == "quote:delete":
-        await query.answer()
+        await answer_query(query)
         db = get_sheets(context)
         db.set_state(summary_state_key(query.message.chat_id), None)
         db.set_state(prompt_state_key(query.message.chat_id), None)
         await safe_delete_message(context.bot, query.message.chat_id, query.message.message_id)
         return
     if data == "quote:back":
-        await query.answer()
+        await answer_query(query)
         await safe_render_summary(context, query.message.chat_id, get_view_date(context))
         return
     if data == "quote:random":
-        await query.answer()
+        await answer_query(query)
         await send_quote_message(context, query.message.chat_id)
         return
     if data.startswith("quote:show:"):
-        await query.answer()
+        await answer_query(query)
         quotes: list[str] = context.application.bot_data.get("quotes", [])
         if not quotes:
             await query.edit_message_text("Файл с цитатами пустой или не найден.")
@@ -2062,7 +2353,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data.startswith("confirm:"):
-        await query.answer()
+        await answer_query(query)
         pending = context.user_data.get("pending_set")
         if not pending:
             await query.edit_message_text("Главное меню:", reply_markup=build_keyboard(MAIN_MENU, cols=2))
@@ -2094,29 +2385,49 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
     if data == "menu:main":
-        await query.answer()
+        await answer_query(query)
         db = get_sheets(context)
         if query.message is not None:
             db.set_state(summary_state_key(query.message.chat_id), str(query.message.message_id))
         await safe_render_summary(context, query.message.chat_id, date_str)
         return
     if data == "menu:refresh":
-        await query.answer()
+        await answer_query(query)
         db = get_sheets(context)
         if query.message is not None:
             db.set_state(summary_state_key(query.message.chat_id), str(query.message.message_id))
         await safe_render_summary(context, query.message.chat_id, date_str)
         return
     if data.startswith("stats:"):
-        await query.answer()
+        await answer_query(query)
         if data == "stats:back":
             await safe_render_summary(context, query.message.chat_id, date_str)
             return
+        if data == "stats:ask_days":
+            context.user_data["expect"] = "stats_days"
+            await send_or_edit_prompt(
+                context,
+                query.message.chat_id,
+                "За сколько последних дней показать статистику? Например 90",
+                build_keyboard([("⬅️ Назад", "stats:week")], cols=1),
+            )
+            return
+        if data == "stats:ask_range":
+            context.user_data["expect"] = "stats_range"
+            await send_or_edit_prompt(
+                context,
+                query.message.chat_id,
+                "Введи период: YYYY-MM-DD YYYY-MM-DD (например 2026-01-01 2026-03-31)",
+                build_keyboard([("⬅️ Назад", "stats:week")], cols=1),
+            )
+            return
         period = data.split(":", 1)[1]
+        context.user_data.pop("expect", None)
+        await clear_prompt(context, query.message.chat_id)
         await render_stats(context, query.message.chat_id, period)
         return
     if data == "menu:date":
-        await query.answer()
+        await answer_query(query)
         await send_or_edit_prompt(
             context,
             query.message.chat_id,
@@ -2129,20 +2440,20 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "date:today":
-        await query.answer()
+        await answer_query(query)
         set_view_date(context, get_active_date(context))
         await clear_prompt(context, query.message.chat_id)
         await safe_render_summary(context, query.message.chat_id, get_view_date(context))
         return
     if data == "date:yesterday":
-        await query.answer()
+        await answer_query(query)
         yday = (get_now(cfg.timezone).date() - timedelta(days=1)).isoformat()
         set_view_date(context, yday)
         await clear_prompt(context, query.message.chat_id)
         await safe_render_summary(context, query.message.chat_id, get_view_date(context))
         return
     if data == "date:pick":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "view_date"
         await send_or_edit_prompt(
             context,
@@ -2166,7 +2477,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "Досуг:", build_leisure_menu(daily))
         return
     if data == "menu:food":
-        await query.answer()
+        await answer_query(query)
         summary = await build_food_summary(context, date_str)
         await query.edit_message_text(
             summary,
@@ -2178,7 +2489,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "Моралька:", build_morale_menu(daily))
         return
     if data == "menu:habits":
-        await query.answer()
+        await answer_query(query)
         text, buttons = await build_habits_menu(context, date_str)
         await query.edit_message_text(
             text,
@@ -2187,7 +2498,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data.startswith("habit:toggle:"):
-        await query.answer()
+        await answer_query(query)
         try:
             idx = int(data.split(":")[2])
         except (IndexError, ValueError):
@@ -2212,8 +2523,16 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
 
+    if data == "habit:stats":
+        await answer_query(query)
+        await query.edit_message_text(
+            build_habit_stats_text(context, date_str),
+            reply_markup=build_keyboard([], cols=1, back=("⬅️ Назад", "menu:habits")),
+        )
+        return
+
     if data == "habit:add":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "habit_add"
         await send_or_edit_prompt(
             context,
@@ -2223,7 +2542,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data == "habit:clear":
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             "Сбросить все отметки привычек за сегодня?",
             reply_markup=build_keyboard([("✅ Да", "habit_clear:yes"), ("↩️ Нет", "habit_clear:no")], cols=2, back=("⬅️ Назад", "menu:habits")),
@@ -2231,7 +2550,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data.startswith("habit_clear:"):
-        await query.answer()
+        await answer_query(query)
         if data == "habit_clear:yes":
             sheets.clear_habits_for_date(date_str)
             sheets.update_daily_fields(date_str, {COLUMN_MAP["habits"]: ""})
@@ -2243,7 +2562,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data.startswith("anti:"):
-        await query.answer()
+        await answer_query(query)
         reason = data.split(":", 1)[1] if ":" in data else ""
         if reason == "custom":
             context.user_data["expect"] = "anti_custom"
@@ -2352,7 +2671,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "ВУЗ:", mark_set_buttons(UNI_OPTIONS, current), back_to="menu:study", cols=3)
         return
     if data == "study:code":
-        await query.answer()
+        await answer_query(query)
         text, buttons = await build_code_menu(context, date_str)
         await query.edit_message_text(
             text,
@@ -2368,7 +2687,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if data.startswith("code_mode:"):
         mode = data.split(":", 1)[1]
         context.user_data["code_mode"] = mode
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             f"💻 Режим: {mode}\nВыбери тему:",
             reply_markup=build_keyboard(mark_choice_buttons(CODE_TOPIC_OPTIONS, None, "code_topic:"), cols=2, back=("⬅️ Назад", "study:code")),
@@ -2379,7 +2698,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         topic = data.split(":", 1)[1]
         mode = context.user_data.get("code_mode")
         if not mode:
-            await query.answer()
+            await answer_query(query)
             await query.edit_message_text(
                 "Сначала выбери режим:",
                 reply_markup=build_keyboard(mark_choice_buttons(CODE_MODE_OPTIONS, None, "code_mode:"), cols=2, back=("⬅️ Назад", "menu:study")),
@@ -2389,7 +2708,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         sync_code_fields(sheets, date_str)
         context.user_data.pop("code_mode", None)
         text, buttons = await build_code_menu(context, date_str)
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             f"✅ Добавил: {mode}/{topic}\n\n{text}",
             reply_markup=build_keyboard(buttons, cols=1, back=("⬅️ Назад", "menu:study")),
@@ -2401,7 +2720,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if removed:
             sync_code_fields(sheets, date_str)
         text, buttons = await build_code_menu(context, date_str)
-        await query.answer()
+        await answer_query(query)
         prefix = "↩️ Удалил последнюю запись.\n\n" if removed else "Нет записей для удаления.\n\n"
         await query.edit_message_text(
             f"{prefix}{text}",
@@ -2410,7 +2729,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data == "code:clear":
-        await query.answer()
+        await answer_query(query)
         context.user_data["pending_code_clear"] = True
         await query.edit_message_text(
             "Удалить все записи кода за сегодня?",
@@ -2419,7 +2738,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data.startswith("code_clear:"):
-        await query.answer()
+        await answer_query(query)
         if data == "code_clear:yes":
             sheets.clear_sessions(date_str, category="Код")
             sync_code_fields(sheets, date_str)
@@ -2460,7 +2779,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "Дневной сон:", mark_set_buttons(NAP_OPTIONS, current), back_to="menu:leisure", cols=2)
         return
     if data == "leisure:nap_custom":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "nap_hours"
         await send_or_edit_prompt(
             context,
@@ -2472,14 +2791,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if data == "leisure:shots":
         daily = get_daily_data(context, date_str)
         count = int(parse_sheet_number(daily.get("Стрельнул_раз")))
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             f"Стрельнул сегодня: {count}",
             reply_markup=build_shots_keyboard(count),
         )
         return
     if data == "leisure:expenses":
-        await query.answer()
+        await answer_query(query)
         text, buttons = await build_expense_menu(context, date_str)
         await query.edit_message_text(
             text,
@@ -2487,7 +2806,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data.startswith("expense:add:"):
-        await query.answer()
+        await answer_query(query)
         category_key = data.split(":", 2)[2]
         category_label = EXPENSE_CATEGORY_LABELS.get(category_key)
         if not category_label:
@@ -2502,7 +2821,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "expense:undo":
-        await query.answer()
+        await answer_query(query)
         removed = sheets.delete_last_expense(date_str)
         text, buttons = await build_expense_menu(context, date_str)
         prefix = "↩️ Удалил последнюю трату.\n\n" if removed else "Нет трат для удаления.\n\n"
@@ -2512,7 +2831,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "expense:clear":
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             "Очистить все траты за выбранный день?",
             reply_markup=build_keyboard(
@@ -2523,7 +2842,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data.startswith("expense_clear:"):
-        await query.answer()
+        await answer_query(query)
         if data == "expense_clear:yes":
             sheets.clear_expenses(date_str)
         text, buttons = await build_expense_menu(context, date_str)
@@ -2533,7 +2852,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "leisure:sleep_manual":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "sleep_bed_manual"
         await send_or_edit_prompt(
             context,
@@ -2543,7 +2862,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "sleep:edit":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "sleep_bed_edit"
         await send_or_edit_prompt(
             context,
@@ -2553,7 +2872,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "sleep:cancel":
-        await query.answer()
+        await answer_query(query)
         await send_or_edit_prompt(
             context,
             query.message.chat_id,
@@ -2566,7 +2885,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "sleep:cancel_yes":
-        await query.answer()
+        await answer_query(query)
         sheets.set_state(STATE_SLEEP_START, None)
         sheets.set_state(STATE_SLEEP_START_DAY, None)
         sheets.set_state(STATE_SLEEP_START_BED, None)
@@ -2583,14 +2902,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         else:
             count = max(0, count - 1)
         sheets.update_daily_fields(date_str, {COLUMN_MAP["shots"]: count})
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text(
             f"Стрельнул сегодня: {count}",
             reply_markup=build_shots_keyboard(count),
         )
         return
     if data in {"leisure:sleep", "sleep:toggle"}:
-        await query.answer()
+        await answer_query(query)
         now = get_now(cfg.timezone)
         sleep_start_raw = sheets.get_state(STATE_SLEEP_START)
         if not sleep_start_raw:
@@ -2645,7 +2964,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "Продуктивность:", mark_set_buttons(PRODUCTIVITY_OPTIONS, current), back_to="menu:leisure", cols=3)
         return
     if data == "leisure:anti":
-        await query.answer()
+        await answer_query(query)
         text, buttons = await build_anti_menu(context, date_str)
         await query.edit_message_text(
             text,
@@ -2665,8 +2984,45 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if data == "food:oils":
         await show_menu(query, "Еда: масла", FOOD_OIL_OPTIONS, back_to="menu:food", cols=2)
         return
+    if data == "food:search":
+        await answer_query(query)
+        context.user_data.clear()
+        context.user_data["expect"] = "food_search"
+        await send_or_edit_prompt(
+            context,
+            query.message.chat_id,
+            "Что ищем? Можно с опечатками (например, \"твраог\" или \"грутка\").",
+            build_keyboard([("⬅️ Назад", "menu:food")], cols=1),
+        )
+        return
+    if data.startswith("food_pick:"):
+        await answer_query(query)
+        try:
+            item = sheets.get_food_item(int(data.split(":", 1)[1]))
+        except ValueError:
+            item = None
+        if not item:
+            return
+        context.user_data.clear()
+        context.user_data["custom_name"] = item["name"]
+        context.user_data["custom_macros"] = (item["protein_100"], item["fat_100"], item["carb_100"], item["kcal_100"])
+        context.user_data["expect"] = "custom_grams"
+        await send_or_edit_prompt(
+            context,
+            query.message.chat_id,
+            f"{item['name']}: сколько грамм съел? (одно число)",
+            build_keyboard([("⬅️ Назад", "menu:food")], cols=1),
+        )
+        return
+    if data == "food:custom_new":
+        await answer_query(query)
+        if not context.user_data.get("custom_name"):
+            return
+        context.user_data["expect"] = "custom_macros"
+        await send_or_edit_prompt(context, query.message.chat_id, "Введи Б/Ж/У/Ккал на 100г (4 числа через пробел).")
+        return
     if data == "food:custom":
-        await query.answer()
+        await answer_query(query)
         context.user_data.clear()
         context.user_data["expect"] = "custom_name"
         await send_or_edit_prompt(
@@ -2688,12 +3044,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_menu(query, "Энергия:", mark_set_buttons(ENERGY_OPTIONS, current), back_to="menu:morale", cols=2)
         return
     if data == "morale:weight":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "weight"
         await send_or_edit_prompt(context, query.message.chat_id, "Введи вес (например, 72.4):")
         return
     if data == "morale:regret":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "regret"
         await send_or_edit_prompt(
             context,
@@ -2703,7 +3059,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return
     if data == "morale:review":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "review"
         await send_or_edit_prompt(
             context,
@@ -2720,7 +3076,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     if data == "habits:text":
-        await query.answer()
+        await answer_query(query)
         context.user_data["expect"] = "habits"
         await send_or_edit_prompt(context, query.message.chat_id, "Привычки: напиши текст.")
         return
@@ -2840,9 +3196,90 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 await show_menu(query, "Моралька:", build_morale_menu(daily))
                 return
 
+    if data.startswith("find:"):
+        await answer_query(query)
+        query_text = context.user_data.get("find_query")
+        if not query_text:
+            await query.edit_message_text(
+                "Поиск устарел, набери /find ещё раз.",
+                reply_markup=build_keyboard([], cols=1, back=("⬅️ Назад", "menu:main")),
+            )
+            return
+        try:
+            page = max(0, int(data.split(":", 1)[1]))
+        except ValueError:
+            return
+        text, keyboard = build_find_view(context, query_text, page)
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
+
+    if data == "food:meals":
+        await answer_query(query)
+        context.user_data.clear()
+        text, keyboard = build_meals_view(context, date_str)
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
+    if data.startswith("meal:apply:"):
+        await answer_query(query)
+        try:
+            template_id = int(data.split(":", 2)[2])
+        except ValueError:
+            return
+        template = next((t for t in sheets.get_meal_templates() if t["id"] == template_id), None)
+        if not template or not template["items"]:
+            return
+        await log_meal(query, context, date_str, template["items"], f"Записал «{template['name']}»")
+        return
+    if data.startswith("meal:repeat:"):
+        await answer_query(query)
+        meal = find_meal(context, data.split(":", 2)[2])
+        if not meal:
+            return
+        await log_meal(query, context, date_str, meal_items(meal), f"Повторил вчерашний приём {meal[0]['time']}")
+        return
+    if data == "meal:save":
+        await answer_query(query)
+        buttons = []
+        for day, day_label in ((date_str, "Сегодня"), (previous_day(date_str), "Вчера")):
+            for meal in day_meals(context, day):
+                label = describe_meal_items(context, meal_items(meal))
+                buttons.append((f"{day_label} {meal[0]['time']}: {shorten(label)}", f"meal:save:{meal_key(day, meal)}"))
+        text = "Какой приём сохранить как шаблон?" if buttons else "Нет записей еды за сегодня и вчера."
+        await query.edit_message_text(text, reply_markup=build_keyboard(buttons, cols=1, back=("⬅️ Назад", "food:meals")))
+        return
+    if data.startswith("meal:save:"):
+        await answer_query(query)
+        meal = find_meal(context, data.split(":", 2)[2])
+        if not meal:
+            return
+        context.user_data.clear()
+        context.user_data["meal_items"] = meal_items(meal)
+        context.user_data["expect"] = "meal_name"
+        await send_or_edit_prompt(
+            context,
+            query.message.chat_id,
+            f"{describe_meal_items(context, context.user_data['meal_items'])}\nКак назвать шаблон? (например, Завтрак)",
+            build_keyboard([("⬅️ Назад", "food:meals")], cols=1),
+        )
+        return
+    if data == "meal:del":
+        await answer_query(query)
+        buttons = [(f"🗑 {t['name'][:40]}", f"meal:del:{t['id']}") for t in sheets.get_meal_templates()]
+        await query.edit_message_text("Какой шаблон удалить?", reply_markup=build_keyboard(buttons, cols=1, back=("⬅️ Назад", "food:meals")))
+        return
+    if data.startswith("meal:del:"):
+        await answer_query(query)
+        try:
+            sheets.delete_meal_template(int(data.split(":", 2)[2]))
+        except ValueError:
+            return
+        text, keyboard = build_meals_view(context, date_str)
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
+
     if data.startswith("food_item:"):
         portion_code = data.split(":", 1)[1]
-        await query.answer()
+        await answer_query(query)
         await query.edit_message_text("Сколько порций?", reply_markup=quantity_keyboard(portion_code))
         return
 
@@ -2854,9 +3291,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             time_str(cfg.timezone),
             portion_code,
             qty)
-        await query.answer()
+        await answer_query(query)
+        portion = get_portion_catalog(context).by_code(portion_code)
         await query.edit_message_text(
-            f"✅ Записал еду: {portion_code} × {qty}",
+            f"✅ Записал еду: {portion['label'] if portion else portion_code} × {qty}",
             reply_markup=build_keyboard(FOOD_MENU, cols=2, back=("⬅️ Назад", "menu:main")),
         )
         return
@@ -2888,6 +3326,31 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await finalize_input(context, chat_id, update.message.message_id)
         return
 
+    if expect == "stats_days":
+        try:
+            days = int(text)
+        except ValueError:
+            await send_or_edit_prompt(context, chat_id, "Нужно число дней. Пример: 90")
+            return
+        if days <= 0 or days > STATS_MAX_DAYS:
+            await send_or_edit_prompt(context, chat_id, f"Число дней от 1 до {STATS_MAX_DAYS}.")
+            return
+        context.user_data.pop("expect", None)
+        await clear_prompt(context, chat_id)
+        await render_stats(context, chat_id, f"last:{days}")
+        return
+
+    if expect == "stats_range":
+        try:
+            first, last = sorted(datetime.strptime(part, "%Y-%m-%d").date() for part in text.replace("—", " ").split())
+        except ValueError:
+            await send_or_edit_prompt(context, chat_id, "Неверный формат. Пример: 2026-01-01 2026-03-31")
+            return
+        context.user_data.pop("expect", None)
+        await clear_prompt(context, chat_id)
+        await render_stats(context, chat_id, f"range:{first.isoformat()}:{last.isoformat()}")
+        return
+
     if expect == "weight":
         try:
             weight = parse_number(text)
@@ -3050,8 +3513,46 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await finalize_input(context, chat_id, update.message.message_id)
         return
 
+    if expect == "find_query":
+        context.user_data.clear()
+        context.user_data["find_query"] = text
+        view_text, keyboard = build_find_view(context, text, 0)
+        await send_or_edit_prompt(context, chat_id, view_text, keyboard)
+        return
+
+    if expect == "meal_name":
+        items = context.user_data.get("meal_items") or []
+        context.user_data.clear()
+        if items:
+            sheets.save_meal_template(text[:60], items)
+        view_text, keyboard = build_meals_view(context, date_str)
+        await send_or_edit_prompt(context, chat_id, f"✅ Шаблон «{text[:60]}» сохранён.\n\n{view_text}", keyboard)
+        return
+
+    if expect == "food_search":
+        context.user_data.pop("expect", None)
+        view_text, keyboard = build_food_search_view(context, text)
+        await send_or_edit_prompt(context, chat_id, view_text, keyboard)
+        return
+
     if expect == "custom_name":
         context.user_data["custom_name"] = text
+        similar = [
+            item
+            for item in sheets.search_food(text, 5)
+            if item["kind"] == "item" and item["score"] >= FOOD_DUPLICATE_SCORE
+        ][:3]
+        if similar:
+            context.user_data.pop("expect", None)
+            buttons = [(f"✅ {item['text'][:40]}", f"food_pick:{item['ref']}") for item in similar]
+            buttons.append((f"➕ Новый: {text[:40]}", "food:custom_new"))
+            await send_or_edit_prompt(
+                context,
+                chat_id,
+                "Похоже, такой продукт уже есть:",
+                build_keyboard(buttons, cols=1, back=("⬅️ Назад", "menu:food")),
+            )
+            return
         context.user_data["expect"] = "custom_macros"
         await send_or_edit_prompt(context, chat_id, "Введи Б/Ж/У/Ккал на 100г (4 числа через пробел).")
         return
@@ -3075,9 +3576,14 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             return
         name = context.user_data.get("custom_name", "Продукт")
         proteins, fats, carbs, kcal = context.user_data.get("custom_macros", (0, 0, 0, 0))
-        code = f"CUST_{get_now(cfg.timezone).strftime('%y%m%d%H%M%S')}"
         sheets.ensure_food_item(name, proteins, fats, carbs, kcal)
-        sheets.ensure_portion(code, name, f"{grams} г (custom)", grams)
+        # Reuse an existing portion of the same size instead of adding another CUST_ row.
+        existing = next((p for p in get_portion_catalog(context).for_product(name) if p["grams"] == grams), None)
+        if existing:
+            code = existing["code"]
+        else:
+            code = f"CUST_{get_now(cfg.timezone).strftime('%y%m%d%H%M%S')}"
+            sheets.ensure_portion(code, name, f"{grams} г (custom)", grams)
         sheets.add_food_log(
             date_str,
             time_str(cfg.timezone),
@@ -3106,7 +3612,7 @@ async def build_daily_summary(context: ContextTypes.DEFAULT_TYPE, date_str: str)
     carbs = macros.get("carb", 0.0)
 
     min_ok, context_min = day_minimum_met(data)
-    status = day_completion_status(data)
+    status = data.get("_status") or day_completion_status(data)
 
     active_day = data.get("_active_day")
     date_label = "Сегодня" if str(active_day or "") == date_str else "Дата"
@@ -3259,7 +3765,7 @@ async def build_food_summary(context: ContextTypes.DEFAULT_TYPE, date_str: str)
     ]
 
     # List of foods eaten today
-    portions = db.list_portions()
+    catalog = get_portion_catalog(context)
     food_log = db.get_food_log(date_str)
     eaten: dict[str, dict[str, float]] = {}
     eaten_products: set[str] = set()
@@ -3353,7 +3859,7 @@ async def build_food_summary(context: ContextTypes.DEFAULT_TYPE, date_str: str)
     recommendations = recommend_portions(
         current_vec,
         target_mid,
-        portions,
+        catalog,
         eaten_products=eaten_products,
         max_items=3,
     )
@@ -3366,16 +3872,183 @@ async def build_food_summary(context: ContextTypes.DEFAULT_TYPE, date_str: str)
                 f"• {item['label']} — +{fmt_num(m['kcal'])} ккал, Б {fmt_num(m['protein'],1)}, Ж {fmt_num(m['fat'],1)}, У {fmt_num(m['carb'],1)}"
             )
 
-    plan = build_plan(current_vec, target_mid, portions, eaten_products=eaten_products, max_steps=4)
-    if plan:
+    plan = optimize_plan(current_vec, target_mid, catalog, eaten_products=eaten_products, max_items=4)
+    if plan.items:
         lines.append("")
         lines.append("🍱 Черновик рациона на остаток дня:")
-        for item in plan:
-            lines.append(f"• {item['label']}")
+        totals = dict(current_vec)
+        for item, qty in plan.items:
+            lines.append(f"• {item['label']}" + (f" ×{qty}" if qty > 1 else ""))
+            for key in totals:
+                totals[key] += item["macros"].get(key, 0.0) * qty
+        lines.append(
+            f"≈ Итого: Ккал {fmt_num(totals['kcal'])} | Б {fmt_num(totals['protein'], 1)} | "
+            f"Ж {fmt_num(totals['fat'], 1)} | У {fmt_num(totals['carb'], 1)}"
+        )
 
     return "\n".join(lines)
 
 
+def get_portion_catalog(context: ContextTypes.DEFAULT_TYPE) -> PortionCatalog:
+    """Portion catalog cached in bot_data until the database catalog version changes."""
+    db = get_sheets(context)
+    bot_data = context.application.bot_data
+    version = db.get_catalog_version()
+    catalog = bot_data.get("portion_catalog")
+    if catalog is None or catalog.version != version:
+        catalog = PortionCatalog.from_portions(db.list_portions(), version)
+        bot_data["portion_catalog"] = catalog
+    return catalog
+
+
+FOOD_SEARCH_LIMIT = 8
+FOOD_DUPLICATE_SCORE = 0.6
+
+
+def build_food_search_view(context: ContextTypes.DEFAULT_TYPE, query_text: str) -> tuple[str, InlineKeyboardMarkup]:
+    catalog = get_portion_catalog(context)
+    buttons: list[tuple[str, str]] = []
+    for item in get_sheets(context).search_food(query_text, FOOD_SEARCH_LIMIT):
+        if item["kind"] == "portion":
+            portion = catalog.by_code(item["ref"])
+            if portion:
+                buttons.append((portion["label"], f"food_item:{portion['code']}"))
+        else:
+            buttons.append((f"{item['text'][:40]} — свои граммы", f"food_pick:{item['ref']}"))
+    if not buttons:
+        text = f"🔎 «{query_text}»: ничего не нашёл."
+    else:
+        text = f"🔎 «{query_text}»: выбери продукт."
+    buttons.append(("🔎 Искать ещё", "food:search"))
+    buttons.append(("➕ Новый продукт", "food:custom"))
+    return text, build_keyboard(buttons, cols=1, back=("⬅️ Назад", "menu:food"))
+
+
+FIND_PAGE_SIZE = 5
+JOURNAL_KIND_LABELS = {
+    "review": "📝 Отзыв",
+    "regret": "😔 Жалею",
+    "code_topic": "💻 Код",
+    "session": "⏱",
+    "expense": "💸",
+}
+
+
+def build_find_view(context: ContextTypes.DEFAULT_TYPE, query_text: str, page: int) -> tuple[str, InlineKeyboardMarkup]:
+    total, rows = get_sheets(context).search_journal(query_text, FIND_PAGE_SIZE, page * FIND_PAGE_SIZE)
+    if not total:
+        return f"🔎 «{query_text}»: ничего не нашёл.", build_keyboard([], cols=1, back=("⬅️ Назад", "menu:main"))
+    pages = (total + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+    lines = [f"🔎 «{query_text}»: {total} совп., стр. {page + 1}/{pages}"]
+    for row in rows:
+        kind = JOURNAL_KIND_LABELS.get(row["kind"], row["kind"])
+        if row["label"]:
+            kind = f"{kind} {row['label']}"
+        lines.append("")
+        lines.append(f"📅 {row['date']} · {kind}")
+        lines.append(row["snippet"])
+    nav = []
+    if page > 0:
+        nav.append(("◀️", f"find:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(("▶️", f"find:{page + 1}"))
+    return "\n".join(lines), build_keyboard(nav, cols=2, back=("⬅️ Назад", "menu:main"))
+
+
+MEAL_GAP_MINUTES = 45
+
+
+def group_meals(entries: list[dict]) -> list[list[dict]]:
+    """Split a day's food log into meals: entries less than ``MEAL_GAP_MINUTES`` apart."""
+    meals: list[list[dict]] = []
+    last_minute = None
+    for entry in sorted(entries, key=lambda item: (item["time"] or "", item["id"])):
+        try:
+            hours, minutes = (entry["time"] or "").split(":")[:2]
+            minute = int(hours) * 60 + int(minutes)
+        except ValueError:
+            minute = last_minute
+        if not meals or minute is None or last_minute is None or minute - last_minute > MEAL_GAP_MINUTES:
+            meals.append([])
+        meals[-1].append(entry)
+        last_minute = minute
+    return meals
+
+
+def meal_items(meal: list[dict]) -> list[tuple[str, float]]:
+    """``(portion_code, quantity)`` pairs of a meal, same portions merged, in first-seen order."""
+    items: dict[str, float] = {}
+    for entry in meal:
+        items[entry["code"]] = items.get(entry["code"], 0) + (entry["quantity"] or 0)
+    return list(items.items())
+
+
+def describe_meal_items(context: ContextTypes.DEFAULT_TYPE, items: list[tuple[str, float]]) -> str:
+    catalog = get_portion_catalog(context)
+    parts = []
+    for code, qty in items:
+        portion = catalog.by_code(code)
+        parts.append(f"{portion['label'] if portion else code} ×{fmt_num(qty, 1)}")
+    return ", ".join(parts)
+
+
+def shorten(text: str, limit: int = 40) -> str:
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+def day_meals(context: ContextTypes.DEFAULT_TYPE, date_str: str) -> list[list[dict]]:
+    return group_meals(get_sheets(context).get_food_log(date_str))
+
+
+def meal_key(date_str: str, meal: list[dict]) -> str:
+    """Callback key of a meal: its date and the id of its first food_log row."""
+    return f"{date_str}:{meal[0]['id']}"
+
+
+def find_meal(context: ContextTypes.DEFAULT_TYPE, key: str) -> list[dict] | None:
+    """The meal of :func:`meal_key` ``key`` as the log groups it now, or None once its row is gone."""
+    date_str, _, entry_id = key.rpartition(":")
+    try:
+        entry_id = int(entry_id)
+    except ValueError:
+        return None
+    return next((meal for meal in day_meals(context, date_str) if any(entry["id"] == entry_id for entry in meal)), None)
+
+
+def previous_day(date_str: str) -> str:
+    return (date.fromisoformat(date_str) - timedelta(days=1)).isoformat()
+
+
+def build_meals_view(context: ContextTypes.DEFAULT_TYPE, date_str: str) -> tuple[str, InlineKeyboardMarkup]:
+    templates = get_sheets(context).get_meal_templates()
+    lines = ["🍱 Шаблоны приёмов пищи"]
+    buttons: list[tuple[str, str]] = []
+    for template in templates:
+        lines.append(f"• {template['name']}: {describe_meal_items(context, template['items']) or '—'}")
+        buttons.append((f"▶️ {template['name'][:40]}", f"meal:apply:{template['id']}"))
+    if not templates:
+        lines.append("Пока пусто — сохрани приём пищи кнопкой «💾».")
+    yesterday = previous_day(date_str)
+    for meal in day_meals(context, yesterday):
+        label = describe_meal_items(context, meal_items(meal))
+        buttons.append((f"🔁 Вчера {meal[0]['time']}: {shorten(label)}", f"meal:repeat:{meal_key(yesterday, meal)}"))
+    buttons.append(("💾 Сохранить приём", "meal:save"))
+    if templates:
+        buttons.append(("🗑 Удалить шаблон", "meal:del"))
+    return "\n".join(lines), build_keyboard(buttons, cols=1, back=("⬅️ Назад", "menu:food"))
+
+
+async def log_meal(query, context: ContextTypes.DEFAULT_TYPE, date_str: str, items: list[tuple[str, float]], title: str) -> None:
+    """Write all items in one transaction and re-render the food screen once."""
+    cfg = context.application.bot_data["config"]
+    count = get_sheets(context).add_food_logs(date_str, time_str(cfg.timezone), items, comment="meal")
+    summary = await build_food_summary(context, date_str)
+    await query.edit_message_text(
+        f"✅ {title}: {count} поз.\n\n{summary}",
+        reply_markup=build_keyboard(FOOD_MENU, cols=2, back=("⬅️ Назад", "menu:main")),
+    )
+
+
 def _write_sheet(ws, headers: list[str], rows: list[dict]) -> None:
     ws.append(headers)
     for row in rows:
@@ -3404,7 +4077,11 @@ def build_export_workbook(context: ContextTypes.DEFAULT_TYPE) -> Path:
     _write_sheet(ws, DAILY_HEADERS, daily_rows)
 
     ws = wb.create_sheet("food_log")
-    _write_sheet(ws, ["date", "time", "portion_code", "quantity", "comment"], db.list_food_log_all())
+    _write_sheet(
+        ws,
+        ["date", "time", "portion_code", "quantity", "comment", "label", "grams", "kcal", "protein", "fat", "carb"],
+        db.list_food_log_all(),
+    )
 
     ws = wb.create_sheet("session_log")
     _write_sheet(ws, ["date", "time", "category", "subcategory", "minutes", "comment"], db.list_session_log_all())
@@ -3438,11 +4115,14 @@ async def delete_export_and_restore_summary(
 ) -> None:
     await asyncio.sleep(delay_seconds)
     db = get_sheets(context)
-    await safe_delete_message(context.bot, chat_id, export_message_id)
     stored = get_state_int(db, export_state_key(chat_id))
     if stored == export_message_id:
         db.set_state(export_state_key(chat_id), None)
-    await safe_render_summary(context, chat_id, date_str)
+    with background():
+        await gather_bounded(
+            safe_delete_message(context.bot, chat_id, export_message_id),
+            safe_render_summary(context, chat_id, date_str),
+        )
 
 
 async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3453,14 +4133,15 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     chat_id = update.effective_chat.id
     date_str = get_view_date(context)
     db = get_sheets(context)
-    await clear_prompt(context, chat_id)
-    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    stale = [take_stale_prompt(db, chat_id), update.message.message_id]
     summary_id = get_state_int(db, summary_state_key(chat_id))
     if summary_id:
-        await safe_delete_message(context.bot, chat_id, summary_id)
+        stale.append(summary_id)
         db.set_state(summary_state_key(chat_id), None)
+    await delete_messages(context.bot, chat_id, stale)
 
-    xlsx_path = build_export_workbook(context)
+    with span("render.export"):
+        xlsx_path = build_export_workbook(context)
     with xlsx_path.open("rb") as f:
         sent = await context.bot.send_document(
             chat_id=chat_id,
@@ -3490,6 +4171,182 @@ async def static_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await safe_delete_message(context.bot, update.effective_chat.id, update.message.message_id)
 
 
+async def rescore_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    count = recompute_all_scores(get_sheets(context))
+    index = context.application.bot_data.get("stats_index")
+    if index is not None:
+        index.reset()
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    await send_or_edit_prompt(
+        context,
+        chat_id,
+        f"♻️ Пересчитал качество и статус: {count} дн.",
+        build_keyboard([("⬅️ К сводке", "menu:main")], cols=1),
+    )
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    result = await run_backup(context.application)
+    if result is None:
+        text = "💾 Бэкап уже идёт, попробуй через минуту."
+    elif result.ok:
+        kept = len(list_snapshots(backup_dir(context.application.bot_data["config"])))
+        text = (
+            f"💾 Бэкап готов: {result.path.name}\n"
+            f"• {fmt_size(result.size)} за {result.seconds:.1f} с, проверка целостности: ok\n"
+            f"• Хранится снимков: {kept}"
+        )
+    else:
+        text = f"⚠️ Бэкап {result.path.name} не прошёл проверку целостности: {result.message}"
+    await send_or_edit_prompt(context, chat_id, text, build_keyboard([("⬅️ К сводке", "menu:main")], cols=1))
+
+
+async def maintenance_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    report = await run_maintenance(context.application)
+    text = format_maintenance_report(report) if report else "🧹 Идёт бэкап или обслуживание, попробуй через минуту."
+    await send_or_edit_prompt(context, chat_id, text, build_keyboard([("⬅️ К сводке", "menu:main")], cols=1))
+
+
+DBSTATS_METHODS = 12
+DBSTATS_STATEMENTS = 5
+
+
+def build_dbstats_text(profiler: DbProfiler) -> str:
+    methods, slowest = profiler.snapshot()
+    lines = [f"🐢 БД с {profiler.since:%Y-%m-%d %H:%M}, порог {profiler.threshold * 1000:g} мс"]
+    if not methods:
+        lines.append("Пока нет вызовов.")
+    for name, stats in methods[:DBSTATS_METHODS]:
+        lines.append(
+            f"• {name}: {stats.calls}× ср {stats.total / stats.calls * 1000:.1f} / макс {stats.max * 1000:.1f} мс"
+            + (f", ждал lock {stats.lock_wait * 1000:.0f} мс" if stats.lock_wait >= 0.001 else "")
+        )
+    if slowest:
+        lines.append("")
+        lines.append("Самые медленные запросы:")
+        for item in slowest[:DBSTATS_STATEMENTS]:
+            lines.append(f"• {item.seconds * 1000:.0f} мс {item.method} ({item.at:%d.%m %H:%M}): {shorten(item.sql, 160)}")
+    return "\n".join(lines)
+
+
+async def dbstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    profiler: DbProfiler | None = context.application.bot_data.get("db_profiler")
+    if profiler is None:
+        text = "🐢 Замеры БД выключены. Включи DB_PROFILE=1 в .env и перезапусти бота."
+    else:
+        if (context.args or [""])[0] == "reset":
+            profiler.reset()
+        text = build_dbstats_text(profiler)
+    await send_or_edit_prompt(context, chat_id, text, build_keyboard([("⬅️ К сводке", "menu:main")], cols=1))
+
+
+async def finish_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, capture: ProfileCapture, seconds: int) -> None:
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        report = capture.stop()
+        context.application.bot_data.pop("profile_capture", None)
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=report.encode("utf-8"),
+        filename=f"profile-{capture.started_at:%Y%m%d-%H%M%S}.txt",
+        caption=f"⏱ Профиль за {seconds} с" + (" + память" if capture.memory else ""),
+    )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    try:
+        seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        text = f"⏱ Формат: /profile <секунды 1–{PROFILE_MAX_SECONDS}> [mem]"
+    elif context.application.bot_data.get("profile_capture") is not None:
+        text = "⏱ Профилирование уже идёт, дождись отчёта."
+    else:
+        capture = ProfileCapture(memory="mem" in args[1:])
+        capture.start()
+        context.application.bot_data["profile_capture"] = capture
+        context.application.create_task(finish_profile(context, chat_id, capture, seconds))
+        text = f"⏱ Профилирую {seconds} с" + (" + память" if capture.memory else "") + "… Отчёт придёт файлом."
+    await send_or_edit_prompt(context, chat_id, text, build_keyboard([("⬅️ К сводке", "menu:main")], cols=1))
+
+
+async def food_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    query_text = " ".join(context.args or []).strip()
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    if not query_text:
+        context.user_data.clear()
+        context.user_data["expect"] = "food_search"
+        await send_or_edit_prompt(
+            context,
+            chat_id,
+            "Что ищем? Можно с опечатками.",
+            build_keyboard([("⬅️ Назад", "menu:food")], cols=1),
+        )
+        return
+    text, keyboard = build_food_search_view(context, query_text)
+    await send_or_edit_prompt(context, chat_id, text, keyboard)
+
+
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(context, update.effective_user.id if update.effective_user else None):
+        return
+    if update.message is None:
+        return
+    chat_id = update.effective_chat.id
+    query_text = " ".join(context.args or []).strip()
+    await safe_delete_message(context.bot, chat_id, update.message.message_id)
+    context.user_data.clear()
+    if not query_text:
+        context.user_data["expect"] = "find_query"
+        await send_or_edit_prompt(
+            context,
+            chat_id,
+            "Что найти в отзывах, сожалениях и комментариях?",
+            build_keyboard([("⬅️ Назад", "menu:main")], cols=1),
+        )
+        return
+    context.user_data["find_query"] = query_text
+    text, keyboard = build_find_view(context, query_text, 0)
+    await send_or_edit_prompt(context, chat_id, text, keyboard)
+
+
 async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not is_authorized(context, update.effective_user.id if update.effective_user else None):
         return
@@ -3598,14 +4455,40 @@ async def sync_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await render_summary(context, update.effective_chat.id, date_str)
 
 
-def start_sync_http_server(db: Database, cfg) -> ThreadingHTTPServer | None:
+def update_route(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """Route name for traces: ``cb:<prefix>``, ``/<command>`` or ``text:<expected input>``.
+
+    Callback data keeps its first two parts; parts with digits (dates, ids, pages) become ``*``.
+    """
+    if update.callback_query is not None:
+        parts = (update.callback_query.data or "").split(":")[:2]
+        return "cb:" + ":".join("*" if any(ch.isdigit() for ch in part) else part for part in parts)
+    text = update.message.text if update.message else None
+    if text and text.startswith("/"):
+        return text.split()[0].split("@")[0]
+    expect = (context.user_data or {}).get("expect")
+    return f"text:{expect or '-'}"
+
+
+def start_sync_http_server(
+    db: Database,
+    cfg,
+    tracer: Tracer | None = None,
+    webhook: Callable[[dict], None] | None = None,
+) -> ThreadingHTTPServer | None:
+    """/health, /metrics and /sync; with ``webhook`` also Telegram updates on the WEBHOOK_URL path.
+
+    ``webhook`` gets each update as parsed JSON, in a server thread.
+    """
     token = (cfg.sync_http_token or "").strip()
-    if not token:
+    if not token and webhook is None:
         LOGGER.info("Sync HTTP disabled (SYNC_HTTP_TOKEN not set).")
         return None
 
     host = cfg.sync_http_host or "0.0.0.0"
     port = int(cfg.sync_http_port or 8088)
+    webhook_path = urlsplit(cfg.webhook_url).path or "/telegram"
+    webhook_secret = (cfg.webhook_secret or "").encode("utf-8")
 
     class SyncHandler(BaseHTTPRequestHandler):
         server_version = "LifeOSSync/1.0"
@@ -3635,34 +4518,68 @@ def start_sync_http_server(db: Database, cfg) -> ThreadingHTTPServer | None:
             if path in {"/", "/health"}:
                 self._send_json(200, {"ok": True})
                 return
-            self._send_json(404, {"ok": False, "error": "not_found"})
-
-        def do_POST(self) -> None:
-            path = self.path.split("?", 1)[0]
-            if path != "/sync":
-                self._send_json(404, {"ok": False, "error": "not_found"})
-                return
-
-            if self._get_token() != token:
-                self._send_json(401, {"ok": False, "error": "unauthorized"})
+            if path == "/metrics" and tracer is not None and token:
+                if self._get_token() != token:
+                    self._send_json(401, {"ok": False, "error": "unauthorized"})
+                    return
+                body = tracer.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
                 return
+            self._send_json(404, {"ok": False, "error": "not_found"})
 
+        def _read_json(self):
             try:
                 length = int(self.headers.get("Content-Length", "0"))
             except ValueError:
                 length = 0
             if length <= 0 or length > 1024 * 1024:
                 self._send_json(400, {"ok": False, "error": "invalid_body"})
-                return
-
+                return None
             raw = self.rfile.read(length)
             try:
                 payload = json.loads(raw.decode("utf-8"))
             except Exception:
                 self._send_json(400, {"ok": False, "error": "bad_json"})
-                return
+                return None
             if not isinstance(payload, dict):
                 self._send_json(400, {"ok": False, "error": "bad_payload"})
+                return None
+            return payload
+
+        def _handle_webhook(self) -> None:
+            secret = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode("utf-8")
+            if not hmac.compare_digest(secret, webhook_secret):
+                self._send_json(401, {"ok": False, "error": "unauthorized"})
+                return
+            update = self._read_json()
+            if update is None:
+                return
+            if "update_id" not in update:
+                self._send_json(400, {"ok": False, "error": "bad_payload"})
+                return
+            # Answer at once: Telegram waits for the response before sending the next update.
+            webhook(update)
+            self._send_json(200, {"ok": True})
+
+        def do_POST(self) -> None:
+            path = self.path.split("?", 1)[0]
+            if webhook is not None and path == webhook_path:
+                self._handle_webhook()
+                return
+            if path != "/sync" or not token:
+                self._send_json(404, {"ok": False, "error": "not_found"})
+                return
+
+            if self._get_token() != token:
+                self._send_json(401, {"ok": False, "error": "unauthorized"})
+                return
+
+            payload = self._read_json()
+            if payload is None:
                 return
 
             try:
@@ -3688,6 +4605,47 @@ def start_sync_http_server(db: Database, cfg) -> ThreadingHTTPServer | None:
     return server
 
 
+async def start_webhook(app: Application, config, db: Database) -> ThreadingHTTPServer:
+    """Serve Telegram updates on the sync HTTP server and point Telegram at WEBHOOK_URL.
+
+    The application must be started; updates go into its ``update_queue`` like polled ones.
+    """
+    loop = asyncio.get_running_loop()
+
+    def enqueue(data: dict) -> None:
+        app.update_queue.put_nowait(Update.de_json(data, app.bot))
+
+    def feed(data: dict) -> None:
+        loop.call_soon_threadsafe(enqueue, data)
+
+    server = start_sync_http_server(db, config, app.bot_data["tracer"], webhook=feed)
+    await app.bot.set_webhook(config.webhook_url, secret_token=config.webhook_secret, allowed_updates=Update.ALL_TYPES)
+    LOGGER.info("Webhook set to %s", config.webhook_url)
+    return server
+
+
+async def run_webhook(app: Application, config, db: Database) -> None:
+    """Serve the webhook until SIGINT/SIGTERM, then stop the application like ``run_polling`` does."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: only Ctrl+C, via KeyboardInterrupt.
+            pass
+    async with app:
+        await app.start()
+        server = await start_webhook(app, config, db)
+        try:
+            await stop.wait()
+            LOGGER.info("Stopping webhook mode")
+        finally:
+            server.shutdown()
+            server.server_close()
+            await app.stop()
+
+
 def main() -> None:
     config = load_config()
     db_path = Path(config.db_path)
@@ -3696,34 +4654,86 @@ def main() -> None:
     db = Database(str(db_path))
     db.init_schema()
     db.seed_from_csv(str(BASE_DIR / "data/food_items.csv"), str(BASE_DIR / "data/portions.csv"))
-
-    app = ApplicationBuilder().token(config.telegram_token).build()
-    app.bot_data["db"] = db
-    app.bot_data["config"] = config
-    app.bot_data["allowed_user_id"] = config.allowed_user_id
-    app.bot_data["quotes"] = load_quotes(QUOTE_FILE)
-    app.bot_data["quote_deck"] = []
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("export", export_command))
-    app.add_handler(CommandHandler("sync", sync_command))
-    app.add_handler(CommandHandler("static", static_command))
-    app.add_handler(CommandHandler("quote", quote_command))
-    app.add_handler(CallbackQueryHandler(handle_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    app.add_error_handler(handle_error)
-    schedule_quote_jobs(app, config)
+    app = build_application(config, db)
 
     LOGGER.info("Bot started")
     if sys.platform.startswith("win"):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    sync_server = start_sync_http_server(db, config)
+    if config.telegram_mode == "webhook":
+        # The webhook is left set on exit: Telegram keeps the updates until the bot is back.
+        try:
+            asyncio.run(run_webhook(app, config, db))
+        except KeyboardInterrupt:
+            pass
+        return
+    sync_server = start_sync_http_server(db, config, app.bot_data["tracer"])
     try:
+        # Polling removes a webhook left from webhook mode.
         app.run_polling()
     finally:
         if sync_server:
             sync_server.shutdown()
 
 
+def build_application(config, db: Database) -> Application:
+    """The bot with all handlers and jobs, talking to ``config.telegram_api_url`` when set."""
+    request = TracingRequest(connection_pool_size=256)
+    outbound = OutboundLimiter(config.tg_rate_global, config.tg_rate_chat, config.tg_chat_burst, config.tg_max_retries)
+    builder = ApplicationBuilder().token(config.telegram_token).request(request).rate_limiter(outbound)
+    if config.persistence_interval > 0:
+        builder = builder.persistence(SqlitePersistence(db, config.persistence_interval))
+    if config.telegram_api_url:
+        api_url = config.telegram_api_url.rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    app = builder.build()
+    app.bot_data["db"] = db
+    app.bot_data["outbound"] = outbound
+    if config.db_profile:
+        slow_log = Path(config.db_slow_log) if config.db_slow_log else None
+        if slow_log is not None and not slow_log.is_absolute():
+            slow_log = BASE_DIR / slow_log
+        profiler = DbProfiler(config.db_slow_ms / 1000, log_path=slow_log)
+        profiler.instrument(db)
+        app.bot_data["db_profiler"] = profiler
+        LOGGER.info("DB profiling on: slow threshold %sms, log %s", config.db_slow_ms, slow_log)
+    tracer = Tracer(update_route, config.trace_slow_ms / 1000)
+    tracer.instrument(db)
+    app.bot_data["tracer"] = tracer
+    app.bot_data["config"] = config
+    app.bot_data["allowed_user_id"] = config.allowed_user_id
+    app.bot_data["quotes"] = load_quotes(QUOTE_FILE)
+    app.bot_data["quote_deck"] = []
+    if config.record_dir:
+        record_dir = Path(config.record_dir)
+        if not record_dir.is_absolute():
+            record_dir = BASE_DIR / record_dir
+        recorder = SessionRecorder(record_dir, db.path, user_id=config.allowed_user_id)
+        request.add_listener(recorder.on_api_call)
+        # Group -1 runs before the real handlers and sees every update, handled or not.
+        app.add_handler(TypeHandler(Update, recorder.on_update), group=-1)
+        app.bot_data["recorder"] = recorder
+        LOGGER.info("Recording session to %s", recorder.path)
+
+    app.add_handler(CommandHandler("start", tracer.wrap(start)))
+    app.add_handler(CommandHandler("export", tracer.wrap(export_command)))
+    app.add_handler(CommandHandler("sync", tracer.wrap(sync_command)))
+    app.add_handler(CommandHandler("static", tracer.wrap(static_command)))
+    app.add_handler(CommandHandler("quote", tracer.wrap(quote_command)))
+    app.add_handler(CommandHandler("rescore", tracer.wrap(rescore_command)))
+    app.add_handler(CommandHandler("food", tracer.wrap(food_command)))
+    app.add_handler(CommandHandler("find", tracer.wrap(find_command)))
+    app.add_handler(CommandHandler("backup", tracer.wrap(backup_command)))
+    app.add_handler(CommandHandler("maintenance", tracer.wrap(maintenance_command)))
+    app.add_handler(CommandHandler("dbstats", tracer.wrap(dbstats_command)))
+    app.add_handler(CommandHandler("profile", tracer.wrap(profile_command)))
+    app.add_handler(CallbackQueryHandler(tracer.wrap(handle_callback)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, tracer.wrap(handle_text)))
+    app.add_error_handler(handle_error)
+    schedule_quote_jobs(app, config)
+    schedule_backup_job(app, config)
+    schedule_maintenance_job(app, config)
+    return app
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+BACKUP_PREFIX = "lifeos-"
+BACKUP_SUFFIX = ".db"
+BACKUP_STAMP = "%Y%m%d-%H%M%S"
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+BACKUP_PART_SUFFIX = ".part"
+# A *.part file this old is a copy that was interrupted, not one still being written.
+BACKUP_PART_MAX_AGE = timedelta(hours=1)
+
+
+@dataclass
+class BackupResult:
+    path: Path
+    ok: bool
+    size: int
+    seconds: float
+    message: str = "ok"
+
+
+def snapshot_path(backup_dir: Path, when: datetime) -> Path:
+    return backup_dir / f"{BACKUP_PREFIX}{when.strftime(BACKUP_STAMP)}{BACKUP_SUFFIX}"
+
+
+def snapshot_time(path: Path) -> datetime | None:
+    name = path.name
+    if not name.startswith(BACKUP_PREFIX) or not name.endswith(BACKUP_SUFFIX):
+        return None
+    try:
+        return datetime.strptime(name[len(BACKUP_PREFIX) : -len(BACKUP_SUFFIX)], BACKUP_STAMP)
+    except ValueError:
+        return None
+
+
+def list_snapshots(backup_dir: Path) -> list[tuple[datetime, Path]]:
+    """Verified snapshots in ``backup_dir``, newest first."""
+    if not backup_dir.is_dir():
+        return []
+    found = [(when, path) for path in backup_dir.iterdir() if (when := snapshot_time(path))]
+    return sorted(found, reverse=True)
+
+
+def partial_copies(backup_dir: Path) -> list[Path]:
+    """``*.part`` files of snapshot copies in ``backup_dir``, finished or not."""
+    if not backup_dir.is_dir():
+        return []
+    return sorted(
+        path
+        for path in backup_dir.iterdir()
+        if path.name.endswith(BACKUP_PART_SUFFIX) and snapshot_time(path.with_name(path.name[: -len(BACKUP_PART_SUFFIX)]))
+    )
+
+
+def verify_snapshot(path: Path) -> str:
+    """``"ok"`` or the first problem reported by ``PRAGMA integrity_check``."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    except sqlite3.DatabaseError as exc:
+        return str(exc)
+    finally:
+        conn.close()
+    return "ok" if rows == [("ok",)] else "; ".join(str(row[0]) for row in rows[:5])
+
+
+def make_snapshot(
+    db_path: Path,
+    backup_dir: Path,
+    *,
+    now: datetime | None = None,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    pause: float = BACKUP_STEP_PAUSE,
+) -> BackupResult:
+    """Copy a live database with the SQLite online backup API, then verify the copy.
+
+    Reads through its own connection, ``pages`` pages per step with a short pause in
+    between, so the bot's connection (and its lock) is never blocked for more than a
+    step. The copy is written to ``*.part`` and renamed only after
+    ``PRAGMA integrity_check`` passes; a failed copy is kept as ``*.corrupt``. The
+    ``*.part`` file is removed if the copy itself raises.
+    """
+    started = time.perf_counter()
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    target = snapshot_path(backup_dir, now or datetime.now())
+    partial = target.with_name(target.name + BACKUP_PART_SUFFIX)
+    try:
+        source = sqlite3.connect(db_path)
+        try:
+            dest = sqlite3.connect(partial)
+            try:
+                def progress(status: int, remaining: int, total: int) -> None:
+                    if remaining and pause:
+                        time.sleep(pause)
+
+                source.backup(dest, pages=pages, progress=progress)
+                # The copy inherits WAL mode; switch it back so the snapshot is one self-contained file.
+                dest.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                dest.close()
+        finally:
+            source.close()
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+
+    message = verify_snapshot(partial)
+    if message != "ok":
+        failed = target.with_name(target.name + ".corrupt")
+        partial.replace(failed)
+        return BackupResult(failed, False, failed.stat().st_size, time.perf_counter() - started, message)
+    partial.replace(target)
+    return BackupResult(target, True, target.stat().st_size, time.perf_counter() - started)
+
+
+def prune_snapshots(
+    backup_dir: Path,
+    *,
+    keep_last: int,
+    keep_daily: int,
+    keep_weekly: int,
+    now: datetime | None = None,
+) -> list[Path]:
+    """Delete snapshots outside the retention policy and return them.
+
+    Kept: the ``keep_last`` newest snapshots, the newest one of each of the last
+    ``keep_daily`` days and the newest one of each of the last ``keep_weekly`` ISO weeks.
+    ``*.part`` leftovers of interrupted copies older than ``BACKUP_PART_MAX_AGE`` go too.
+    """
+    now = now or datetime.now()
+    snapshots = list_snapshots(backup_dir)
+    keep = {path for _, path in snapshots[: max(keep_last, 0)]}
+    day_cutoff = (now - timedelta(days=keep_daily)).date()
+    week_cutoff = (now - timedelta(weeks=keep_weekly)).date()
+    seen_days: set = set()
+    seen_weeks: set = set()
+    for when, path in snapshots:
+        day = when.date()
+        week = day.isocalendar()[:2]
+        if day > day_cutoff and day not in seen_days:
+            seen_days.add(day)
+            keep.add(path)
+        if day > week_cutoff and week not in seen_weeks:
+            seen_weeks.add(week)
+            keep.add(path)
+    removed = []
+    for _, path in snapshots:
+        if path not in keep:
+            path.unlink(missing_ok=True)
+            removed.append(path)
+    stale_before = (now - BACKUP_PART_MAX_AGE).timestamp()
+    for path in partial_copies(backup_dir):
+        try:
+            if path.stat().st_mtime < stale_before:
+                path.unlink()
+                removed.append(path)
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Online backup of the LifeOS SQLite database")
+    parser.add_argument("db", type=Path)
+    parser.add_argument("backup_dir", type=Path)
+    parser.add_argument("--verify", action="store_true", help="only check the existing snapshots")
+    args = parser.parse_args()
+    if args.verify:
+        for when, path in list_snapshots(args.backup_dir):
+            print(f"{when:%Y-%m-%d %H:%M:%S}  {path.stat().st_size:>10}  {verify_snapshot(path)}")
+        return
+    result = make_snapshot(args.db, args.backup_dir)
+    print(f"{result.path}  {result.size} bytes  {result.seconds:.2f}s  {result.message}")
+
+
+if __name__ == "__main__":
+    main()
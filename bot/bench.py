@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from app import (
+    BASE_DIR,
+    apply_sync_payload,
+    build_daily_summary,
+    build_export_workbook,
+    build_food_summary,
+    build_stats_summary,
+    day_targets,
+    get_daily_data,
+    get_portion_catalog,
+    load_stats_frame,
+)
+from db import Database
+from food_engine import MACRO_KEYS, PortionCatalog, build_plan, macro_vector, optimize_plan, plan_score, recommend_portions
+from stats_engine import best_streak, current_streak
+from synthetic import generate_history
+
+
+# Benchmark label -> stats period. Labels stay fixed so baseline entries keep matching
+# after New Year; the calendar year is resolved when the case runs.
+STATS_PERIODS = {
+    "week": lambda: "week",
+    "month": lambda: "month",
+    "all": lambda: "all",
+    "last:90": lambda: "last:90",
+    "prev_year": lambda: f"y:{date.today().year - 1}",
+}
+BASELINE_PATH = Path(__file__).with_name("bench_baseline.json")
+CORE_YEARS = 5.0
+# A benchmark regresses when its median is this much slower than the baseline and the
+# difference is above the noise floor.
+REGRESSION_TOLERANCE = 0.25
+NOISE_FLOOR = 0.0005
+
+
+def bench_context(db: Database, export_dir: str | None = None) -> SimpleNamespace:
+    cfg = SimpleNamespace(timezone="Europe/Moscow", export_dir=export_dir or tempfile.gettempdir())
+    application = SimpleNamespace(bot_data={"db": db, "config": cfg})
+    return SimpleNamespace(application=application, user_data={})
+
+
+def timed(fn, rounds: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return min(samples), statistics.median(samples)
+
+
+def bench_stats(years_list: list[float], rounds: int) -> None:
+    print(f"{'years':>6} {'days':>6} {'period':>9} {'min ms':>9} {'median ms':>10}")
+    for years in years_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "bench.db"
+            days = generate_history(db_path, years)["daily"]
+            db = Database(str(db_path))
+            context = bench_context(db)
+            build_stats_summary(context, "all")  # score every day and build the index, like the first open after a deploy
+            for label, period in STATS_PERIODS.items():
+                best, median = timed(lambda: build_stats_summary(context, period()), rounds)
+                print(f"{years:>6g} {days:>6} {label:>9} {best * 1000:>9.1f} {median * 1000:>10.1f}")
+            dates = db.get_daily_dates()
+            frame = load_stats_frame(db, dates[0], dates[-1])
+            engine_cases = {
+                "pctl": lambda: [frame.percentile(name, [10, 50, 90]) for name in ("sleep", "steps", "kcal", "expense")],
+                "streaks": lambda: [(best_streak(active), current_streak(active)) for active in map(frame.positive, ("shots", "study"))],
+            }
+            for label, fn in engine_cases.items():
+                best, median = timed(fn, rounds)
+                print(f"{years:>6g} {days:>6} {label:>9} {best * 1000:>9.1f} {median * 1000:>10.1f}")
+            db.close()
+
+
+def shipped_portions() -> list[dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(str(Path(tmp) / "catalog.db"))
+        db.init_schema()
+        db.seed_from_csv(str(BASE_DIR / "data/food_items.csv"), str(BASE_DIR / "data/portions.csv"))
+        portions = db.list_portions()
+        db.close()
+    return portions
+
+
+def synthetic_portions(base: list[dict], size: int, *, seed: int = 42) -> list[dict]:
+    """``size`` portions of made-up products with macro densities jittered from ``base``."""
+    rnd = random.Random(seed)
+    portions = []
+    for i in range(size):
+        source = rnd.choice(base)
+        scale = rnd.uniform(0.5, 2.0)
+        macros = {key: source["macros"][key] * scale * rnd.uniform(0.8, 1.2) for key in MACRO_KEYS}
+        product = f"{source['product']} #{i // 3}"
+        portions.append(
+            {"code": f"SYN_{i}", "product": product, "label": product, "grams": source["grams"] * scale, "macros": macros}
+        )
+    return portions
+
+
+def in_ranges(vec, targets: dict) -> bool:
+    return all(targets[key][0] <= vec[i] <= targets[key][1] for i, key in enumerate(MACRO_KEYS))
+
+
+def bench_meal(cases: int, synthetic_size: int) -> None:
+    base = shipped_portions()
+    catalogs = [("shipped", base), (f"synth {synthetic_size}", synthetic_portions(base, synthetic_size))]
+    print(f"{'catalog':>12} {'planner':>7} {'score':>9} {'in range':>9} {'median ms':>10} {'max ms':>8} {'complete':>8}")
+    for name, portions in catalogs:
+        catalog = PortionCatalog.from_portions(portions)
+        rnd = random.Random(7)
+        states = []
+        for _ in range(cases):
+            targets = day_targets(rnd.choice(["Верх", "Отдых"]))
+            share = rnd.uniform(0.0, 0.8)
+            current = {key: (targets[key][0] + targets[key][1]) / 2 * share * rnd.uniform(0.6, 1.4) for key in MACRO_KEYS}
+            eaten = {p["product"] for p in rnd.sample(portions, 2)}
+            states.append((targets, current, eaten))
+        results: dict[str, list] = {"greedy": [], "b&b": []}
+        for targets, current, eaten in states:
+            target_mid = {key: (targets[key][0] + targets[key][1]) / 2 for key in MACRO_KEYS}
+            target = macro_vector(target_mid)
+            started = time.perf_counter()
+            greedy = build_plan(current, target_mid, catalog, eaten_products=eaten, max_steps=4)
+            elapsed = time.perf_counter() - started
+            vec = macro_vector(current) + sum((macro_vector(p["macros"]) for p in greedy), macro_vector({}))
+            results["greedy"].append((plan_score(vec, target), in_ranges(vec, targets), elapsed, True))
+
+            started = time.perf_counter()
+            plan = optimize_plan(current, target_mid, catalog, eaten_products=eaten, max_items=4)
+            elapsed = time.perf_counter() - started
+            vec = macro_vector(current) + sum((macro_vector(p["macros"]) * qty for p, qty in plan.items), macro_vector({}))
+            results["b&b"].append((plan_score(vec, target), in_ranges(vec, targets), elapsed, plan.complete))
+        for planner, rows in results.items():
+            scores = [row[0] for row in rows]
+            hits = sum(row[1] for row in rows)
+            times = [row[2] * 1000 for row in rows]
+            complete = sum(row[3] for row in rows)
+            print(
+                f"{name:>12} {planner:>7} {statistics.mean(scores):>9.0f} {hits / len(rows):>8.0%} "
+                f"{statistics.median(times):>10.2f} {max(times):>8.2f} {complete / len(rows):>8.0%}"
+            )
+
+
+def measure(fn, rounds: int, warmup: int = 1) -> dict[str, float]:
+    """pytest-benchmark style statistics of ``fn()`` over ``rounds`` timed runs, in seconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {
+        "min": min(samples),
+        "max": max(samples),
+        "mean": statistics.mean(samples),
+        "median": statistics.median(samples),
+        "stddev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+    }
+
+
+def core_cases(context: SimpleNamespace, loop: asyncio.AbstractEventLoop) -> list[tuple[str, object]]:
+    db = context.application.bot_data["db"]
+    cfg = context.application.bot_data["config"]
+    today = db.get_state("active_day")
+    dates = db.get_daily_dates()
+    middle = dates[len(dates) // 2]
+    catalog = get_portion_catalog(context)
+    portions = catalog.portions
+    targets = day_targets("Верх")
+    target_mid = {key: (targets[key][0] + targets[key][1]) / 2 for key in MACRO_KEYS}
+    current = {key: value * 0.45 for key, value in target_mid.items()}
+    eaten = {portions[0]["product"], portions[len(portions) // 2]["product"]}
+    sync_payload = {
+        "date": today,
+        "steps": 9000,
+        "active_kcal": 420,
+        "weight": 74.2,
+        "sleep_hours": 7.4,
+        "food": {"kcal": 1800, "protein": 130, "fat": 60, "carb": 170},
+    }
+    cases: list[tuple[str, object]] = [
+        ("get_daily_data[today]", lambda: get_daily_data(context, today)),
+        ("get_daily_data[history]", lambda: get_daily_data(context, middle)),
+        ("build_daily_summary", lambda: loop.run_until_complete(build_daily_summary(context, today))),
+        ("build_food_summary", lambda: loop.run_until_complete(build_food_summary(context, today))),
+    ]
+    for label, period in STATS_PERIODS.items():
+        cases.append((f"build_stats_summary[{label}]", lambda period=period: build_stats_summary(context, period())))
+    cases += [
+        ("build_export_workbook", lambda: build_export_workbook(context)),
+        ("apply_sync_payload", lambda: apply_sync_payload(db, cfg, sync_payload)),
+        ("recommend_portions", lambda: recommend_portions(current, target_mid, catalog, eaten_products=eaten, max_items=3)),
+        ("build_plan", lambda: build_plan(current, target_mid, catalog, eaten_products=eaten, max_steps=4)),
+    ]
+    return cases
+
+
+def compare_to_baseline(results: dict[str, dict], baseline: dict, tolerance: float) -> list[str]:
+    """Names of benchmarks whose median regressed against ``baseline``."""
+    regressed = []
+    print(f"{'benchmark':<34} {'median ms':>10} {'baseline':>10} {'change':>8}")
+    for name, stats in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            print(f"{name:<34} {stats['median'] * 1000:>10.2f} {'—':>10} {'new':>8}")
+            continue
+        change = stats["median"] / base["median"] - 1 if base["median"] else 0.0
+        slow = change > tolerance and stats["median"] - base["median"] > NOISE_FLOOR
+        if slow:
+            regressed.append(name)
+        print(
+            f"{name:<34} {stats['median'] * 1000:>10.2f} {base['median'] * 1000:>10.2f} "
+            f"{change:>+7.0%}{' !' if slow else ''}"
+        )
+    return regressed
+
+
+def bench_core(years: float, rounds: int, *, save: Path | None, compare: Path | None, tolerance: float) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        counts = generate_history(db_path, years)
+        print("  ".join(f"{table}: {rows}" for table, rows in counts.items()))
+        db = Database(str(db_path))
+        context = bench_context(db, tmp)
+        loop = asyncio.new_event_loop()
+        # Score every day and build the stats index, like the first open after a deploy.
+        build_stats_summary(context, "all")
+        results = {}
+        try:
+            for name, fn in core_cases(context, loop):
+                results[name] = measure(fn, rounds)
+        finally:
+            loop.close()
+            db.close()
+
+    if compare is not None:
+        baseline = json.loads(compare.read_text(encoding="utf-8"))
+        if baseline.get("meta", {}).get("years") != years:
+            print(f"warning: baseline was recorded with --years {baseline.get('meta', {}).get('years')}", file=sys.stderr)
+        regressed = compare_to_baseline(results, baseline, tolerance)
+    else:
+        regressed = []
+        print(f"{'benchmark':<34} {'min ms':>9} {'median ms':>10} {'stddev':>8}")
+        for name, stats in results.items():
+            print(f"{name:<34} {stats['min'] * 1000:>9.2f} {stats['median'] * 1000:>10.2f} {stats['stddev'] * 1000:>8.2f}")
+    if save is not None:
+        meta = {
+            "years": years,
+            "rows": counts,
+            "rounds": rounds,
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        save.write_text(json.dumps({"meta": meta, "benchmarks": results}, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"baseline saved to {save}")
+    if regressed:
+        print(f"regressions (> {tolerance:.0%}): {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LifeOS benchmarks on synthetic data")
+    parser.add_argument("suite", nargs="?", choices=["stats", "meal", "core"], default="stats")
+    parser.add_argument("--years", type=float, nargs="+", help="default: 1 5 20 (stats), 5 (core)")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--cases", type=int, default=200, help="meal: random day states per catalog")
+    parser.add_argument("--synthetic", type=int, default=5000, help="meal: size of the synthetic catalog")
+    parser.add_argument("--save", type=Path, nargs="?", const=BASELINE_PATH, help="core: write results as the JSON baseline")
+    parser.add_argument("--compare", type=Path, nargs="?", const=BASELINE_PATH, help="core: compare with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="core: allowed median slowdown")
+    args = parser.parse_args()
+    if args.suite == "core":
+        years = args.years[0] if args.years else CORE_YEARS
+        sys.exit(bench_core(years, args.rounds, save=args.save, compare=args.compare, tolerance=args.tolerance))
+    if args.suite == "meal":
+        bench_meal(args.cases, args.synthetic)
+    else:
+        bench_stats(args.years or [1, 5, 20], args.rounds)
+
+
+if __name__ == "__main__":
+    main()
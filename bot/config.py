@@ -20,6 +20,26 @@ class Config:
     sync_http_host: str
     sync_http_port: int
     sync_http_token: str
+    backup_dir: str = "backups"
+    backup_interval_hours: float = 6.0
+    backup_keep_last: int = 4
+    backup_keep_daily: int = 7
+    backup_keep_weekly: int = 8
+    maintenance_time: str = "04:30"
+    db_profile: bool = False
+    db_slow_ms: float = 50.0
+    db_slow_log: str = "logs/slow_sql.log"
+    trace_slow_ms: float = 700.0
+    telegram_api_url: str = ""
+    record_dir: str = ""
+    tg_rate_global: float = 30.0
+    tg_rate_chat: float = 1.0
+    tg_chat_burst: int = 20
+    tg_max_retries: int = 3
+    telegram_mode: str = "polling"
+    webhook_url: str = ""
+    webhook_secret: str = ""
+    persistence_interval: float = 60.0
 
 
 def load_config() -> Config:
@@ -34,8 +54,34 @@ def load_config() -> Config:
     sync_http_port_raw = os.getenv("SYNC_HTTP_PORT", "8088").strip()
     sync_http_port = int(sync_http_port_raw) if sync_http_port_raw else 8088
     sync_http_token = os.getenv("SYNC_HTTP_TOKEN", "").strip()
+    backup_dir = os.getenv("BACKUP_DIR", "backups").strip() or "backups"
+    backup_interval_raw = os.getenv("BACKUP_INTERVAL_HOURS", "6").strip()
+    backup_interval_hours = float(backup_interval_raw) if backup_interval_raw else 6.0
+    backup_keep_last = int(os.getenv("BACKUP_KEEP_LAST", "4").strip() or 4)
+    backup_keep_daily = int(os.getenv("BACKUP_KEEP_DAILY", "7").strip() or 7)
+    backup_keep_weekly = int(os.getenv("BACKUP_KEEP_WEEKLY", "8").strip() or 8)
+    maintenance_time = os.getenv("MAINTENANCE_TIME", "04:30").strip()
+    db_profile = os.getenv("DB_PROFILE", "").strip().lower() in {"1", "true", "yes", "on"}
+    db_slow_ms = float(os.getenv("DB_SLOW_MS", "50").strip() or 50)
+    db_slow_log = os.getenv("DB_SLOW_LOG", "logs/slow_sql.log").strip()
+    trace_slow_ms = float(os.getenv("TRACE_SLOW_MS", "700").strip() or 700)
+    telegram_api_url = os.getenv("TELEGRAM_API_URL", "").strip()
+    record_dir = os.getenv("RECORD_DIR", "").strip()
+    tg_rate_global = float(os.getenv("TG_RATE_GLOBAL", "30").strip() or 30)
+    tg_rate_chat = float(os.getenv("TG_RATE_CHAT", "1").strip() or 1)
+    tg_chat_burst = int(os.getenv("TG_CHAT_BURST", "20").strip() or 20)
+    tg_max_retries = int(os.getenv("TG_MAX_RETRIES", "3").strip() or 3)
+    telegram_mode = os.getenv("TELEGRAM_MODE", "polling").strip().lower() or "polling"
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip()
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip()
+    persistence_interval = float(os.getenv("PERSISTENCE_INTERVAL", "60").strip() or 60)
 
-    missing = [name for name, value in {"TELEGRAM_BOT_TOKEN": telegram_token}.items() if not value]
+    if telegram_mode not in {"polling", "webhook"}:
+        raise ValueError(f"TELEGRAM_MODE must be polling or webhook, got {telegram_mode!r}")
+    required = {"TELEGRAM_BOT_TOKEN": telegram_token}
+    if telegram_mode == "webhook":
+        required.update({"WEBHOOK_URL": webhook_url, "WEBHOOK_SECRET": webhook_secret})
+    missing = [name for name, value in required.items() if not value]
     if missing:
         raise ValueError(f"Missing env vars: {', '.join(missing)}")
 
@@ -49,4 +95,24 @@ def load_config() -> Config:
         sync_http_host=sync_http_host,
         sync_http_port=sync_http_port,
         sync_http_token=sync_http_token,
+        backup_dir=backup_dir,
+        backup_interval_hours=backup_interval_hours,
+        backup_keep_last=backup_keep_last,
+        backup_keep_daily=backup_keep_daily,
+        backup_keep_weekly=backup_keep_weekly,
+        maintenance_time=maintenance_time,
+        db_profile=db_profile,
+        db_slow_ms=db_slow_ms,
+        db_slow_log=db_slow_log,
+        trace_slow_ms=trace_slow_ms,
+        telegram_api_url=telegram_api_url,
+        record_dir=record_dir,
+        tg_rate_global=tg_rate_global,
+        tg_rate_chat=tg_rate_chat,
+        tg_chat_burst=tg_chat_burst,
+        tg_max_retries=tg_max_retries,
+        telegram_mode=telegram_mode,
+        webhook_url=webhook_url,
+        webhook_secret=webhook_secret,
+        persistence_interval=persistence_interval,
     )
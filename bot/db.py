@@ -3,9 +3,201 @@
 import csv
 import sqlite3
 import threading
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, replace
+from datetime import date
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Any, Callable, Iterable, Optional
+
+from food_search import fts_query, normalize, similarity, trigrams
+from habit_bits import HabitBitmap
+from stats_index import RunIndex
+
+
+CATALOG_VERSION_KEY = "catalog_version"
+
+# Trigram full-text index over product names and "product description" portion labels,
+# kept in sync by triggers. rowid = 2 * food_items.id for products, 2 * portion_search_ids.id + 1
+# for portions: portions is keyed by its TEXT code, and its implicit rowid may change on VACUUM.
+FOOD_SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS portion_search_ids (
+    id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL UNIQUE
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS food_search USING fts5(
+    text, kind UNINDEXED, ref UNINDEXED, tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS food_items_search_ai AFTER INSERT ON food_items BEGIN
+    INSERT INTO food_search (rowid, text, kind, ref) VALUES (new.id * 2, new.name, 'item', new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS food_items_search_au AFTER UPDATE OF name ON food_items BEGIN
+    UPDATE food_search SET text = new.name WHERE rowid = new.id * 2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS food_items_search_ad AFTER DELETE ON food_items BEGIN
+    DELETE FROM food_search WHERE rowid = old.id * 2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS portions_search_ai AFTER INSERT ON portions BEGIN
+    INSERT OR IGNORE INTO portion_search_ids (code) VALUES (new.code);
+    INSERT INTO food_search (rowid, text, kind, ref)
+    SELECT ps.id * 2 + 1, fi.name || ' ' || COALESCE(new.description, ''), 'portion', new.code
+    FROM food_items fi JOIN portion_search_ids ps ON ps.code = new.code
+    WHERE fi.id = new.item_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS portions_search_ad AFTER DELETE ON portions BEGIN
+    DELETE FROM food_search WHERE rowid = (SELECT id * 2 + 1 FROM portion_search_ids WHERE code = old.code);
+    DELETE FROM portion_search_ids WHERE code = old.code;
+END;
+"""
+
+
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_LOOKUP_BATCH = 500
+
+
+@dataclass
+class FoodRecord:
+    """One product per 100 g, as produced by ``food_import``."""
+
+    name: str
+    protein: float
+    fat: float
+    carb: float
+    kcal: float
+    barcode: str | None = None
+
+
+@dataclass
+class ImportStats:
+    processed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+
+
+# Resolved at insert time, so history keeps the grams and macros the portion had then.
+FOOD_LOG_SNAPSHOT = (
+    ("product", "TEXT"),
+    ("label", "TEXT"),
+    ("grams", "REAL"),
+    ("kcal", "REAL"),
+    ("protein", "REAL"),
+    ("fat", "REAL"),
+    ("carb", "REAL"),
+)
+FOOD_LOG_INSERT = (
+    "INSERT INTO food_log (date, time, portion_code, quantity, comment, "
+    + ", ".join(column for column, _ in FOOD_LOG_SNAPSHOT)
+    + ") VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
+)
+
+
+def _food_log_snapshot(code: str, quantity: float, portion: tuple | None) -> tuple:
+    """Values for ``FOOD_LOG_SNAPSHOT``; unknown portions keep the code as label and no macros."""
+    if portion is None:
+        return (None, code, 0.0, None, None, None, None)
+    product, description, grams, kcal_100, protein_100, fat_100, carb_100 = portion
+    label = f"{product} ({description})" if description else product
+    return (
+        product,
+        label,
+        grams * (quantity or 0),
+        quantity * grams * kcal_100 / 100.0,
+        quantity * grams * protein_100 / 100.0,
+        quantity * grams * fat_100 / 100.0,
+        quantity * grams * carb_100 / 100.0,
+    )
+
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _nocase(text: str) -> str:
+    # SQLite's NOCASE folds ASCII letters only.
+    return text.translate(_ASCII_LOWER)
+
+
+def _batched(items: list, size: int) -> Iterable[list]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+# Full-text index over journal text: daily review/regret/code topic, session
+# subcategory + comment and expense comments. rowid = 8 * source id + JOURNAL_KINDS index,
+# where the id of a daily row is its julian day number (stable across VACUUM, unlike rowid).
+JOURNAL_DAILY_COLUMNS = ("review", "regret", "code_topic")
+JOURNAL_KINDS = (*JOURNAL_DAILY_COLUMNS, "session", "expense")
+JOURNAL_DAY_ID = "CAST(julianday({row}date) AS INTEGER)"
+JOURNAL_SESSION_TEXT = "TRIM(COALESCE({row}.subcategory, '') || ' ' || COALESCE({row}.comment, ''))"
+
+
+def _journal_search_schema() -> str:
+    statements = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS journal_search USING fts5(
+            text, date UNINDEXED, kind UNINDEXED, label UNINDEXED,
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """
+    ]
+    new_day, old_day = JOURNAL_DAY_ID.format(row="new."), JOURNAL_DAY_ID.format(row="old.")
+    for kind, column in enumerate(JOURNAL_DAILY_COLUMNS):
+        insert = (
+            f"INSERT INTO journal_search (rowid, text, date, kind) "
+            f"SELECT {new_day} * 8 + {kind}, new.{column}, new.date, '{column}' WHERE COALESCE(new.{column}, '') <> '';"
+        )
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS daily_journal_{column}_ai AFTER INSERT ON daily BEGIN {insert} END;")
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS daily_journal_{column}_au AFTER UPDATE OF {column}, date ON daily BEGIN "
+            f"DELETE FROM journal_search WHERE rowid = {old_day} * 8 + {kind}; {insert} END;"
+        )
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS daily_journal_{column}_ad AFTER DELETE ON daily BEGIN "
+            f"DELETE FROM journal_search WHERE rowid = {old_day} * 8 + {kind}; END;"
+        )
+    for table, kind_name, text in (
+        ("session_log", "session", JOURNAL_SESSION_TEXT.format(row="new")),
+        ("expense_log", "expense", "new.comment"),
+    ):
+        kind = JOURNAL_KINDS.index(kind_name)
+        insert = (
+            f"INSERT INTO journal_search (rowid, text, date, kind, label) "
+            f"SELECT new.id * 8 + {kind}, {text}, new.date, '{kind_name}', new.category WHERE COALESCE({text}, '') <> '';"
+        )
+        delete = f"DELETE FROM journal_search WHERE rowid = old.id * 8 + {kind};"
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {table}_journal_ai AFTER INSERT ON {table} BEGIN {insert} END;")
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {table}_journal_au AFTER UPDATE ON {table} BEGIN {delete} {insert} END;")
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {table}_journal_ad AFTER DELETE ON {table} BEGIN {delete} END;")
+    return "\n".join(statements)
+
+
+def _journal_match(query: str) -> str | None:
+    """FTS5 expression requiring every word of ``query`` as a prefix (so word forms match)."""
+    words = normalize(query).split()
+    if not words:
+        return None
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+AUTO_VACUUM_INCREMENTAL = 2
+VACUUM_STEP_PAGES = 1000
+ANALYSIS_LIMIT = 1000
+
+
+@dataclass
+class MaintenanceReport:
+    db_before: int = 0
+    wal_before: int = 0
+    db_after: int = 0
+    wal_after: int = 0
+    free_pages: int = 0
+    checkpoint_busy: bool = False
+    seconds: float = 0.0
 
 
 @dataclass
@@ -18,17 +210,48 @@ class Database:
         self._path = Path(db_path)
         self._path.parent.mkdir(parents=True, exist_ok=True)
         self._lock = threading.Lock()
+        self._change_listeners: list[Callable[[str], None]] = []
+        self._habit_bitmaps: dict[int, tuple[str, HabitBitmap]] | None = None
+        self._habit_runs: dict[int, RunIndex] | None = None
+        self._food_fts = False
+        self._journal_fts = False
         self._conn = sqlite3.connect(self._path, check_same_thread=False)
         self._conn.row_factory = sqlite3.Row
         self._conn.execute("PRAGMA foreign_keys = ON")
+        # Must come before journal_mode: switching to WAL writes the header of a new file,
+        # after which auto_vacuum only changes through a full VACUUM.
+        self._conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
         self._conn.execute("PRAGMA journal_mode = WAL")
         self._conn.execute("PRAGMA synchronous = NORMAL")
 
     def close(self) -> None:
         self._conn.close()
 
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def add_change_listener(self, callback: Callable[[str], None]) -> None:
+        """Register ``callback(date_str)`` for every write that changes a day.
+
+        Called with the lock held, so listeners must only record the date.
+        """
+        self._change_listeners.append(callback)
+
+    def install_profiler(self, wrap_lock: Callable[[Any], Any], on_statement: Callable[[str], None]) -> None:
+        """Hook a profiler in: ``wrap_lock(lock)`` replaces the connection lock and
+        ``on_statement(sql)`` sees every statement. Call before other threads use the database.
+        """
+        self._lock = wrap_lock(self._lock)
+        self._conn.set_trace_callback(on_statement)
+
+    def _notify_changed(self, date_str: str) -> None:
+        for callback in self._change_listeners:
+            callback(date_str)
+
     def init_schema(self) -> None:
         with self._lock:
+            self._enable_incremental_vacuum()
             cur = self._conn.cursor()
             cur.executescript(
                 """
@@ -129,6 +352,26 @@ class Database:
                     key TEXT PRIMARY KEY,
                     value TEXT
                 );
+
+                CREATE TABLE IF NOT EXISTS ptb_data (
+                    kind TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (kind, id)
+                );
+
+                CREATE TABLE IF NOT EXISTS meal_templates (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS meal_template_items (
+                    template_id INTEGER NOT NULL REFERENCES meal_templates(id) ON DELETE CASCADE,
+                    position INTEGER NOT NULL,
+                    portion_code TEXT NOT NULL REFERENCES portions(code) ON DELETE CASCADE,
+                    quantity REAL NOT NULL,
+                    PRIMARY KEY (template_id, position)
+                );
                 """
             )
             self._conn.commit()
@@ -150,8 +393,200 @@ class Database:
                     "shots_count": "INTEGER",
                     "nap_hours": "REAL",
                     "day_status": "TEXT",
+                    "rev": "INTEGER",
+                    "quality": "INTEGER",
+                    "completion_status": "TEXT",
+                    "missing": "TEXT",
+                    "score_version": "INTEGER",
+                    "score_rev": "INTEGER",
                 },
             )
+            self._ensure_columns("habits", {"bitmap": "BLOB", "bitmap_start": "TEXT"})
+            self._backfill_habit_bitmaps()
+            self._ensure_columns("food_items", {"barcode": "TEXT"})
+            self._ensure_columns("food_log", {column: col_type for column, col_type in FOOD_LOG_SNAPSHOT})
+            self._backfill_food_log_snapshots()
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_food_items_name_nocase ON food_items(name COLLATE NOCASE)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_portions_item ON portions(item_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_food_log_date ON food_log(date)")
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_food_items_barcode ON food_items(barcode) WHERE barcode IS NOT NULL"
+            )
+            self._conn.commit()
+            self._init_food_search()
+            self._init_journal_search()
+
+    def _enable_incremental_vacuum(self) -> None:
+        # Caller holds the lock. New files get auto_vacuum in __init__; a file created
+        # before that needs one full VACUUM to switch.
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return
+        self._conn.commit()
+        self._conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+        self._conn.execute("VACUUM")
+
+    def maintenance(self, *, vacuum_step: int = VACUUM_STEP_PAGES) -> MaintenanceReport:
+        """Checkpoint and truncate the WAL, refresh planner statistics, release free pages.
+
+        Free pages are returned ``vacuum_step`` at a time with the lock released in
+        between, so bot requests can interleave with a long vacuum.
+        """
+        started = time.perf_counter()
+        report = MaintenanceReport(db_before=self._file_size(""), wal_before=self._file_size("-wal"))
+        with self._lock:
+            self._conn.commit()
+            report.free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            analyzed = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+            if analyzed:
+                self._conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+                self._conn.execute("PRAGMA optimize")
+            else:
+                self._conn.execute("ANALYZE")
+            self._conn.commit()
+        left = report.free_pages
+        while left:
+            with self._lock:
+                self._conn.execute(f"PRAGMA incremental_vacuum({vacuum_step})").fetchall()
+                self._conn.commit()
+                remaining = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= left:
+                break
+            left = remaining
+        with self._lock:
+            busy, _, _ = self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        report.checkpoint_busy = bool(busy)
+        report.db_after = self._file_size("")
+        report.wal_after = self._file_size("-wal")
+        report.seconds = time.perf_counter() - started
+        return report
+
+    def _file_size(self, suffix: str) -> int:
+        path = self._path.with_name(self._path.name + suffix)
+        return path.stat().st_size if path.exists() else 0
+
+    def _init_food_search(self) -> None:
+        # Caller holds the lock. Without FTS5 (old SQLite builds) search falls back to a scan.
+        rekey = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name='portion_search_ids'").fetchone() is None
+        try:
+            if rekey:
+                # Older triggers keyed portion rows on portions.rowid; replace them and rebuild.
+                self._conn.executescript("DROP TRIGGER IF EXISTS portions_search_ai; DROP TRIGGER IF EXISTS portions_search_ad;")
+            self._conn.executescript(FOOD_SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            self._food_fts = False
+            return
+        self._food_fts = True
+        if rekey:
+            self._conn.execute("DELETE FROM food_search")
+        cur = self._conn.execute("SELECT COUNT(*) FROM food_search")
+        if cur.fetchone()[0]:
+            return
+        self._conn.execute("INSERT INTO food_search (rowid, text, kind, ref) SELECT id * 2, name, 'item', id FROM food_items")
+        self._conn.execute("INSERT OR IGNORE INTO portion_search_ids (code) SELECT code FROM portions ORDER BY rowid")
+        self._conn.execute(
+            """
+            INSERT INTO food_search (rowid, text, kind, ref)
+            SELECT ps.id * 2 + 1, fi.name || ' ' || COALESCE(p.description, ''), 'portion', p.code
+            FROM portions p
+            JOIN portion_search_ids ps ON ps.code = p.code
+            JOIN food_items fi ON fi.id = p.item_id
+            """
+        )
+        self._conn.commit()
+
+    def _init_journal_search(self) -> None:
+        # Caller holds the lock. Same fallback as food search: a scan without FTS5.
+        try:
+            self._conn.executescript(_journal_search_schema())
+        except sqlite3.OperationalError:
+            self._journal_fts = False
+            return
+        self._journal_fts = True
+        cur = self._conn.execute("SELECT COUNT(*) FROM journal_search")
+        if cur.fetchone()[0]:
+            return
+        for kind, column in enumerate(JOURNAL_DAILY_COLUMNS):
+            self._conn.execute(
+                f"""
+                INSERT INTO journal_search (rowid, text, date, kind)
+                SELECT {JOURNAL_DAY_ID.format(row="")} * 8 + {kind}, {column}, date, '{column}' FROM daily WHERE COALESCE({column}, '') <> ''
+                """
+            )
+        session_text = JOURNAL_SESSION_TEXT.format(row="session_log")
+        self._conn.execute(
+            f"""
+            INSERT INTO journal_search (rowid, text, date, kind, label)
+            SELECT id * 8 + {JOURNAL_KINDS.index("session")}, {session_text}, date, 'session', category
+            FROM session_log WHERE {session_text} <> ''
+            """
+        )
+        self._conn.execute(
+            f"""
+            INSERT INTO journal_search (rowid, text, date, kind, label)
+            SELECT id * 8 + {JOURNAL_KINDS.index("expense")}, comment, date, 'expense', category
+            FROM expense_log WHERE COALESCE(comment, '') <> ''
+            """
+        )
+        self._conn.commit()
+
+    def _portion_snapshots(self, codes: Iterable[str]) -> dict[str, tuple]:
+        # Caller holds the lock. code -> (product, description, grams, kcal_100, protein_100, fat_100, carb_100).
+        out: dict[str, tuple] = {}
+        for part in _batched(sorted(set(codes)), IMPORT_LOOKUP_BATCH):
+            cur = self._conn.execute(
+                f"""
+                SELECT p.code, fi.name, p.description, p.grams, fi.kcal_100, fi.protein_100, fi.fat_100, fi.carb_100
+                FROM portions p
+                JOIN food_items fi ON fi.id = p.item_id
+                WHERE p.code IN ({','.join('?' * len(part))})
+                """,
+                part,
+            )
+            out.update((row[0], tuple(row[1:])) for row in cur.fetchall())
+        return out
+
+    def _backfill_food_log_snapshots(self) -> None:
+        # Caller holds the lock. Fills the snapshot of rows logged before the columns existed.
+        cur = self._conn.execute("SELECT id, portion_code, quantity FROM food_log WHERE label IS NULL")
+        rows = cur.fetchall()
+        if not rows:
+            return
+        snapshots = self._portion_snapshots(row["portion_code"] for row in rows)
+        self._conn.executemany(
+            f"UPDATE food_log SET {', '.join(f'{column}=?' for column, _ in FOOD_LOG_SNAPSHOT)} WHERE id=?",
+            [
+                (*_food_log_snapshot(row["portion_code"], row["quantity"], snapshots.get(row["portion_code"])), row["id"])
+                for row in rows
+            ],
+        )
+        self._conn.commit()
+
+    def _backfill_habit_bitmaps(self) -> None:
+        # Caller holds the lock. Builds bitmaps for habits logged before the column existed.
+        cur = self._conn.execute(
+            """
+            SELECT hl.habit_id, hl.date FROM habit_log hl
+            JOIN habits h ON h.id = hl.habit_id
+            WHERE h.bitmap_start IS NULL
+            """
+        )
+        bitmaps: dict[int, HabitBitmap] = {}
+        for row in cur.fetchall():
+            try:
+                day = date.fromisoformat(row["date"])
+            except ValueError:
+                continue
+            bitmaps.setdefault(row["habit_id"], HabitBitmap()).set(day, True)
+        if not bitmaps:
+            return
+        self._conn.executemany(
+            "UPDATE habits SET bitmap=?, bitmap_start=? WHERE id=?",
+            [(bm.to_blob(), bm.start.isoformat(), habit_id) for habit_id, bm in bitmaps.items()],
+        )
+        self._conn.commit()
 
     def _ensure_columns(self, table: str, columns: dict[str, str]) -> None:
         cur = self._conn.execute(f"PRAGMA table_info({table})")
@@ -175,18 +610,19 @@ class Database:
             if count:
                 return
             with food_items_csv_path.open("r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    cur.execute(
-                        "INSERT INTO food_items (name, protein_100, fat_100, carb_100, kcal_100) VALUES (?,?,?,?,?)",
+                cur.executemany(
+                    "INSERT INTO food_items (name, protein_100, fat_100, carb_100, kcal_100) VALUES (?,?,?,?,?)",
+                    [
                         (
                             row["name"],
                             float(row["protein_100"]),
                             float(row["fat_100"]),
                             float(row["carb_100"]),
                             float(row["kcal_100"]),
-                        ),
-                    )
+                        )
+                        for row in csv.DictReader(f)
+                    ],
+                )
             self._conn.commit()
 
             # build name -> id map
@@ -194,36 +630,123 @@ class Database:
             item_map = {row["name"]: row["id"] for row in cur.fetchall()}
 
             with portions_csv_path.open("r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    item_id = item_map.get(row["product"])
-                    if not item_id:
-                        continue
-                    cur.execute(
-                        "INSERT INTO portions (code, item_id, description, grams) VALUES (?,?,?,?)",
-                        (
-                            row["code"],
-                            item_id,
-                            row["description"],
-                            float(row["grams"]),
-                        ),
-                    )
+                cur.executemany(
+                    "INSERT INTO portions (code, item_id, description, grams) VALUES (?,?,?,?)",
+                    [
+                        (row["code"], item_map[row["product"]], row["description"], float(row["grams"]))
+                        for row in csv.DictReader(f)
+                        if item_map.get(row["product"])
+                    ],
+                )
+            self._bump_catalog_version()
             self._conn.commit()
 
     def ensure_daily_row(self, date_str: str) -> None:
         with self._lock:
-            self._conn.execute("INSERT OR IGNORE INTO daily (date) VALUES (?)", (date_str,))
+            cur = self._conn.execute("INSERT OR IGNORE INTO daily (date) VALUES (?)", (date_str,))
             self._conn.commit()
+            if cur.rowcount:
+                self._notify_changed(date_str)
 
     def update_daily_fields(self, date_str: str, fields: dict[str, object]) -> None:
         if not fields:
             return
         self.ensure_daily_row(date_str)
-        columns = ", ".join([f"{col}=?" for col in fields.keys()])
+        columns = ", ".join([f"{col}=?" for col in fields.keys()] + ["rev=COALESCE(rev, 0) + 1"])
         values = list(fields.values()) + [date_str]
         with self._lock:
             self._conn.execute(f"UPDATE daily SET {columns} WHERE date=?", values)
             self._conn.commit()
+            self._notify_changed(date_str)
+
+    def _touch_daily(self, date_str: str) -> None:
+        # Caller holds the lock. Bumps the row revision so persisted scores get recomputed.
+        self._conn.execute("UPDATE daily SET rev=COALESCE(rev, 0) + 1 WHERE date=?", (date_str,))
+        self._notify_changed(date_str)
+
+    def store_day_scores(
+        self,
+        date_str: str,
+        rev: int | None,
+        quality: int | None,
+        status: str,
+        missing: str | None,
+        version: int,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE daily
+                SET quality=?, completion_status=?, missing=?, score_version=?, score_rev=?
+                WHERE date=? AND rev IS ?
+                """,
+                (quality, status, missing, version, rev, date_str, rev),
+            )
+            self._conn.commit()
+
+    def invalidate_scores(self) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE daily SET score_version=NULL")
+            self._conn.commit()
+
+    def get_stale_score_dates(self, version: int, start: str | None = None) -> list[str]:
+        sql = "SELECT date FROM daily WHERE (score_version IS NOT ? OR score_rev IS NOT rev)"
+        params: list[object] = [version]
+        if start:
+            sql += " AND date>=?"
+            params.append(start)
+        sql += " ORDER BY date"
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            return [row["date"] for row in cur.fetchall()]
+
+    def get_score_summary(self, start: str | None = None, end: str | None = None) -> dict:
+        conditions: list[str] = []
+        params: list[object] = []
+        if start:
+            conditions.append("date>=?")
+            params.append(start)
+        if end:
+            conditions.append("date<=?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        paused_where = "WHERE " + " AND ".join(conditions + ["completion_status='paused'"])
+        with self._lock:
+            cur = self._conn.execute(
+                f"""
+                SELECT completion_status AS status, COUNT(*) AS cnt,
+                       SUM(quality) AS quality_sum, COUNT(quality) AS quality_count
+                FROM daily
+                {where}
+                GROUP BY completion_status
+                """,
+                params,
+            )
+            rows = cur.fetchall()
+            cur = self._conn.execute(
+                f"""
+                SELECT date, day_status FROM daily
+                {paused_where}
+                ORDER BY date
+                """,
+                params,
+            )
+            paused = [(row["date"], row["day_status"]) for row in cur.fetchall()]
+        counts: dict[str, int] = {}
+        quality_sum = 0
+        quality_count = 0
+        for row in rows:
+            status = row["status"] or ""
+            counts[status] = int(row["cnt"])
+            if status in {"full", "partial", "none"}:
+                quality_sum += int(row["quality_sum"] or 0)
+                quality_count += int(row["quality_count"] or 0)
+        return {
+            "counts": counts,
+            "quality_sum": quality_sum,
+            "quality_count": quality_count,
+            "paused": paused,
+        }
 
     def get_daily_row(self, date_str: str) -> Optional[dict]:
         with self._lock:
@@ -238,6 +761,21 @@ class Database:
             cur = self._conn.execute("SELECT date FROM daily ORDER BY date")
             return [row["date"] for row in cur.fetchall()]
 
+    def get_daily_date_bounds(self) -> tuple[Optional[str], Optional[str]]:
+        with self._lock:
+            cur = self._conn.execute("SELECT MIN(date) AS first, MAX(date) AS last FROM daily")
+            row = cur.fetchone()
+        return row["first"], row["last"]
+
+    def get_daily_rows(self, start: str, end: str) -> list[dict]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT * FROM daily WHERE date BETWEEN ? AND ? ORDER BY date",
+                (start, end),
+            )
+            rows = cur.fetchall()
+        return [dict(row) for row in rows]
+
     def get_state(self, key: str) -> Optional[str]:
         with self._lock:
             cur = self._conn.execute("SELECT value FROM state WHERE key=?", (key,))
@@ -255,6 +793,27 @@ class Database:
                 )
             self._conn.commit()
 
+    def get_ptb_data(self, kind: str) -> dict[int, str]:
+        """Persisted ``user_data``/``chat_data`` JSON by id (``kind`` is "user" or "chat")."""
+        with self._lock:
+            cur = self._conn.execute("SELECT id, data FROM ptb_data WHERE kind=?", (kind,))
+            return {row["id"]: row["data"] for row in cur.fetchall()}
+
+    def write_ptb_data(self, changes: Iterable[tuple[str, int, Optional[str]]]) -> None:
+        """Upsert ``(kind, id, json)`` rows, deleting those with ``None``, in one transaction."""
+        changes = list(changes)
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM ptb_data WHERE kind=? AND id=?",
+                [(kind, row_id) for kind, row_id, data in changes if data is None],
+            )
+            self._conn.executemany(
+                "INSERT INTO ptb_data (kind, id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(kind, id) DO UPDATE SET data=excluded.data",
+                [(kind, row_id, data) for kind, row_id, data in changes if data is not None],
+            )
+            self._conn.commit()
+
     def add_food_log(
         self,
         date_str: str,
@@ -264,14 +823,85 @@ class Database:
         comment: str = "",
     ) -> int:
         with self._lock:
-            cur = self._conn.cursor()
-            cur.execute(
-                "INSERT INTO food_log (date, time, portion_code, quantity, comment) VALUES (?,?,?,?,?)",
-                (date_str, time_str, portion_code, quantity, comment),
+            snapshot = _food_log_snapshot(
+                portion_code, quantity, self._portion_snapshots([portion_code]).get(portion_code)
+            )
+            cur = self._conn.execute(
+                FOOD_LOG_INSERT,
+                (date_str, time_str, portion_code, quantity, comment, *snapshot),
             )
+            self._touch_daily(date_str)
             self._conn.commit()
             return cur.lastrowid
 
+    def add_food_logs(
+        self,
+        date_str: str,
+        time_str: str,
+        items: Iterable[tuple[str, float]],
+        comment: str = "",
+    ) -> int:
+        """Log several ``(portion_code, quantity)`` pairs in one transaction."""
+        items = list(items)
+        if not items:
+            return 0
+        with self._lock:
+            snapshots = self._portion_snapshots(code for code, _ in items)
+            self._conn.executemany(
+                FOOD_LOG_INSERT,
+                [
+                    (date_str, time_str, code, quantity, comment, *_food_log_snapshot(code, quantity, snapshots.get(code)))
+                    for code, quantity in items
+                ],
+            )
+            self._touch_daily(date_str)
+            self._conn.commit()
+        return len(items)
+
+    def save_meal_template(self, name: str, items: list[tuple[str, float]]) -> int:
+        """Create or replace the template ``name`` with ``(portion_code, quantity)`` items."""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("SELECT id FROM meal_templates WHERE name=?", (name,))
+            row = cur.fetchone()
+            if row:
+                template_id = row["id"]
+                cur.execute("DELETE FROM meal_template_items WHERE template_id=?", (template_id,))
+            else:
+                cur.execute("INSERT INTO meal_templates (name) VALUES (?)", (name,))
+                template_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO meal_template_items (template_id, position, portion_code, quantity) VALUES (?,?,?,?)",
+                [(template_id, position, code, quantity) for position, (code, quantity) in enumerate(items)],
+            )
+            self._conn.commit()
+            return template_id
+
+    def get_meal_templates(self) -> list[dict]:
+        """Templates by name, each with ``items`` as ``(portion_code, quantity)`` pairs."""
+        with self._lock:
+            cur = self._conn.execute(
+                """
+                SELECT t.id, t.name, i.portion_code, i.quantity
+                FROM meal_templates t
+                LEFT JOIN meal_template_items i ON i.template_id = t.id
+                ORDER BY t.name, t.id, i.position
+                """
+            )
+            rows = cur.fetchall()
+        templates: dict[int, dict] = {}
+        for row in rows:
+            template = templates.setdefault(row["id"], {"id": row["id"], "name": row["name"], "items": []})
+            if row["portion_code"] is not None:
+                template["items"].append((row["portion_code"], row["quantity"]))
+        return list(templates.values())
+
+    def delete_meal_template(self, template_id: int) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM meal_templates WHERE id=?", (template_id,))
+            self._conn.commit()
+            return cur.rowcount > 0
+
     def ensure_food_item(
         self,
         name: str,
@@ -282,7 +912,7 @@ class Database:
     ) -> int:
         with self._lock:
             cur = self._conn.cursor()
-            cur.execute("SELECT id FROM food_items WHERE lower(name)=lower(?)", (name,))
+            cur.execute("SELECT id FROM food_items WHERE name=? COLLATE NOCASE", (name,))
             row = cur.fetchone()
             if row:
                 return row["id"]
@@ -290,8 +920,10 @@ class Database:
                 "INSERT INTO food_items (name, protein_100, fat_100, carb_100, kcal_100) VALUES (?,?,?,?,?)",
                 (name, proteins, fats, carbs, kcal),
             )
+            item_id = cur.lastrowid
+            self._bump_catalog_version()
             self._conn.commit()
-            return cur.lastrowid
+            return item_id
 
     def ensure_portion(
         self,
@@ -305,7 +937,7 @@ class Database:
             cur.execute("SELECT code FROM portions WHERE code=?", (code,))
             if cur.fetchone():
                 return
-            cur.execute("SELECT id FROM food_items WHERE lower(name)=lower(?)", (product_name,))
+            cur.execute("SELECT id FROM food_items WHERE name=? COLLATE NOCASE", (product_name,))
             row = cur.fetchone()
             if not row:
                 raise ValueError(f"Food item not found: {product_name}")
@@ -313,8 +945,230 @@ class Database:
                 "INSERT INTO portions (code, item_id, description, grams) VALUES (?,?,?,?)",
                 (code, row["id"], description, grams),
             )
+            self._bump_catalog_version()
             self._conn.commit()
 
+    def _bump_catalog_version(self) -> None:
+        # Caller holds the lock; committed together with the catalog write.
+        self._conn.execute(
+            """
+            INSERT INTO state (key, value) VALUES (?, '1')
+            ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER) + 1
+            """,
+            (CATALOG_VERSION_KEY,),
+        )
+
+    def get_catalog_version(self) -> int:
+        """Counter bumped by every food_items/portions write (also from other processes)."""
+        value = self.get_state(CATALOG_VERSION_KEY)
+        return int(value) if value else 0
+
+    def import_food_items(
+        self,
+        records: Iterable[FoodRecord],
+        *,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        progress: Callable[[ImportStats], None] | None = None,
+    ) -> ImportStats:
+        """Bulk upsert of products, one transaction per ``chunk_size`` records.
+
+        A record updates the product with the same barcode, otherwise the one with the
+        same name (case-insensitive, which also gives it the barcode if it had none), and
+        is inserted when neither exists. Within a chunk the last record for a
+        barcode/name wins. ``progress`` is called after every committed chunk.
+        """
+        stats = ImportStats()
+        chunk: list[FoodRecord] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                self._import_chunk(chunk, stats)
+                chunk = []
+                if progress:
+                    progress(stats)
+        if chunk:
+            self._import_chunk(chunk, stats)
+            if progress:
+                progress(stats)
+        return stats
+
+    def _import_chunk(self, chunk: list[FoodRecord], stats: ImportStats) -> None:
+        by_key: dict[str, FoodRecord] = {}
+        for record in chunk:
+            # Later duplicates replace earlier ones but keep their first position.
+            key = f"b:{record.barcode}" if record.barcode else f"n:{_nocase(record.name)}"
+            by_key[key] = record
+        unique: dict[str, FoodRecord] = {}
+        for record in by_key.values():
+            unique[_nocase(record.name)] = record
+        records = list(unique.values())
+        stats.processed += len(chunk)
+        stats.skipped += len(chunk) - len(records)
+
+        with self._lock:
+            barcodes = [r.barcode for r in records if r.barcode]
+            by_barcode: dict[str, int] = {}
+            for part in _batched(barcodes, IMPORT_LOOKUP_BATCH):
+                cur = self._conn.execute(
+                    f"SELECT id, barcode FROM food_items WHERE barcode IN ({','.join('?' * len(part))})",
+                    part,
+                )
+                by_barcode.update((row["barcode"], row["id"]) for row in cur.fetchall())
+            names = [r.name for r in records if r.barcode not in by_barcode]
+            by_name: dict[str, int] = {}
+            for part in _batched(names, IMPORT_LOOKUP_BATCH):
+                cur = self._conn.execute(
+                    f"SELECT id, name FROM food_items WHERE name COLLATE NOCASE IN ({','.join('?' * len(part))})",
+                    part,
+                )
+                by_name.update((_nocase(row["name"]), row["id"]) for row in cur.fetchall())
+
+            updates = []
+            inserts = []
+            for r in records:
+                item_id = by_barcode.get(r.barcode) if r.barcode else None
+                if item_id is None:
+                    item_id = by_name.get(_nocase(r.name))
+                if item_id is None:
+                    inserts.append((r.name, r.protein, r.fat, r.carb, r.kcal, r.barcode))
+                else:
+                    updates.append((r.protein, r.fat, r.carb, r.kcal, r.barcode, item_id))
+            try:
+                if updates:
+                    self._conn.executemany(
+                        """
+                        UPDATE food_items
+                        SET protein_100=?, fat_100=?, carb_100=?, kcal_100=?, barcode=COALESCE(barcode, ?)
+                        WHERE id=?
+                        """,
+                        updates,
+                    )
+                inserted = 0
+                if inserts:
+                    # OR IGNORE: a barcode already owned by another name is skipped, not fatal.
+                    cur = self._conn.executemany(
+                        """
+                        INSERT OR IGNORE INTO food_items (name, protein_100, fat_100, carb_100, kcal_100, barcode)
+                        VALUES (?,?,?,?,?,?)
+                        """,
+                        inserts,
+                    )
+                    inserted = cur.rowcount
+                self._bump_catalog_version()
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        stats.updated += len(updates)
+        stats.inserted += inserted
+        stats.skipped += len(inserts) - inserted
+
+    def get_food_item_by_barcode(self, barcode: str) -> Optional[dict]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT id, name, protein_100, fat_100, carb_100, kcal_100 FROM food_items WHERE barcode=?",
+                (barcode,),
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+
+    def get_food_item(self, item_id: int) -> Optional[dict]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT id, name, protein_100, fat_100, carb_100, kcal_100 FROM food_items WHERE id=?",
+                (item_id,),
+            )
+            row = cur.fetchone()
+        return dict(row) if row else None
+
+    def search_food(self, query: str, limit: int = 8, candidates: int = 200) -> list[dict]:
+        """Typo-tolerant product/portion search.
+
+        The FTS5 trigram index returns up to ``candidates`` rows sharing any trigram with
+        the query; they are re-ranked by trigram similarity. Short or heavily mistyped
+        queries that share no trigram with anything fall back to scoring every portion
+        and every product that has one (bulk-imported products without portions are
+        left out so the scan stays small).
+        Returns dicts with ``kind`` ("item"/"portion"), ``ref`` (item id or portion code),
+        ``text`` and ``score``.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        match = fts_query(query) if self._food_fts else None
+        with self._lock:
+            rows = []
+            if match:
+                cur = self._conn.execute(
+                    "SELECT kind, ref, text FROM food_search WHERE food_search MATCH ? ORDER BY rank LIMIT ?",
+                    (match, candidates),
+                )
+                rows = cur.fetchall()
+            if not rows:
+                cur = self._conn.execute(
+                    """
+                    SELECT 'item' AS kind, id AS ref, name AS text FROM food_items fi
+                    WHERE EXISTS (SELECT 1 FROM portions p WHERE p.item_id = fi.id)
+                    UNION ALL
+                    SELECT 'portion', p.code, fi.name || ' ' || COALESCE(p.description, '')
+                    FROM portions p
+                    JOIN food_items fi ON fi.id = p.item_id
+                    """
+                )
+                rows = cur.fetchall()
+        results = []
+        for row in rows:
+            score = similarity(query_grams, row["text"])
+            if score > 0:
+                results.append({"kind": row["kind"], "ref": row["ref"], "text": row["text"], "score": score})
+        results.sort(key=lambda item: (-item["score"], item["text"]))
+        return results[:limit]
+
+    def search_journal(self, query: str, limit: int = 5, offset: int = 0) -> tuple[int, list[dict]]:
+        """Journal entries containing every word of ``query`` (as word prefixes), best first.
+
+        Returns the total number of matches and one page of dicts with ``date``, ``kind``
+        (one of ``JOURNAL_KINDS``), ``label`` (session/expense category) and ``snippet``
+        (matched words wrapped in «»).
+        """
+        match = _journal_match(query)
+        if not match:
+            return 0, []
+        if not self._journal_fts:
+            return self._search_journal_scan(query, limit, offset)
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM journal_search WHERE journal_search MATCH ?", (match,)
+            ).fetchone()[0]
+            cur = self._conn.execute(
+                """
+                SELECT date, kind, label, snippet(journal_search, 0, '«', '»', '…', 12) AS snippet
+                FROM journal_search
+                WHERE journal_search MATCH ?
+                ORDER BY rank, date DESC
+                LIMIT ? OFFSET ?
+                """,
+                (match, limit, offset),
+            )
+            rows = cur.fetchall()
+        return total, [dict(row) for row in rows]
+
+    def _search_journal_scan(self, query: str, limit: int, offset: int) -> tuple[int, list[dict]]:
+        words = normalize(query).split()
+        selects = [f"SELECT date, '{column}' AS kind, NULL AS label, {column} AS text FROM daily" for column in JOURNAL_DAILY_COLUMNS]
+        selects.append(f"SELECT date, 'session', category, {JOURNAL_SESSION_TEXT.format(row='session_log')} FROM session_log")
+        selects.append("SELECT date, 'expense', category, comment FROM expense_log")
+        with self._lock:
+            cur = self._conn.execute(" UNION ALL ".join(selects))
+            rows = cur.fetchall()
+        matches = []
+        for row in rows:
+            words_in_text = normalize(row["text"] or "").split()
+            if words_in_text and all(any(w.startswith(word) for w in words_in_text) for word in words):
+                matches.append({"date": row["date"], "kind": row["kind"], "label": row["label"], "snippet": row["text"][:120]})
+        matches.sort(key=lambda item: item["date"], reverse=True)
+        return len(matches), matches[offset : offset + limit]
+
     def list_portions(self) -> list[dict]:
         with self._lock:
             cur = self._conn.execute(
@@ -352,55 +1206,37 @@ class Database:
         with self._lock:
             cur = self._conn.execute(
                 """
-                SELECT fl.id, fl.date, fl.time, fl.portion_code, fl.quantity, fl.comment,
-                       p.grams, p.description, fi.name AS product
-                FROM food_log fl
-                LEFT JOIN portions p ON p.code = fl.portion_code
-                LEFT JOIN food_items fi ON fi.id = p.item_id
-                WHERE fl.date = ?
-                ORDER BY fl.id
+                SELECT id, date, time, portion_code, quantity, comment, product, label, grams
+                FROM food_log
+                WHERE date = ?
+                ORDER BY id
                 """,
                 (date_str,),
             )
             rows = cur.fetchall()
-        result = []
-        for row in rows:
-            grams = row["grams"] or 0
-            total_grams = grams * (row["quantity"] or 0)
-            label = row["portion_code"]
-            if row["product"]:
-                label = (
-                    f"{row['product']} ({row['description']})" if row["description"] else row["product"]
-                )
-            result.append(
-                {
-                    "id": row["id"],
-                    "date": row["date"],
-                    "time": row["time"],
-                    "code": row["portion_code"],
-                    "quantity": row["quantity"],
-                    "comment": row["comment"],
-                    "product": row["product"],
-                    "label": label,
-                    "grams": total_grams,
-                }
-            )
-        return result
+        return [
+            {
+                "id": row["id"],
+                "date": row["date"],
+                "time": row["time"],
+                "code": row["portion_code"],
+                "quantity": row["quantity"],
+                "comment": row["comment"],
+                "product": row["product"],
+                "label": row["label"] or row["portion_code"],
+                "grams": row["grams"] or 0,
+            }
+            for row in rows
+        ]
 
     def get_daily_macros(self, date_str: str) -> Optional[dict]:
         with self._lock:
             cur = self._conn.execute(
                 """
-                SELECT
-                    SUM(fl.quantity * p.grams * fi.kcal_100 / 100.0) AS kcal,
-                    SUM(fl.quantity * p.grams * fi.protein_100 / 100.0) AS protein,
-                    SUM(fl.quantity * p.grams * fi.fat_100 / 100.0) AS fat,
-                    SUM(fl.quantity * p.grams * fi.carb_100 / 100.0) AS carb,
-                    COUNT(fl.id) AS cnt
-                FROM food_log fl
-                JOIN portions p ON p.code = fl.portion_code
-                JOIN food_items fi ON fi.id = p.item_id
-                WHERE fl.date = ?
+                SELECT SUM(kcal) AS kcal, SUM(protein) AS protein, SUM(fat) AS fat, SUM(carb) AS carb,
+                       COUNT(kcal) AS cnt
+                FROM food_log
+                WHERE date = ?
                 """,
                 (date_str,),
             )
@@ -446,9 +1282,79 @@ class Database:
                 "INSERT INTO expense_log (date, time, category, amount, comment) VALUES (?,?,?,?,?)",
                 (date_str, time_str, category, amount, comment),
             )
+            self._touch_daily(date_str)
             self._conn.commit()
             return cur.lastrowid
 
+    def import_history(
+        self,
+        daily: Iterable[dict[str, object]] = (),
+        food: Iterable[tuple[str, str, str, float]] = (),
+        sessions: Iterable[tuple[str, str, str, str, int, str]] = (),
+        expenses: Iterable[tuple[str, str, str, float, str]] = (),
+        habits: Iterable[tuple[str, str]] = (),
+    ) -> None:
+        """Write many days of history in one transaction.
+
+        ``daily`` rows are dicts with a ``date`` key and upsert only the columns they
+        carry; ``food`` is ``(date, time, portion_code, quantity)``, ``sessions`` and
+        ``expenses`` are the ``add_session``/``add_expense`` arguments and ``habits``
+        is ``(date, habit_name)`` for every day marked done. Revisions are bumped and
+        change listeners called as if each row was written on its own.
+        """
+        daily, food, sessions, expenses, habits = map(list, (daily, food, sessions, expenses, habits))
+        changed = {row["date"] for row in daily} | {row[0] for row in (*food, *expenses, *habits)}
+        with self._lock:
+            by_columns: dict[tuple[str, ...], list[tuple]] = {}
+            for row in daily:
+                columns = tuple(sorted(column for column in row if column != "date"))
+                by_columns.setdefault(columns, []).append((row["date"], *(row[column] for column in columns)))
+            for columns, rows in by_columns.items():
+                updates = ", ".join([f"{column}=excluded.{column}" for column in columns] + ["rev=COALESCE(daily.rev, 0) + 1"])
+                self._conn.executemany(
+                    f"INSERT INTO daily (date, {''.join(f'{column}, ' for column in columns)}rev) "
+                    f"VALUES (?, {'?, ' * len(columns)}1) ON CONFLICT(date) DO UPDATE SET {updates}",
+                    rows,
+                )
+            snapshots = self._portion_snapshots(row[2] for row in food)
+            self._conn.executemany(
+                FOOD_LOG_INSERT,
+                [
+                    (date_str, time_str, code, quantity, "", *_food_log_snapshot(code, quantity, snapshots.get(code)))
+                    for date_str, time_str, code, quantity in food
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO session_log (date, time, category, subcategory, minutes, comment) VALUES (?,?,?,?,?,?)",
+                sessions,
+            )
+            self._conn.executemany(
+                "INSERT INTO expense_log (date, time, category, amount, comment) VALUES (?,?,?,?,?)",
+                expenses,
+            )
+            self._conn.executemany(
+                "UPDATE daily SET rev=COALESCE(rev, 0) + 1 WHERE date=?",
+                [(date_str,) for date_str in sorted({row[0] for row in (*food, *expenses)})],
+            )
+            if habits:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO habit_log (date, habit_id, done) "
+                    "SELECT ?, id, 1 FROM habits WHERE lower(name)=lower(?)",
+                    habits,
+                )
+                # Rebuild the touched bitmaps from habit_log rather than one bit at a time.
+                names = sorted({name.lower() for _, name in habits})
+                self._conn.executemany(
+                    "UPDATE habits SET bitmap=NULL, bitmap_start=NULL WHERE lower(name)=?",
+                    [(name,) for name in names],
+                )
+                self._backfill_habit_bitmaps()
+                self._habit_bitmaps = None
+                self._habit_runs = None
+            self._conn.commit()
+            for date_str in sorted(changed):
+                self._notify_changed(date_str)
+
     def get_expenses(self, date_str: str) -> list[dict]:
         with self._lock:
             cur = self._conn.execute(
@@ -476,6 +1382,7 @@ class Database:
             if not row:
                 return False
             self._conn.execute("DELETE FROM expense_log WHERE id=?", (row["id"],))
+            self._touch_daily(date_str)
             self._conn.commit()
         return True
 
@@ -486,6 +1393,7 @@ class Database:
             if count <= 0:
                 return 0
             self._conn.execute("DELETE FROM expense_log WHERE date=?", (date_str,))
+            self._touch_daily(date_str)
             self._conn.commit()
         return count
 
@@ -508,6 +1416,26 @@ class Database:
             totals["total"] += value
         return totals
 
+    def get_expense_totals_range(self, start: str, end: str) -> dict[str, dict[str, float]]:
+        with self._lock:
+            cur = self._conn.execute(
+                """
+                SELECT date, category, SUM(amount) AS total
+                FROM expense_log
+                WHERE date BETWEEN ? AND ?
+                GROUP BY date, category
+                """,
+                (start, end),
+            )
+            rows = cur.fetchall()
+        by_date: dict[str, dict[str, float]] = {}
+        for row in rows:
+            totals = by_date.setdefault(row["date"], {"total": 0.0})
+            value = float(row["total"] or 0.0)
+            totals[row["category"]] = value
+            totals["total"] += value
+        return by_date
+
     def get_sessions(self, date_str: str, *, category: str | None = None) -> list[dict]:
         params = [date_str]
         sql = "SELECT * FROM session_log WHERE date=?"
@@ -568,8 +1496,59 @@ class Database:
                 return False
             self._conn.execute("INSERT INTO habits (name, active) VALUES (?,1)", (normalized,))
             self._conn.commit()
+            self._habit_bitmaps = None
+            self._habit_runs = None
         return True
 
+    def _habit_bitmap_cache(self) -> dict[int, tuple[str, HabitBitmap]]:
+        # Caller holds the lock. In-memory mirror of habits.bitmap, loaded once.
+        if self._habit_bitmaps is None:
+            cur = self._conn.execute("SELECT id, name, bitmap, bitmap_start FROM habits ORDER BY id")
+            self._habit_bitmaps = {
+                row["id"]: (row["name"], HabitBitmap.from_blob(row["bitmap_start"], row["bitmap"]))
+                for row in cur.fetchall()
+            }
+        return self._habit_bitmaps
+
+    def _habit_run_cache(self) -> dict[int, RunIndex]:
+        # Caller holds the lock. Runs of done days per habit, built from the bitmaps once
+        # and patched by _set_habit_bit.
+        if self._habit_runs is None:
+            self._habit_runs = {
+                habit_id: RunIndex(day.toordinal() for day in bitmap.days())
+                for habit_id, (_name, bitmap) in self._habit_bitmap_cache().items()
+            }
+        return self._habit_runs
+
+    def _set_habit_bit(self, habit_id: int, date_str: str, done: bool) -> None:
+        # Caller holds the lock and commits.
+        try:
+            day = date.fromisoformat(date_str)
+        except ValueError:
+            return
+        entry = self._habit_bitmap_cache().get(habit_id)
+        if entry is None:
+            return
+        bitmap = entry[1]
+        bitmap.set(day, done)
+        if self._habit_runs is not None:
+            self._habit_runs.setdefault(habit_id, RunIndex()).set(day.toordinal(), done)
+        self._conn.execute(
+            "UPDATE habits SET bitmap=?, bitmap_start=? WHERE id=?",
+            (bitmap.to_blob(), bitmap.start.isoformat() if bitmap.start else None, habit_id),
+        )
+
+    def get_habit_bitmaps(self, active_only: bool = True) -> dict[str, HabitBitmap]:
+        """Copies of the per-habit completion bitmaps, in habit order."""
+        with self._lock:
+            cache = self._habit_bitmap_cache()
+            if active_only:
+                cur = self._conn.execute("SELECT id FROM habits WHERE active=1")
+                active = {row["id"] for row in cur.fetchall()}
+            else:
+                active = set(cache)
+            return {name: replace(bitmap) for habit_id, (name, bitmap) in cache.items() if habit_id in active}
+
     def set_habit_done(self, date_str: str, habit_name: str, done: bool) -> None:
         with self._lock:
             cur = self._conn.execute("SELECT id FROM habits WHERE lower(name)=lower(?)", (habit_name,))
@@ -587,25 +1566,40 @@ class Database:
                     "DELETE FROM habit_log WHERE date=? AND habit_id=?",
                     (date_str, habit_id),
                 )
+            self._set_habit_bit(habit_id, date_str, done)
             self._conn.commit()
+            self._notify_changed(date_str)
 
     def clear_habits_for_date(self, date_str: str) -> None:
         with self._lock:
+            cur = self._conn.execute("SELECT habit_id FROM habit_log WHERE date=?", (date_str,))
+            habit_ids = [row["habit_id"] for row in cur.fetchall()]
             self._conn.execute("DELETE FROM habit_log WHERE date=?", (date_str,))
+            for habit_id in habit_ids:
+                self._set_habit_bit(habit_id, date_str, False)
             self._conn.commit()
+            self._notify_changed(date_str)
 
     def get_habits_done(self, date_str: str) -> list[str]:
+        try:
+            day = date.fromisoformat(date_str)
+        except ValueError:
+            return []
         with self._lock:
-            cur = self._conn.execute(
-                """
-                SELECT h.name FROM habit_log hl
-                JOIN habits h ON h.id = hl.habit_id
-                WHERE hl.date=?
-                ORDER BY h.id
-                """,
-                (date_str,),
-            )
-            return [row["name"] for row in cur.fetchall()]
+            return [name for name, bitmap in self._habit_bitmap_cache().values() if bitmap.get(day)]
+
+    def get_habit_streaks(self, day: date, grace: int = 1) -> dict[str, int]:
+        """Current streak of every habit through ``day``, from memory (no query once loaded).
+
+        With ``grace`` a streak survives that many unmarked days at its end, e.g. a habit
+        done yesterday but not yet today.
+        """
+        with self._lock:
+            runs = self._habit_run_cache()
+            return {
+                name: runs[habit_id].current(day.toordinal(), grace)
+                for habit_id, (name, _bitmap) in self._habit_bitmap_cache().items()
+            }
 
     def list_food_items(self) -> list[dict]:
         with self._lock:
@@ -632,9 +1626,9 @@ class Database:
         with self._lock:
             cur = self._conn.execute(
                 """
-                SELECT fl.date, fl.time, fl.portion_code, fl.quantity, fl.comment
-                FROM food_log fl
-                ORDER BY fl.id
+                SELECT date, time, portion_code, quantity, comment, label, grams, kcal, protein, fat, carb
+                FROM food_log
+                ORDER BY id
                 """
             )
             rows = cur.fetchall()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import functools
+import heapq
+import inspect
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from db import Database
+
+
+SLOW_LOGGER = logging.getLogger("lifeos-bot.slow-sql")
+SQL_PREVIEW = 300
+
+
+@dataclass
+class MethodStats:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    lock_wait: float = 0.0
+    statements: int = 0
+
+
+@dataclass(order=True)
+class SlowStatement:
+    seconds: float
+    sql: str = field(compare=False)
+    method: str = field(compare=False)
+    at: datetime = field(compare=False)
+
+
+@dataclass
+class _Frame:
+    method: str
+    started: float
+    lock_wait: float = 0.0
+    # (start, sql); sql is None where a nested method call took over.
+    statements: list[tuple[float, str | None]] = field(default_factory=list)
+
+
+class _TimedLock:
+    """Drop-in for the ``Database`` lock that charges acquire waits to the running method."""
+
+    def __init__(self, profiler: "DbProfiler", lock):
+        self._profiler = profiler
+        self._lock = lock
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        frame = self._profiler._frame()
+        if frame is not None:
+            frame.lock_wait += time.perf_counter() - started
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class DbProfiler:
+    """Opt-in timing of every public :class:`Database` method and the SQL it runs.
+
+    :meth:`instrument` wraps the methods of one ``Database`` instance, times its lock
+    acquisitions and installs ``set_trace_callback``. A statement's time runs from its
+    trace callback to the next statement (or the end of the method), so it includes
+    fetching its rows. Statements and calls slower than ``threshold`` seconds go to the
+    slow-query log; the ``top_n`` slowest statements are kept in memory.
+    """
+
+    def __init__(self, threshold: float = 0.05, top_n: int = 20, log_path: Path | None = None):
+        self.threshold = threshold
+        self.top_n = top_n
+        self.methods: dict[str, MethodStats] = {}
+        self.slowest: list[SlowStatement] = []
+        self.since = datetime.now()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        if log_path is not None and not SLOW_LOGGER.handlers:
+            log_path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=2_000_000, backupCount=3, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            SLOW_LOGGER.addHandler(handler)
+            SLOW_LOGGER.propagate = False
+
+    def instrument(self, db: Database) -> None:
+        db.install_profiler(lambda lock: _TimedLock(self, lock), self._on_statement)
+        for name, _ in inspect.getmembers(Database, inspect.isfunction):
+            if not name.startswith("_"):
+                setattr(db, name, self._wrap(name, getattr(db, name)))
+
+    def reset(self) -> None:
+        with self._stats_lock:
+            self.methods.clear()
+            self.slowest.clear()
+            self.since = datetime.now()
+
+    def snapshot(self) -> tuple[list[tuple[str, MethodStats]], list[SlowStatement]]:
+        """Methods by total time and the slowest statements, slowest first."""
+        with self._stats_lock:
+            methods = sorted(
+                ((name, MethodStats(**vars(stats))) for name, stats in self.methods.items()),
+                key=lambda item: item[1].total,
+                reverse=True,
+            )
+            slowest = sorted(self.slowest, reverse=True)
+        return methods, slowest
+
+    def _frame(self) -> _Frame | None:
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def _on_statement(self, sql: str) -> None:
+        # Statements run by triggers and virtual tables (FTS5 internals) come prefixed with "--"
+        # and belong to the statement that caused them.
+        if sql.startswith("--"):
+            return
+        frame = self._frame()
+        if frame is not None:
+            frame.statements.append((time.perf_counter(), sql))
+
+    def _wrap(self, name: str, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+            frame = _Frame(name, time.perf_counter())
+            if stack:
+                stack[-1].statements.append((frame.started, None))
+            stack.append(frame)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stack.pop()
+                self._record(frame, time.perf_counter())
+
+        return wrapper
+
+    def _record(self, frame: _Frame, ended: float) -> None:
+        elapsed = ended - frame.started
+        slow: list[SlowStatement] = []
+        ends = [started for started, _ in frame.statements[1:]] + [ended]
+        for (started, sql), end in zip(frame.statements, ends):
+            if sql is not None and end - started >= self.threshold:
+                slow.append(SlowStatement(end - started, " ".join(sql.split())[:SQL_PREVIEW], frame.method, datetime.now()))
+        with self._stats_lock:
+            stats = self.methods.setdefault(frame.method, MethodStats())
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.lock_wait += frame.lock_wait
+            stats.statements += sum(1 for _, sql in frame.statements if sql is not None)
+            for item in slow:
+                if len(self.slowest) < self.top_n:
+                    heapq.heappush(self.slowest, item)
+                elif item > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, item)
+        for item in slow:
+            SLOW_LOGGER.warning("%.1fms %s: %s", item.seconds * 1000, item.method, item.sql)
+        if elapsed >= self.threshold and not slow:
+            SLOW_LOGGER.warning(
+                "%.1fms %s (lock wait %.1fms, %d statements)",
+                elapsed * 1000,
+                frame.method,
+                frame.lock_wait * 1000,
+                sum(1 for _, sql in frame.statements if sql is not None),
+            )
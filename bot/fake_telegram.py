@@ -0,0 +1,470 @@
+from __future__ import annotations
+
+import argparse
+import email.parser
+import email.policy
+import json
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+BOT_ID = 100000001
+RATE_LIMITED_METHODS = {"sendMessage", "editMessageText", "deleteMessage", "deleteMessages", "answerCallbackQuery", "sendDocument"}
+NOT_MODIFIED = (
+    "Bad Request: message is not modified: specified new message content and reply markup are "
+    "exactly the same as a current content and reply markup of the message"
+)
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, retry_after: int | None = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class FakeBotApi:
+    """In-process stand-in for the Telegram Bot API, for end-to-end runs without Telegram.
+
+    Serves ``/bot<token>/<method>`` for ``getMe``, ``getUpdates`` (long polling),
+    ``sendMessage``, ``editMessageText``, ``deleteMessage``, ``deleteMessages``,
+    ``answerCallbackQuery`` and ``sendDocument`` and keeps the messages of every chat, so edits and deletes fail the
+    way Telegram's do ("message is not modified", "message to delete not found").
+    Every call except ``getUpdates`` sleeps ``latency`` plus up to ``jitter`` seconds.
+    Message calls answer 429 with ``retry_after`` at random with probability ``rate_429``,
+    and always beyond ``chat_limit`` calls per chat per second (0 = no limit).
+    Updates are queued with :meth:`push_update`, :meth:`command`, :meth:`text` and :meth:`tap`,
+    or from another process with ``POST /control/{command,text,tap}``. After ``setWebhook``
+    they are POSTed to the webhook instead, one at a time, with the secret token header;
+    ``deliveries`` counts the HTTP statuses (0 = could not connect).
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        chat_limit: int = 0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.chat_limit = chat_limit
+        self.calls: Counter[str] = Counter()
+        self.errors: Counter[int] = Counter()
+        self.deliveries: Counter[int] = Counter()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._updates: deque[dict] = deque()
+        self._next_update_id = 1
+        self._messages: dict[int, dict[int, dict]] = {}
+        self._next_message_id: dict[int, int] = {}
+        self._chat_calls: dict[int, deque[float]] = {}
+        self._webhook: tuple[str, str | None] | None = None
+        self._outbox: queue.Queue[dict | None] = queue.Queue()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeBotApi":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._deliver, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._outbox.put(None)
+        with self._updates_ready:
+            self._updates_ready.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    # --- updates -----------------------------------------------------------------------
+
+    def push_update(self, update: dict) -> int:
+        """Queue an update (``update_id`` is assigned here) and return its id."""
+        with self._updates_ready:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            if self._webhook is not None:
+                self._outbox.put({**update, "update_id": update_id})
+            else:
+                self._updates.append({**update, "update_id": update_id})
+                self._updates_ready.notify_all()
+        return update_id
+
+    def _deliver(self) -> None:
+        while (update := self._outbox.get()) is not None:
+            with self._lock:
+                webhook = self._webhook
+            if webhook is None:
+                continue
+            url, secret = webhook
+            request = urllib.request.Request(
+                url, data=json.dumps(update).encode("utf-8"), headers={"Content-Type": "application/json"}
+            )
+            if secret:
+                request.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    status = response.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            except OSError:
+                status = 0
+            with self._lock:
+                self.deliveries[status] += 1
+
+    def command(self, chat_id: int, user_id: int, text: str) -> int:
+        command = text.split()[0]
+        entities = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self.push_update({"message": self._user_message(chat_id, user_id, text, entities)})
+
+    def text(self, chat_id: int, user_id: int, text: str) -> int:
+        return self.push_update({"message": self._user_message(chat_id, user_id, text)})
+
+    def tap(self, chat_id: int, user_id: int, data: str) -> int:
+        """A button press on the newest bot message in the chat."""
+        with self._lock:
+            own = [message_id for message_id, message in (self._messages.get(chat_id) or {}).items() if message["from"]["is_bot"]]
+            message = dict(self._messages[chat_id][max(own)]) if own else None
+        query = {"id": str(self._next_update_id), "from": _user(user_id), "chat_instance": str(chat_id), "data": data}
+        if message is not None:
+            query["message"] = message
+        return self.push_update({"callback_query": query})
+
+    def remember(self, message: dict) -> None:
+        """Adopt a message seen elsewhere (a recorded session) so edits and deletes of it work."""
+        chat_id = message.get("chat", {}).get("id")
+        message_id = message.get("message_id")
+        if chat_id is None or message_id is None or not message.get("date"):
+            return
+        with self._lock:
+            self._messages.setdefault(chat_id, {}).setdefault(message_id, dict(message))
+            self._next_message_id[chat_id] = max(self._next_message_id.get(chat_id, 1), message_id + 1)
+
+    def messages(self, chat_id: int) -> list[dict]:
+        with self._lock:
+            return [dict(message) for _, message in sorted((self._messages.get(chat_id) or {}).items())]
+
+    def _user_message(self, chat_id: int, user_id: int, text: str, entities: list | None = None) -> dict:
+        with self._lock:
+            message = {
+                "message_id": self._new_message_id(chat_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+                "from": _user(user_id),
+                "text": text,
+            }
+            if entities:
+                message["entities"] = entities
+            self._messages.setdefault(chat_id, {})[message["message_id"]] = message
+        return message
+
+    def _new_message_id(self, chat_id: int) -> int:
+        # Caller holds the lock. Message ids are per chat, shared by user and bot messages.
+        message_id = self._next_message_id.get(chat_id, 1)
+        self._next_message_id[chat_id] = message_id + 1
+        return message_id
+
+    # --- Bot API methods ---------------------------------------------------------------
+
+    def call(self, method: str, params: dict) -> object:
+        """Run one Bot API method; raises :class:`ApiError` like Telegram would answer."""
+        with self._lock:
+            self.calls[method] += 1
+        if method == "getUpdates":
+            return self._get_updates(params)
+        delay = self.latency + (self._rnd.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            raise ApiError(404, "Not Found: method not found")
+        if method in RATE_LIMITED_METHODS:
+            self._check_flood(_int(params.get("chat_id")))
+        return handler(params)
+
+    def _check_flood(self, chat_id: int | None) -> None:
+        with self._lock:
+            if self.rate_429 and self._rnd.random() < self.rate_429:
+                raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}", self.retry_after)
+            if not self.chat_limit or chat_id is None:
+                return
+            now = time.monotonic()
+            window = self._chat_calls.setdefault(chat_id, deque())
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.chat_limit:
+                raise ApiError(429, f"Too Many Requests: retry after {self.retry_after}", self.retry_after)
+            window.append(now)
+
+    def _get_updates(self, params: dict) -> list[dict]:
+        offset = _int(params.get("offset")) or 0
+        limit = _int(params.get("limit")) or 100
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._updates_ready:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._server_running():
+                    return []
+                self._updates_ready.wait(remaining)
+                while self._updates and self._updates[0]["update_id"] < offset:
+                    self._updates.popleft()
+            return list(self._updates)[:limit]
+
+    def _server_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _api_getMe(self, params: dict) -> dict:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "LifeOS", "username": "lifeos_fake_bot"}
+
+    def _api_setWebhook(self, params: dict) -> bool:
+        url = params.get("url") or ""
+        if not url:
+            return self._api_deleteWebhook(params)
+        with self._lock:
+            self._webhook = (url, params.get("secret_token"))
+            # Like Telegram: updates waiting for getUpdates go to the webhook now.
+            while self._updates:
+                self._outbox.put(self._updates.popleft())
+        return True
+
+    def _api_deleteWebhook(self, params: dict) -> bool:
+        with self._lock:
+            self._webhook = None
+        return True
+
+    def _api_answerCallbackQuery(self, params: dict) -> bool:
+        return True
+
+    def _api_sendMessage(self, params: dict) -> dict:
+        return self._bot_message(params, text=params.get("text", ""))
+
+    def _api_sendDocument(self, params: dict) -> dict:
+        document = params.get("document") or {}
+        name = document.get("filename") or "file"
+        return self._bot_message(
+            params,
+            caption=params.get("caption"),
+            document={"file_id": f"doc-{name}", "file_unique_id": name, "file_name": name, "file_size": document.get("size", 0)},
+        )
+
+    def _api_editMessageText(self, params: dict) -> dict:
+        chat_id, message_id = _int(params.get("chat_id")), _int(params.get("message_id"))
+        markup = _json(params.get("reply_markup"))
+        with self._lock:
+            message = (self._messages.get(chat_id) or {}).get(message_id)
+            if message is None or "text" not in message:
+                raise ApiError(400, "Bad Request: message to edit not found")
+            if message["text"] == params.get("text") and message.get("reply_markup") == markup:
+                raise ApiError(400, NOT_MODIFIED)
+            message["text"] = params.get("text", "")
+            message["edit_date"] = int(time.time())
+            if markup is None:
+                message.pop("reply_markup", None)
+            else:
+                message["reply_markup"] = markup
+            return dict(message)
+
+    def _api_deleteMessage(self, params: dict) -> bool:
+        chat_id, message_id = _int(params.get("chat_id")), _int(params.get("message_id"))
+        with self._lock:
+            if (self._messages.get(chat_id) or {}).pop(message_id, None) is None:
+                raise ApiError(400, "Bad Request: message to delete not found")
+        return True
+
+    def _api_deleteMessages(self, params: dict) -> bool:
+        # Like Telegram: messages that are already gone are skipped, not an error.
+        chat_id = _int(params.get("chat_id"))
+        message_ids = _json(params.get("message_ids")) or []
+        if not 1 <= len(message_ids) <= 100:
+            raise ApiError(400, "Bad Request: message_ids must contain 1-100 ids")
+        with self._lock:
+            messages = self._messages.get(chat_id) or {}
+            for message_id in message_ids:
+                messages.pop(message_id, None)
+        return True
+
+    def _bot_message(self, params: dict, **content) -> dict:
+        chat_id = _int(params.get("chat_id"))
+        if chat_id is None:
+            raise ApiError(400, "Bad Request: chat not found")
+        with self._lock:
+            message = {
+                "message_id": self._new_message_id(chat_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "LifeOS"},
+                **{key: value for key, value in content.items() if value is not None},
+            }
+            markup = _json(params.get("reply_markup"))
+            if markup is not None:
+                message["reply_markup"] = markup
+            self._messages.setdefault(chat_id, {})[message["message_id"]] = message
+            return dict(message)
+
+    # --- HTTP --------------------------------------------------------------------------
+
+    def _handler_class(self):
+        api = self
+
+        class FakeApiHandler(BaseHTTPRequestHandler):
+            server_version = "FakeBotApi/1.0"
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                # Headers and body go out as two writes; with Nagle the body waits for the
+                # client's delayed ACK (~40ms) on a kept-alive connection.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _send_json(self, status: int, payload: dict) -> None:
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The bot hung up, e.g. a long poll cut short by shutdown.
+                    return
+
+            def log_message(self, fmt: str, *args) -> None:
+                return
+
+            def do_POST(self) -> None:
+                self._handle()
+
+            def do_GET(self) -> None:
+                self._handle()
+
+            def _handle(self) -> None:
+                parts = self.path.split("?", 1)[0].strip("/").split("/")
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                params = _parse_body(self.headers.get("Content-Type", ""), body)
+                if parts[0] == "control" and len(parts) == 2 and parts[1] in {"command", "text", "tap"}:
+                    # Lets another process (curl, a driver) play the user: {"chat_id", "user_id", "text"|"data"}.
+                    value = params.get("data") if parts[1] == "tap" else params.get("text")
+                    update_id = getattr(api, parts[1])(_int(params.get("chat_id")), _int(params.get("user_id")), value or "")
+                    self._send_json(200, {"ok": True, "result": update_id})
+                    return
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self._send_json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                try:
+                    result = api.call(parts[1], params)
+                except ApiError as exc:
+                    with api._lock:
+                        api.errors[exc.code] += 1
+                    payload = {"ok": False, "error_code": exc.code, "description": exc.description}
+                    if exc.retry_after is not None:
+                        payload["parameters"] = {"retry_after": exc.retry_after}
+                    self._send_json(exc.code, payload)
+                    return
+                self._send_json(200, {"ok": True, "result": result})
+
+        return FakeApiHandler
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Load"}
+
+
+def _int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _json(value):
+    if value is None or not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def _parse_body(content_type: str, body: bytes) -> dict:
+    """Parameters of a Bot API call: JSON, urlencoded form or multipart (files become name/size)."""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params: dict = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            filename = part.get_filename()
+            if filename is not None:
+                params[name] = {"filename": filename, "size": len(payload)}
+            else:
+                params[name] = payload.decode("utf-8")
+        # Files sent as attach://<name> are referenced from the parameter of the same meaning.
+        for key, value in list(params.items()):
+            if isinstance(value, str) and value.startswith("attach://"):
+                params[key] = params.get(value[len("attach://") :], value)
+        return params
+    return {key: values[-1] for key, values in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for local end-to-end runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every call except getUpdates")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra random latency, up to this much")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probability of a 429 on message calls")
+    parser.add_argument("--chat-limit", type=int, default=0, help="message calls per chat per second before 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    api = FakeBotApi(
+        args.host,
+        args.port,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        chat_limit=args.chat_limit,
+    ).start()
+    print(f"Fake Bot API on {api.url} (TELEGRAM_API_URL={api.url})")
+    try:
+        api._thread.join()
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
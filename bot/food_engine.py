@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+MACRO_KEYS = ("kcal", "protein", "fat", "carb")
+MACRO_WEIGHTS = np.array([1.0, 1.3, 0.8, 1.0])
+EATEN_PENALTY = 0.6
+
+
+@dataclass
+class PortionCatalog:
+    """Portions as an N×4 macro matrix (kcal/protein/fat/carb) plus a product id per row.
+
+    ``portions`` keeps the original dicts in the same row order, so results can be
+    mapped back to labels and codes. ``columns`` is the transposed, contiguous copy of
+    ``macros`` that the scoring loops over; ``product_index`` maps a product name to its id.
+    ``version`` is the database catalog version the rows were loaded at.
+    """
+
+    portions: list[dict]
+    macros: np.ndarray
+    product_ids: np.ndarray
+    products: list[str]
+    version: int = 0
+
+    def __post_init__(self) -> None:
+        self.columns = np.ascontiguousarray(self.macros.T)
+        self.product_index = {product: i for i, product in enumerate(self.products)}
+        self.code_index = {portion["code"]: i for i, portion in enumerate(self.portions)}
+        self.product_rows: dict[int, list[int]] = {}
+        for row, product_id in enumerate(self.product_ids.tolist()):
+            self.product_rows.setdefault(product_id, []).append(row)
+
+    @classmethod
+    def from_portions(cls, portions: list[dict], version: int = 0) -> "PortionCatalog":
+        products: list[str] = []
+        product_index: dict[str, int] = {}
+        ids = []
+        for portion in portions:
+            product = portion["product"]
+            if product not in product_index:
+                product_index[product] = len(products)
+                products.append(product)
+            ids.append(product_index[product])
+        macros = np.array(
+            [[portion["macros"].get(key, 0.0) for key in MACRO_KEYS] for portion in portions],
+            dtype=np.float64,
+        ).reshape(len(portions), len(MACRO_KEYS))
+        return cls(
+            portions=portions,
+            macros=macros,
+            product_ids=np.asarray(ids, dtype=np.int64),
+            products=products,
+            version=version,
+        )
+
+    def __len__(self) -> int:
+        return len(self.portions)
+
+    def by_code(self, code: str) -> dict | None:
+        row = self.code_index.get(code)
+        return self.portions[row] if row is not None else None
+
+    def for_product(self, name: str) -> list[dict]:
+        product_id = self.product_index.get(name)
+        if product_id is None:
+            return []
+        return [self.portions[row] for row in self.product_rows[product_id]]
+
+    def product_mask(self, names: set[str]) -> np.ndarray:
+        """Rows whose product is in ``names``."""
+        wanted = [self.product_index[name] for name in names if name in self.product_index]
+        if not wanted:
+            return np.zeros(len(self), dtype=bool)
+        lookup = np.zeros(len(self.products), dtype=bool)
+        lookup[wanted] = True
+        return lookup[self.product_ids]
+
+
+def macro_vector(values: dict) -> np.ndarray:
+    return np.array([values.get(key, 0.0) for key in MACRO_KEYS], dtype=np.float64)
+
+
+def deficit_score(vector: np.ndarray, target: np.ndarray) -> float:
+    """Weighted squared shortfall of one macro vector below ``target``."""
+    total = 0.0
+    for key in range(len(MACRO_KEYS)):
+        gap = max(0.0, target[key] - vector[key])
+        total += gap * gap * MACRO_WEIGHTS[key]
+    return float(total)
+
+
+def catalog_scores(base: np.ndarray, target: np.ndarray, catalog: PortionCatalog) -> np.ndarray:
+    """``deficit_score(base + portion)`` for every catalog row at once.
+
+    Works column by column on contiguous arrays and keeps the left-to-right summation
+    order of :func:`deficit_score`, so both give bit-identical results.
+    """
+    total = np.zeros(len(catalog))
+    for key in range(len(MACRO_KEYS)):
+        gap = catalog.columns[key] + base[key]
+        np.subtract(target[key], gap, out=gap)
+        np.maximum(gap, 0.0, out=gap)
+        gap *= gap
+        gap *= MACRO_WEIGHTS[key]
+        total += gap
+    return total
+
+
+def top_indices(scores: np.ndarray, candidates: np.ndarray, limit: int) -> np.ndarray:
+    """Up to ``limit`` candidate rows by descending score, ties kept in catalog order."""
+    if len(candidates) > limit:
+        kth = np.partition(scores[candidates], len(candidates) - limit)[len(candidates) - limit]
+        candidates = candidates[scores[candidates] >= kth]
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order[:limit]]
+
+
+def recommend_portions(
+    current: dict,
+    target_mid: dict,
+    catalog: PortionCatalog,
+    *,
+    eaten_products: set[str],
+    max_items: int = 3,
+) -> list[dict]:
+    if not len(catalog) or max_items <= 0:
+        return []
+    target = macro_vector(target_mid)
+    base = macro_vector(current)
+    improvement = deficit_score(base, target) - catalog_scores(base, target, catalog)
+    penalty = np.where(catalog.product_mask(eaten_products), EATEN_PENALTY, 1.0)
+    scores = improvement * penalty
+    candidates = np.flatnonzero(improvement > 0)
+    return [catalog.portions[i] for i in top_indices(scores, candidates, max_items)]
+
+
+def build_plan(
+    current: dict,
+    target_mid: dict,
+    catalog: PortionCatalog,
+    *,
+    eaten_products: set[str],
+    max_steps: int = 4,
+) -> list[dict]:
+    """Greedy plan: repeatedly add the best portion, penalizing products already used."""
+    rows = greedy_rows(current, target_mid, catalog, eaten_products=eaten_products, max_steps=max_steps)
+    return [catalog.portions[i] for i in rows]
+
+
+def greedy_rows(
+    current: dict,
+    target_mid: dict,
+    catalog: PortionCatalog,
+    *,
+    eaten_products: set[str],
+    max_steps: int = 4,
+) -> list[int]:
+    if not len(catalog):
+        return []
+    target = macro_vector(target_mid)
+    temp = macro_vector(current)
+    penalized = catalog.product_mask(eaten_products)
+    rows: list[int] = []
+    for _ in range(max_steps):
+        improvement = deficit_score(temp, target) - catalog_scores(temp, target, catalog)
+        candidates = np.flatnonzero(improvement > 0)
+        if not len(candidates):
+            break
+        scores = improvement * np.where(penalized, EATEN_PENALTY, 1.0)
+        choice = int(top_indices(scores, candidates, 1)[0])
+        rows.append(choice)
+        penalized |= catalog.product_ids == catalog.product_ids[choice]
+        temp = temp + catalog.macros[choice]
+    return rows
+
+
+OVERSHOOT_FACTOR = 1.5
+EATEN_COST_SHARE = 0.05
+PLAN_CANDIDATES = 24
+PLAN_TIME_BUDGET = 0.05
+
+
+@dataclass
+class MealPlan:
+    """Chosen ``(portion, quantity)`` pairs and the objective they reach.
+
+    ``complete`` means the shortlist of candidate portions was searched to the end, so
+    the plan is optimal among those portions (not over the whole catalog). It is False
+    when the search hit its time budget and returned the best plan found so far (never
+    worse than the greedy one).
+    """
+
+    items: list[tuple[dict, int]]
+    score: float
+    complete: bool
+
+
+def plan_score(vector, target) -> float:
+    """Weighted squared distance to ``target``; overshooting costs ``OVERSHOOT_FACTOR`` more."""
+    total = 0.0
+    for key in range(len(MACRO_KEYS)):
+        gap = target[key] - vector[key]
+        weight = MACRO_WEIGHTS[key] if gap > 0 else MACRO_WEIGHTS[key] * OVERSHOOT_FACTOR
+        total += gap * gap * weight
+    return float(total)
+
+
+def catalog_plan_scores(base: np.ndarray, target: np.ndarray, catalog: PortionCatalog) -> np.ndarray:
+    """``plan_score(base + portion)`` for every catalog row."""
+    total = np.zeros(len(catalog))
+    for key in range(len(MACRO_KEYS)):
+        gap = target[key] - (catalog.columns[key] + base[key])
+        weight = np.where(gap > 0, MACRO_WEIGHTS[key], MACRO_WEIGHTS[key] * OVERSHOOT_FACTOR)
+        total += gap * gap * weight
+    return total
+
+
+def optimize_plan(
+    current: dict,
+    target_mid: dict,
+    catalog: PortionCatalog,
+    *,
+    eaten_products: set[str],
+    max_items: int = 4,
+    max_qty: int = 2,
+    candidates: int = PLAN_CANDIDATES,
+    time_budget: float = PLAN_TIME_BUDGET,
+) -> MealPlan:
+    """Best integer portion quantities for the rest of the day (branch and bound).
+
+    Minimizes :func:`plan_score` of the final macros plus a fixed cost for every
+    product already eaten today (``EATEN_COST_SHARE`` of the starting score). At most
+    ``max_items`` portions in total, ``max_qty`` of each, and every product at most once.
+    The search runs over the ``candidates`` portions that improve the score most on
+    their own; the greedy :func:`build_plan` result, with repeated products folded or
+    dropped, is the starting incumbent.
+    """
+    target = macro_vector(target_mid)
+    base = macro_vector(current)
+    base_score = plan_score(base, target)
+    if not len(catalog) or max_items <= 0:
+        return MealPlan([], base_score, True)
+
+    single = base_score - catalog_plan_scores(base, target, catalog)
+    shortlist = top_indices(single, np.flatnonzero(single > 0), candidates)
+    if not len(shortlist):
+        return MealPlan([], base_score, True)
+
+    eaten_cost = EATEN_COST_SHARE * base_score
+    eaten_mask = catalog.product_mask(eaten_products)
+    rows = [tuple(float(x) for x in catalog.macros[i]) for i in shortlist]
+    products = [int(catalog.product_ids[i]) for i in shortlist]
+    eaten = [bool(eaten_mask[i]) for i in shortlist]
+    target_t = tuple(float(x) for x in target)
+    weights = tuple(float(w) for w in MACRO_WEIGHTS)
+    over_weights = tuple(w * OVERSHOOT_FACTOR for w in weights)
+    keys = range(len(MACRO_KEYS))
+    # Largest single-portion contribution per macro among shortlist[i:].
+    suffix_max = [[0.0] * len(MACRO_KEYS) for _ in range(len(rows) + 1)]
+    for i in range(len(rows) - 1, -1, -1):
+        suffix_max[i] = [max(rows[i][k], suffix_max[i + 1][k]) for k in keys]
+
+    def lower_bound(vec, slots: int, start: int) -> float:
+        # Macros only grow: an overshoot stays, a deficit shrinks by at most slots × max portion.
+        reach = suffix_max[start]
+        bound = 0.0
+        for k in keys:
+            gap = target_t[k] - vec[k]
+            if gap > 0:
+                gap = max(0.0, gap - slots * reach[k])
+                bound += gap * gap * weights[k]
+            else:
+                bound += gap * gap * over_weights[k]
+        return bound
+
+    # Plans are kept as (catalog row, quantity) pairs.
+    best_cost = base_score
+    best_items: list[tuple[int, int]] = []
+    greedy = greedy_rows(current, target_mid, catalog, eaten_products=eaten_products, max_steps=max_items)
+    # greedy_rows only penalises repeats: fold a repeated row into its quantity (up to
+    # max_qty) and drop other portions of a product already in the plan.
+    incumbent: dict[int, int] = {}
+    product_rows: dict[int, int] = {}
+    for row in greedy:
+        if product_rows.setdefault(int(catalog.product_ids[row]), row) == row and incumbent.get(row, 0) < max_qty:
+            incumbent[row] = incumbent.get(row, 0) + 1
+    if incumbent:
+        vec = base + sum(catalog.macros[row] * qty for row, qty in incumbent.items())
+        greedy_cost = plan_score(vec, target) + eaten_cost * sum(bool(eaten_mask[row]) for row in incumbent)
+        if greedy_cost < best_cost:
+            best_cost = greedy_cost
+            best_items = list(incumbent.items())
+
+    deadline = time.perf_counter() + time_budget
+    nodes = 0
+    timed_out = False
+    chosen: list[tuple[int, int]] = []
+    used: set[int] = set()
+
+    def search(start: int, vec: tuple, slots: int, cost_so_far: float) -> None:
+        nonlocal best_cost, best_items, nodes, timed_out
+        nodes += 1
+        if nodes & 255 == 0 and time.perf_counter() > deadline:
+            timed_out = True
+        if timed_out:
+            return
+        score = plan_score(vec, target_t) + cost_so_far
+        if score < best_cost - 1e-9:
+            best_cost = score
+            best_items = [(int(shortlist[i]), qty) for i, qty in chosen]
+        if slots == 0 or start >= len(rows):
+            return
+        if lower_bound(vec, slots, start) + cost_so_far >= best_cost - 1e-9:
+            return
+        for i in range(start, len(rows)):
+            if products[i] in used:
+                continue
+            used.add(products[i])
+            extra = eaten_cost if eaten[i] else 0.0
+            row = rows[i]
+            for qty in range(1, min(max_qty, slots) + 1):
+                chosen.append((i, qty))
+                search(i + 1, tuple(vec[k] + qty * row[k] for k in keys), slots - qty, cost_so_far + extra)
+                chosen.pop()
+            used.discard(products[i])
+
+    search(0, tuple(float(x) for x in base), max_items, 0.0)
+    return MealPlan([(catalog.portions[row], qty) for row, qty in best_items], best_cost, not timed_out)
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+from dotenv import load_dotenv
+
+from db import IMPORT_CHUNK_SIZE, Database, FoodRecord, ImportStats
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+KJ_PER_KCAL = 4.184
+MAX_KCAL_100 = 900.0
+MAX_NAME_LEN = 120
+
+
+def _number(value) -> float | None:
+    if value is None or value == "":
+        return None
+    try:
+        number = float(str(value).replace(",", "."))
+    except ValueError:
+        return None
+    return number if number == number else None
+
+
+def _name_fields(lang: str | None) -> tuple[str, ...]:
+    fields = ("product_name", "generic_name")
+    if lang:
+        fields = (f"product_name_{lang}", *fields, f"generic_name_{lang}")
+    return fields
+
+
+def to_record(row: dict, nutriments: dict, lang: str | None = None, with_brand: bool = True) -> FoodRecord | None:
+    """Map one Open Food Facts product to a :class:`FoodRecord` (``None`` if unusable).
+
+    Products without a name or without all four values per 100 g are skipped, as are
+    values that cannot be per 100 g (negative macros, more than 100 g, more than 900 kcal).
+    """
+    name = next((str(row[field]).strip() for field in _name_fields(lang) if row.get(field)), "")
+    if not name:
+        return None
+    brand = str(row.get("brands") or "").split(",")[0].strip()
+    if with_brand and brand and brand.lower() not in name.lower():
+        name = f"{name} ({brand})"
+    name = " ".join(name.split())[:MAX_NAME_LEN]
+
+    kcal = _number(nutriments.get("energy-kcal_100g"))
+    if kcal is None:
+        kj = _number(nutriments.get("energy-kj_100g"))
+        if kj is None:
+            kj = _number(nutriments.get("energy_100g"))
+        kcal = kj / KJ_PER_KCAL if kj is not None else None
+    protein = _number(nutriments.get("proteins_100g"))
+    fat = _number(nutriments.get("fat_100g"))
+    carb = _number(nutriments.get("carbohydrates_100g"))
+    if kcal is None or protein is None or fat is None or carb is None:
+        return None
+    if min(kcal, protein, fat, carb) < 0 or max(protein, fat, carb) > 100 or kcal > MAX_KCAL_100:
+        return None
+    barcode = str(row.get("code") or "").strip() or None
+    return FoodRecord(name, round(protein, 1), round(fat, 1), round(carb, 1), round(kcal), barcode)
+
+
+class _Source:
+    """Text stream over a plain or gzipped file that knows how far into the file it is."""
+
+    def __init__(self, path: Path):
+        self.size = path.stat().st_size
+        self._raw = path.open("rb")
+        stream = gzip.GzipFile(fileobj=self._raw) if path.suffix == ".gz" else self._raw
+        self.text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+
+    def fraction(self) -> float:
+        return self._raw.tell() / self.size if self.size else 1.0
+
+    def close(self) -> None:
+        self.text.close()
+        self._raw.close()
+
+
+def detect_format(path: Path) -> str:
+    suffixes = [suffix.lower() for suffix in path.suffixes if suffix.lower() != ".gz"]
+    return "jsonl" if suffixes and suffixes[-1] in (".jsonl", ".json", ".ndjson") else "csv"
+
+
+def read_csv(text: io.TextIOBase, lang: str | None = None, with_brand: bool = True) -> Iterator[FoodRecord | None]:
+    """Records from the Open Food Facts CSV export (tab-separated) or any CSV with the same columns.
+
+    Yields ``None`` for rows that were skipped, so callers can count them.
+    """
+    csv.field_size_limit(sys.maxsize)
+    header = text.readline()
+    delimiter = "\t" if "\t" in header else ","
+    columns = next(csv.reader([header], delimiter=delimiter))
+    # The official export is tab-separated without quoting; quotes are part of the values.
+    quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+    reader = csv.DictReader(text, fieldnames=columns, delimiter=delimiter, quoting=quoting)
+    for row in reader:
+        yield to_record(row, row, lang, with_brand)
+
+
+def read_jsonl(text: io.TextIOBase, lang: str | None = None, with_brand: bool = True) -> Iterator[FoodRecord | None]:
+    """Records from the Open Food Facts JSONL dump (one product object per line)."""
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            product = json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+            continue
+        yield to_record(product, product.get("nutriments") or {}, lang, with_brand)
+
+
+def import_file(
+    db: Database,
+    path: Path,
+    *,
+    fmt: str | None = None,
+    lang: str | None = None,
+    with_brand: bool = True,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    limit: int | None = None,
+    progress: Callable[[ImportStats, float], None] | None = None,
+) -> ImportStats:
+    """Stream ``path`` into ``food_items``; ``progress(stats, fraction_of_file)`` after each chunk."""
+    source = _Source(path)
+    rejected = 0
+    reader = read_jsonl if (fmt or detect_format(path)) == "jsonl" else read_csv
+
+    def records() -> Iterator[FoodRecord]:
+        nonlocal rejected
+        for seen, record in enumerate(reader(source.text, lang, with_brand)):
+            if limit is not None and seen >= limit:
+                return
+            if record is None:
+                rejected += 1
+            else:
+                yield record
+
+    def report(stats: ImportStats) -> None:
+        if progress:
+            progress(_with_rejected(stats, rejected), source.fraction())
+
+    try:
+        stats = db.import_food_items(records(), chunk_size=chunk_size, progress=report)
+    finally:
+        source.close()
+    return _with_rejected(stats, rejected)
+
+
+def _with_rejected(stats: ImportStats, rejected: int) -> ImportStats:
+    return ImportStats(
+        processed=stats.processed + rejected,
+        inserted=stats.inserted,
+        updated=stats.updated,
+        skipped=stats.skipped + rejected,
+    )
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Import an Open Food Facts CSV/JSONL dump into food_items")
+    parser.add_argument("path", type=Path, help=".csv/.tsv/.jsonl, optionally .gz")
+    parser.add_argument("--db", type=Path, default=Path(os.getenv("DB_PATH", "data/lifeos.db").strip()))
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: by file extension")
+    parser.add_argument("--lang", default="ru", help="prefer product_name_<lang> when present (empty to disable)")
+    parser.add_argument("--no-brand", action="store_true", help="do not append the brand to product names")
+    parser.add_argument("--chunk", type=int, default=IMPORT_CHUNK_SIZE, help="records per transaction")
+    parser.add_argument("--limit", type=int, help="stop after this many source rows")
+    args = parser.parse_args()
+
+    db_path = args.db if args.db.is_absolute() else BASE_DIR / args.db
+    db = Database(str(db_path))
+    db.init_schema()
+    # Seed the shipped catalog first: seeding is skipped once food_items is non-empty.
+    db.seed_from_csv(str(BASE_DIR / "data/food_items.csv"), str(BASE_DIR / "data/portions.csv"))
+    started = time.perf_counter()
+
+    def progress(stats: ImportStats, fraction: float) -> None:
+        elapsed = time.perf_counter() - started
+        print(
+            f"\r{fraction:>4.0%}  {stats.processed:>9} rows  +{stats.inserted} ~{stats.updated} "
+            f"-{stats.skipped}  {stats.processed / max(elapsed, 1e-9):>7.0f} rows/s",
+            end="",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    try:
+        stats = import_file(
+            db,
+            args.path,
+            fmt=args.format,
+            lang=args.lang or None,
+            with_brand=not args.no_brand,
+            chunk_size=args.chunk,
+            limit=args.limit,
+            progress=progress,
+        )
+    finally:
+        db.close()
+    print(file=sys.stderr)
+    print(
+        f"{stats.processed} rows in {time.perf_counter() - started:.1f}s: "
+        f"{stats.inserted} inserted, {stats.updated} updated, {stats.skipped} skipped"
+    )
+
+
+if __name__ == "__main__":
+    main()
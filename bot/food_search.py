@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import re
+
+
+WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """Lowercase, ``ё`` → ``е``, punctuation collapsed to single spaces."""
+    return " ".join(WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of every word, padded so short words and word starts still match."""
+    grams: set[str] = set()
+    for word in normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(query_grams: set[str], text: str) -> float:
+    """Dice coefficient between the query trigrams and the trigrams of ``text``."""
+    text_grams = trigrams(text)
+    if not query_grams or not text_grams:
+        return 0.0
+    return 2 * len(query_grams & text_grams) / (len(query_grams) + len(text_grams))
+
+
+def fts_query(text: str) -> str | None:
+    """FTS5 expression matching any unpadded trigram of ``text`` (for the trigram tokenizer)."""
+    grams: set[str] = set()
+    for word in normalize(text).split():
+        grams.update(word[i : i + 3] for i in range(len(word) - 2))
+    if not grams:
+        return None
+    return " OR ".join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams))
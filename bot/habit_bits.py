@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+
+def weekday_mask(start: date, span: int, weekday: int) -> int:
+    """Bits set for every day in ``[start, start + span)`` that falls on ``weekday``."""
+    offset = (weekday - start.weekday()) % 7
+    if offset >= span:
+        return 0
+    count = (span - offset + 6) // 7
+    # 1 + 2**7 + 2**14 + ... has one bit per week.
+    return ((1 << (7 * count)) - 1) // 127 << offset
+
+
+@dataclass
+class HabitBitmap:
+    """Completion history of one habit: bit ``i`` is the day ``start + i``.
+
+    Stored in ``habits.bitmap`` as little-endian bytes; ``start`` is the first day the
+    habit was ever marked (``None`` for an empty history).
+    """
+
+    start: date | None = None
+    bits: int = 0
+
+    @classmethod
+    def from_blob(cls, start: str | None, blob: bytes | None) -> "HabitBitmap":
+        if not start or not blob:
+            return cls()
+        return cls(date.fromisoformat(start), int.from_bytes(blob, "little"))
+
+    def to_blob(self) -> bytes | None:
+        if not self.bits:
+            return None
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+
+    def get(self, day: date) -> bool:
+        if self.start is None or day < self.start:
+            return False
+        return bool(self.bits >> (day - self.start).days & 1)
+
+    def set(self, day: date, done: bool) -> None:
+        if self.start is None:
+            if not done:
+                return
+            self.start = day
+        if day < self.start:
+            if not done:
+                return
+            self.bits <<= (self.start - day).days
+            self.start = day
+        bit = 1 << (day - self.start).days
+        self.bits = self.bits | bit if done else self.bits & ~bit
+        if not self.bits:
+            self.start = None
+
+    def window(self, start: date, end: date) -> int:
+        """Bits for ``[start, end]`` re-based so that bit 0 is ``start``."""
+        span = (end - start).days + 1
+        if self.start is None or span <= 0:
+            return 0
+        shift = (start - self.start).days
+        bits = self.bits >> shift if shift >= 0 else self.bits << -shift
+        return bits & ((1 << span) - 1)
+
+    def count(self, start: date, end: date) -> int:
+        return self.window(start, end).bit_count()
+
+    def rate(self, start: date, end: date) -> float:
+        span = (end - start).days + 1
+        return self.count(start, end) / span if span > 0 else 0.0
+
+    def weekday_counts(self, start: date, end: date) -> list[int]:
+        """Completed days per weekday (Mon..Sun) within ``[start, end]``."""
+        span = (end - start).days + 1
+        bits = self.window(start, end)
+        return [(bits & weekday_mask(start, span, weekday)).bit_count() for weekday in range(7)]
+
+    def days(self) -> list[date]:
+        if self.start is None:
+            return []
+        out = []
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            out.append(self.start + timedelta(days=low.bit_length() - 1))
+            bits ^= low
+        return out
+
+
+def co_occurrence(a: HabitBitmap, b: HabitBitmap, start: date, end: date) -> int:
+    """Days within ``[start, end]`` on which both habits were done."""
+    return (a.window(start, end) & b.window(start, end)).bit_count()
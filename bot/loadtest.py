@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import socket
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app import build_application, start_webhook
+from config import Config
+from db import Database
+from fake_telegram import FakeBotApi
+from synthetic import generate_history
+from tracing import Trace
+
+
+CHAT_ID = 424242
+UPDATE_TIMEOUT = 10.0
+WEBHOOK_SECRET = "loadtest-secret"
+
+# Steps: "/command ...", "tap:<callback data>" or "text:<message>". Every scenario opens
+# the summary first so taps have a bot message to press on.
+SCENARIOS: dict[str, list[str]] = {
+    "morning": [
+        "/start",
+        "tap:menu:sport",
+        "tap:sport:training",
+        "tap:set:training:Верх",
+        "tap:menu:study",
+        "tap:study:english",
+        "tap:set:english:30",
+        "tap:menu:main",
+    ],
+    "food": [
+        "/start",
+        "tap:menu:food",
+        "tap:food:protein",
+        "tap:food_item:CURD_180",
+        "tap:food_qty:CURD_180:1",
+        "tap:menu:food",
+        "tap:food:search",
+        "text:твраог",
+        "tap:menu:main",
+    ],
+    "stats": ["/start", "tap:stats:week", "tap:stats:month", "tap:stats:all", "tap:stats:back"],
+    "journal": [
+        "/start",
+        "tap:menu:morale",
+        "tap:morale:review",
+        "text:нормальный день, читал вечером",
+        "/find читал",
+        "tap:menu:main",
+    ],
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` (``q`` in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def load_steps(names: list[str], script: Path | None) -> list[str]:
+    if script is not None:
+        steps = json.loads(script.read_text(encoding="utf-8"))
+        if not isinstance(steps, list) or not all(isinstance(step, str) for step in steps):
+            raise ValueError(f"{script}: expected a JSON list of step strings")
+        return steps
+    return [step for name in names for step in SCENARIOS[name]]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def send_step(api: FakeBotApi, user_id: int, step: str) -> int:
+    if step.startswith("/"):
+        return api.command(CHAT_ID, user_id, step)
+    kind, _, value = step.partition(":")
+    if kind == "tap":
+        return api.tap(CHAT_ID, user_id, value)
+    if kind == "text":
+        return api.text(CHAT_ID, user_id, value)
+    raise ValueError(f"unknown step {step!r}")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    steps = load_steps(args.scenario, args.script)
+    user_id = 777
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "load.db"
+        generate_history(db_path, args.years)
+        api = FakeBotApi(
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            rate_429=args.rate_429,
+            chat_limit=args.chat_limit,
+            seed=1,
+        ).start()
+        webhook_port = free_port() if args.webhook else 0
+        config = Config(
+            telegram_token=f"{100000001}:fake",
+            db_path=str(db_path),
+            timezone="Europe/Moscow",
+            allowed_user_id=user_id,
+            webapp_url="",
+            export_dir=tmp,
+            sync_http_host="127.0.0.1",
+            sync_http_port=webhook_port,
+            sync_http_token="",
+            backup_interval_hours=0,
+            maintenance_time="",
+            trace_slow_ms=0,
+            telegram_api_url=api.url,
+            tg_rate_chat=args.chat_rate,
+            telegram_mode="webhook" if args.webhook else "polling",
+            webhook_url=f"http://127.0.0.1:{webhook_port}/telegram" if args.webhook else "",
+            webhook_secret=WEBHOOK_SECRET if args.webhook else "",
+        )
+        db = Database(str(db_path))
+        app = build_application(config, db)
+
+        loop = asyncio.get_running_loop()
+        sent_at: dict[int, float] = {}
+        pending: dict[int, asyncio.Future] = {}
+        samples: list[tuple[str, float, float]] = []
+
+        def on_trace(trace: Trace, ended: float) -> None:
+            if trace.update_id not in sent_at:
+                return
+            samples.append((trace.route, ended - sent_at[trace.update_id], ended - trace.started))
+            future = pending.pop(trace.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+        app.bot_data["tracer"].add_listener(on_trace)
+        await app.initialize()
+        await app.start()
+        if args.webhook:
+            server = await start_webhook(app, config, db)
+        else:
+            await app.updater.start_polling(poll_interval=0.0, timeout=1)
+        slots = asyncio.Semaphore(args.inflight)
+        timeouts = 0
+
+        async def fire(step: str) -> None:
+            nonlocal timeouts
+            async with slots:
+                future = loop.create_future()
+                sent = time.perf_counter()
+                update_id = send_step(api, user_id, step)
+                sent_at[update_id] = sent
+                pending[update_id] = future
+                try:
+                    await asyncio.wait_for(future, UPDATE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    timeouts += 1
+                    pending.pop(update_id, None)
+
+        started = time.perf_counter()
+        try:
+            tasks = []
+            for step in itertools.islice(itertools.cycle(steps), args.updates):
+                # Taps refer to the bot's newest message, so keep order within one in-flight slot.
+                if args.inflight == 1:
+                    await fire(step)
+                else:
+                    tasks.append(asyncio.create_task(fire(step)))
+            await asyncio.gather(*tasks)
+        finally:
+            elapsed = time.perf_counter() - started
+            if args.webhook:
+                server.shutdown()
+                server.server_close()
+            else:
+                await app.updater.stop()
+            await app.stop()
+            await app.shutdown()
+            api.stop()
+            db.close()
+
+    end_to_end = [sample[1] * 1000 for sample in samples]
+    handler = [sample[2] * 1000 for sample in samples]
+    routes: dict[str, list[float]] = {}
+    for route, _, seconds in samples:
+        routes.setdefault(route, []).append(seconds * 1000)
+    return {
+        "updates": len(samples),
+        "timeouts": timeouts,
+        "seconds": elapsed,
+        "updates_per_sec": len(samples) / elapsed if elapsed else 0.0,
+        "end_to_end_ms": {q: percentile(end_to_end, q) for q in (50, 90, 99, 100)},
+        "handler_ms": {q: percentile(handler, q) for q in (50, 90, 99, 100)},
+        "api_calls": dict(api.calls),
+        "api_errors": {str(code): count for code, count in api.errors.items()},
+        "webhook_deliveries": {str(status): count for status, count in api.deliveries.items()},
+        "outbound": dict(app.bot_data["outbound"].stats),
+        "routes": {route: (len(values), statistics.median(values)) for route, values in routes.items()},
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['updates']} updates in {report['seconds']:.1f}s: {report['updates_per_sec']:.1f} updates/s"
+        + (f", {report['timeouts']} timed out" if report["timeouts"] else "")
+    )
+    for label, key in (("end-to-end", "end_to_end_ms"), ("handler", "handler_ms")):
+        values = report[key]
+        print(f"{label:>11} ms  p50 {values[50]:7.1f}  p90 {values[90]:7.1f}  p99 {values[99]:7.1f}  max {values[100]:7.1f}")
+    calls = report["api_calls"]
+    api_total = sum(count for method, count in calls.items() if method != "getUpdates")
+    print(f"Bot API: {api_total} calls ({api_total / max(report['updates'], 1):.1f}/update), errors {report['api_errors'] or '—'}")
+    print(f"Outbound queue: {report['outbound'] or '—'}")
+    if report["webhook_deliveries"]:
+        print(f"Webhook deliveries by status: {report['webhook_deliveries']}")
+    print(f"{'route':<28} {'n':>5} {'median ms':>10}")
+    for route, (count, median) in sorted(report["routes"].items(), key=lambda item: -item[1][1]):
+        print(f"{route:<28} {count:>5} {median:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive the bot end to end against the fake Bot API")
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--script", type=Path, help="JSON list of steps instead of the built-in scenarios")
+    parser.add_argument("--updates", type=int, default=200, help="total updates; the steps repeat")
+    parser.add_argument("--inflight", type=int, default=1, help="updates sent before waiting for a result")
+    parser.add_argument("--years", type=float, default=2, help="synthetic history in the test database")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--chat-limit", type=int, default=0)
+    parser.add_argument("--chat-rate", type=float, default=0.0, help="bot-side per-chat limit, calls/s (0 = off)")
+    parser.add_argument("--webhook", action="store_true", help="deliver updates to the webhook instead of getUpdates")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    # app.py logs every request at INFO; keep the report readable.
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
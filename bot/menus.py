@@ -229,6 +229,8 @@ FOOD_MENU = [
     ("Сладкое", "food:sweet"),
     ("Масла", "food:oils"),
     ("Другое", "food:custom"),
+    ("Поиск", "food:search"),
+    ("Шаблоны", "food:meals"),
 ]
 
 FOOD_PROTEIN_OPTIONS = [
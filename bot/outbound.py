@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from tracing import span
+
+
+LOGGER = logging.getLogger("lifeos-bot.outbound")
+
+# Lower goes first. Callback answers stop the button spinner; deletes only tidy the chat.
+PRIORITY_ANSWER = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BACKGROUND = 2
+ENDPOINT_PRIORITY = {
+    "answerCallbackQuery": PRIORITY_ANSWER,
+    "deleteMessage": PRIORITY_BACKGROUND,
+    "deleteMessages": PRIORITY_BACKGROUND,
+}
+EDIT_METHODS = {"editMessageText", "editMessageReplyMarkup", "editMessageCaption"}
+# deleteMessages takes at most this many ids per call.
+DELETE_BATCH = 100
+# Independent Telegram calls of one handler in flight at once.
+GATHER_LIMIT = 4
+# Deferred calls still queued at shutdown get this long to go out.
+DRAIN_TIMEOUT = 5.0
+
+_BACKGROUND: ContextVar[bool] = ContextVar("lifeos_outbound_background", default=False)
+
+
+@contextmanager
+def background() -> Iterator[None]:
+    """Run the Bot API calls made inside at background priority (jobs, not the user waiting)."""
+    token = _BACKGROUND.set(True)
+    try:
+        yield
+    finally:
+        _BACKGROUND.reset(token)
+
+
+def in_background(job):
+    """Job callback wrapper: everything the job sends goes at background priority."""
+
+    @functools.wraps(job)
+    async def wrapper(context):
+        with background():
+            return await job(context)
+
+    return wrapper
+
+
+@dataclass(frozen=True)
+class OutboundArgs:
+    """``rate_limit_args`` for a single call: priority override, or don't wait for the result."""
+
+    priority: int | None = None
+    wait: bool = True
+
+
+DEFERRED_DELETE = OutboundArgs(priority=PRIORITY_BACKGROUND, wait=False)
+DEFERRED_ANSWER = OutboundArgs(priority=PRIORITY_ANSWER, wait=False)
+
+
+async def gather_bounded(*aws, limit: int = GATHER_LIMIT) -> list:
+    """``asyncio.gather`` for independent Telegram operations, at most ``limit`` at a time."""
+    slots = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with slots:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+class _Bucket:
+    """Token bucket; ``rate`` 0 means unlimited. ``blocked_until`` comes from a 429."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not self.rate:
+            return 0.0
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate) - 1
+            self.stamp = now
+
+
+class _Superseded(Exception):
+    """A queued edit was replaced by a newer edit of the same message before it went out."""
+
+    def __init__(self, result: asyncio.Future):
+        super().__init__("superseded")
+        self.result = result
+
+
+@dataclass(order=True)
+class _Queued:
+    priority: int
+    seq: int
+    endpoint: str = field(compare=False)
+    chat_id: Any = field(compare=False)
+    key: tuple | None = field(compare=False)
+    turn: asyncio.Future = field(compare=False)
+    # Outcome of the call, shared with edits collapsed into this one.
+    result: asyncio.Future = field(compare=False)
+
+
+class OutboundLimiter(BaseRateLimiter[OutboundArgs]):
+    """Every Bot API call goes through here: rate limits, ``retry_after``, priorities, collapsing.
+
+    A call goes out at once while the global and per-chat token buckets allow it;
+    otherwise it waits in a queue served by priority (callback answers, then
+    interactive sends and edits, then deletes and job traffic), oldest first. A 429
+    blocks the chat (or everything, for calls without a chat) for ``retry_after`` and
+    the call is queued again, up to ``max_retries`` times.
+
+    While queued, an edit is dropped when a newer edit of the same message arrives
+    (both callers get the newer result) or when the message is deleted (the edit
+    fails as "message to edit not found", as it would at Telegram; ``deleteMessages``
+    too), and deletes of the same message share one call. ``OutboundArgs(wait=False)`` returns ``True``
+    immediately and sends in the background; failures are only logged.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: int = 20, max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.stats: Counter[str] = Counter()
+        self._global = _Bucket(global_rate, int(global_rate))
+        self._chats: dict[Any, _Bucket] = {}
+        self._queue: list[_Queued] = []
+        self._edits: dict[tuple, _Queued] = {}
+        self._deletes: dict[tuple, asyncio.Future] = {}
+        self._seq = itertools.count()
+        self._tasks: set[asyncio.Task] = set()
+        self._wake: asyncio.Event | None = None
+        self._pump_task: asyncio.Task | None = None
+
+    async def initialize(self) -> None:
+        # Called again by the updater's bot.initialize(); keep the first pump.
+        if self._pump_task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump(), name="outbound-pump")
+
+    async def shutdown(self) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=DRAIN_TIMEOUT)
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        options = rate_limit_args or OutboundArgs()
+        priority = options.priority
+        if priority is None:
+            priority = PRIORITY_BACKGROUND if _BACKGROUND.get() else ENDPOINT_PRIORITY.get(endpoint, PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        message_id = data.get("message_id")
+        key = (chat_id, message_id) if chat_id is not None and message_id is not None else None
+        if endpoint == "deleteMessages" and chat_id is not None:
+            for deleted in data.get("message_ids") or ():
+                self._drop_edits((chat_id, deleted))
+        if options.wait:
+            return await self._send(callback, args, kwargs, endpoint, priority, chat_id, key)
+        task = asyncio.create_task(self._send_quietly(callback, args, kwargs, endpoint, priority, chat_id, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.stats["deferred"] += 1
+        return True
+
+    async def _send_quietly(self, *call) -> None:
+        endpoint = call[3]
+        try:
+            await self._send(*call)
+        except (BadRequest, Forbidden) as exc:
+            LOGGER.debug("%s: %s", endpoint, exc)
+        except TelegramError as exc:
+            LOGGER.warning("%s failed: %s", endpoint, exc)
+
+    async def _send(self, callback, args, kwargs, endpoint, priority, chat_id, key):
+        if endpoint == "deleteMessage" and key is not None:
+            earlier = self._deletes.get(key)
+            if earlier is not None:
+                self.stats["collapsed"] += 1
+                return await asyncio.shield(earlier)
+            self._drop_edits(key)
+        loop = asyncio.get_running_loop()
+        op = _Queued(priority, next(self._seq), endpoint, chat_id, key, loop.create_future(), loop.create_future())
+        # Nobody may await the shared outcome; don't warn about an unretrieved exception.
+        op.result.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if endpoint == "deleteMessage" and key is not None:
+            self._deletes[key] = op.result
+        try:
+            try:
+                result = await self._run(op, callback, args, kwargs)
+            except _Superseded as exc:
+                self.stats["collapsed"] += 1
+                result = await asyncio.shield(exc.result)
+        except BaseException as exc:
+            self._settle(op.result, exception=exc)
+            raise
+        else:
+            self._settle(op.result, result)
+        finally:
+            if endpoint == "deleteMessage" and key is not None and self._deletes.get(key) is op.result:
+                del self._deletes[key]
+        return result
+
+    async def _run(self, op: _Queued, callback, args, kwargs):
+        for attempt in itertools.count():
+            await self._turn(op)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                self.stats["retried"] += 1
+                delay = _seconds(exc.retry_after) + 0.1
+                LOGGER.warning("%s: 429, retry %d in %.1fs", op.endpoint, attempt + 1, delay)
+                bucket = self._global if op.chat_id is None else self._chat(op.chat_id)
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+                loop = asyncio.get_running_loop()
+                op.turn = loop.create_future()
+
+    async def _turn(self, op: _Queued) -> None:
+        now = time.monotonic()
+        if not self._queue and self._ready(op.chat_id, now):
+            self._take(op.chat_id, now)
+            return
+        if op.endpoint in EDIT_METHODS and op.key is not None:
+            edit_key = (op.endpoint, *op.key)
+            earlier = self._edits.pop(edit_key, None)
+            if earlier is not None:
+                self._settle(earlier.turn, exception=_Superseded(op.result))
+            self._edits[edit_key] = op
+        self._queue.append(op)
+        self._wake.set()
+        with span(f"queue.{op.endpoint}"):
+            await op.turn
+
+    def _pump_once(self, now: float) -> float | None:
+        """Release what the buckets allow, by priority; return the wait until the next release."""
+        delay = None
+        waiting: list[_Queued] = []
+        held_chats = set()
+        held_global = False
+        for op in sorted(self._queue):
+            if op.turn.done():
+                continue
+            own = max(self._global.delay(now), self._chat(op.chat_id).delay(now) if op.chat_id is not None else 0.0)
+            if held_global or op.chat_id in held_chats or own > 0:
+                # Nothing of lower priority overtakes a held call on the same chat.
+                waiting.append(op)
+                if own > 0:
+                    delay = own if delay is None else min(delay, own)
+                    held_global = held_global or self._global.delay(now) > 0
+                    if op.chat_id is not None:
+                        held_chats.add(op.chat_id)
+                continue
+            self._take(op.chat_id, now)
+            if op.key is not None and self._edits.get((op.endpoint, *op.key)) is op:
+                del self._edits[(op.endpoint, *op.key)]
+            op.turn.set_result(None)
+        self._queue = waiting
+        return delay
+
+    async def _pump(self) -> None:
+        while True:
+            self._wake.clear()
+            delay = self._pump_once(time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _drop_edits(self, key: tuple) -> None:
+        """Fail queued edits of a message that is about to be deleted."""
+        for method in EDIT_METHODS:
+            edit = self._edits.pop((method, *key), None)
+            if edit is not None:
+                self.stats["collapsed"] += 1
+                self._settle(edit.turn, exception=BadRequest("Message to edit not found"))
+
+    def _chat(self, chat_id) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = _Bucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _ready(self, chat_id, now: float) -> bool:
+        return self._global.delay(now) <= 0 and (chat_id is None or self._chat(chat_id).delay(now) <= 0)
+
+    def _take(self, chat_id, now: float) -> None:
+        self._global.take(now)
+        if chat_id is not None:
+            self._chat(chat_id).take(now)
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result: Any = None, exception: BaseException | None = None) -> None:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+def _seconds(retry_after) -> float:
+    # int in PTB 21, timedelta from PTB 22 on.
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import Database
+
+
+LOGGER = logging.getLogger("lifeos-bot")
+
+
+class SqlitePersistence(BasePersistence[dict, dict, dict]):
+    """``user_data`` and ``chat_data`` in the bot's own database (table ``ptb_data``), as JSON.
+
+    PTB hands over the entries touched since the last round every ``update_interval``
+    seconds and once more on stop. Entries whose JSON did not change are skipped, and
+    the rest of a round is written in one transaction, so a burst of taps costs at most
+    one write per interval instead of one per update. ``bot_data`` holds live objects
+    (the database, caches, the tracer) and is rebuilt on start, so it is not stored;
+    neither is callback data or conversation state, which the bot does not use.
+    Tuples come back as lists. A value JSON cannot hold (or a non-string key) is
+    logged and left out instead of coming back as something else after a restart.
+    """
+
+    def __init__(self, db: Database, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._db = db
+        self._written: dict[tuple[str, int], str] = {}
+        self._pending: dict[tuple[str, int], str | None] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return self._load("user")
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return self._load("chat")
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("user", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("chat", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._write()
+
+    def _load(self, kind: str) -> dict[int, dict]:
+        loaded: dict[int, dict] = {}
+        for row_id, raw in self._db.get_ptb_data(kind).items():
+            try:
+                loaded[row_id] = json.loads(raw)
+            except json.JSONDecodeError:
+                LOGGER.warning("Skipping unreadable persisted %s_data for %s", kind, row_id)
+                continue
+            self._written[(kind, row_id)] = raw
+        return loaded
+
+    def _stage(self, kind: str, row_id: int, data: dict | None) -> None:
+        key = (kind, row_id)
+        # An emptied dict is dropped rather than stored as "{}".
+        raw = self._dump(kind, row_id, data) if data else None
+        if raw == self._written.get(key) and key not in self._pending:
+            return
+        self._pending[key] = raw
+        if self._flush_task is None:
+            # PTB stages every entry of a round before this task runs: one transaction per round.
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    @staticmethod
+    def _dump(kind: str, row_id: int, data: dict) -> str | None:
+        try:
+            return json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError):
+            pass
+        stored = {}
+        for name, value in data.items():
+            try:
+                if not isinstance(name, str):
+                    raise TypeError(f"key of type {type(name).__name__}")
+                json.dumps(value)
+            except (TypeError, ValueError) as exc:
+                LOGGER.warning("Not persisting %s_data[%r] for %s: %s", kind, name, row_id, exc)
+                continue
+            stored[name] = value
+        return json.dumps(stored, ensure_ascii=False, sort_keys=True) if stored else None
+
+    async def _flush_soon(self) -> None:
+        await asyncio.sleep(0)
+        self._flush_task = None
+        self._write()
+
+    def _write(self) -> None:
+        changes = {key: raw for key, raw in self._pending.items() if raw != self._written.get(key)}
+        self._pending.clear()
+        if not changes:
+            return
+        try:
+            self._db.write_ptb_data((kind, row_id, raw) for (kind, row_id), raw in changes.items())
+        except Exception:
+            # Keep them for the next round; newer staged values win.
+            self._pending = {**changes, **self._pending}
+            raise
+        for key, raw in changes.items():
+            if raw is None:
+                self._written.pop(key, None)
+            else:
+                self._written[key] = raw
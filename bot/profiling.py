@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+
+
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_CUMULATIVE = 40
+PROFILE_TOP_OWN = 20
+ALLOC_TOP = 25
+TRACEMALLOC_FRAMES = 10
+
+
+class ProfileCapture:
+    """One ``cProfile`` window, optionally with ``tracemalloc`` snapshots at both ends.
+
+    Nothing is installed until :meth:`start`, and :meth:`stop` removes the profiler
+    again, so the bot pays nothing outside a capture. ``cProfile`` only sees the thread
+    that called :meth:`start`, i.e. the event loop running the handlers and jobs.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.started_at = datetime.now()
+        self._profile = cProfile.Profile()
+        self._started = 0.0
+        self._own_tracemalloc = False
+        self._baseline: tracemalloc.Snapshot | None = None
+
+    def start(self) -> None:
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._own_tracemalloc = True
+            self._baseline = tracemalloc.take_snapshot()
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self) -> str:
+        """Stop profiling and return the text report."""
+        self._profile.disable()
+        elapsed = time.perf_counter() - self._started
+        snapshot = None
+        traced = (0, 0)
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            traced = tracemalloc.get_traced_memory()
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+        return self._report(elapsed, snapshot, traced)
+
+    def _report(self, elapsed: float, snapshot: tracemalloc.Snapshot | None, traced: tuple[int, int]) -> str:
+        out = io.StringIO()
+        out.write(f"Profile {self.started_at:%Y-%m-%d %H:%M:%S}, {elapsed:.1f}s (event loop thread)\n\n")
+        stats = pstats.Stats(self._profile, stream=out).strip_dirs()
+        out.write(f"=== Top {PROFILE_TOP_CUMULATIVE} by cumulative time ===\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_CUMULATIVE)
+        out.write(f"=== Top {PROFILE_TOP_OWN} by own time ===\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP_OWN)
+        if snapshot is not None and self._baseline is not None:
+            snapshot = _without_tracemalloc(snapshot)
+            baseline = _without_tracemalloc(self._baseline)
+            out.write(f"=== Memory: {traced[0] / 1024:.0f} KiB traced, peak {traced[1] / 1024:.0f} KiB ===\n\n")
+            out.write(f"=== Top {ALLOC_TOP} allocation sites (live at the end) ===\n")
+            for stat in snapshot.statistics("lineno")[:ALLOC_TOP]:
+                out.write(f"{stat}\n")
+            out.write(f"\n=== Top {ALLOC_TOP} growth during the window ===\n")
+            for diff in snapshot.compare_to(baseline, "lineno")[:ALLOC_TOP]:
+                out.write(f"{diff}\n")
+        return out.getvalue()
+
+
+def _without_tracemalloc(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
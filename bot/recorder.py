@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+from backup import make_snapshot
+
+
+RECORD_STAMP = "%Y%m%d-%H%M%S"
+
+
+class SessionRecorder:
+    """Opt-in log of one bot run for :mod:`replay`: incoming updates and outgoing Bot API calls.
+
+    Writes ``session-<stamp>.jsonl`` into ``record_dir``, one compact JSON object per line:
+    a ``session`` header, then ``update`` events with the full update and ``api`` events
+    with the method, chat, HTTP status, response size and duration (no message texts).
+    ``t`` is seconds since the start. The database is snapshotted next to the log first
+    (``session-<stamp>.db``), so a replay starts from the same state.
+    """
+
+    def __init__(self, record_dir: Path, db_path: Path, *, user_id: int | None = None):
+        record_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime(RECORD_STAMP)
+        self.path = record_dir / f"session-{stamp}.jsonl"
+        snapshot = make_snapshot(db_path, record_dir)
+        self.db_path = snapshot.path.replace(record_dir / f"session-{stamp}.db")
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._file = self.path.open("a", encoding="utf-8")
+        self._write(
+            {
+                "kind": "session",
+                "started": datetime.now().isoformat(timespec="seconds"),
+                "db": self.db_path.name,
+                "user_id": user_id,
+                "ok": snapshot.ok,
+            }
+        )
+
+    async def on_update(self, update, context) -> None:
+        self._write({"kind": "update", "t": self._now(), "update": update.to_dict()})
+
+    def on_api_call(self, method: str, chat_id: object, status: int, size: int, seconds: float) -> None:
+        event = {"kind": "api", "t": self._now(), "method": method, "status": status, "size": size, "ms": round(seconds * 1000, 2)}
+        if chat_id is not None:
+            event["chat_id"] = chat_id
+        self._write(event)
+
+    def _now(self) -> float:
+        return round(time.perf_counter() - self._started, 4)
+
+    def _write(self, event: dict) -> None:
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+def read_session(path: Path) -> tuple[dict, list[dict]]:
+    """Header and events of a recorded session."""
+    events = list(iter_events(path))
+    if not events or events[0].get("kind") != "session":
+        raise ValueError(f"{path}: not a recorded session")
+    return events[0], events[1:]
+
+
+def iter_events(path: Path) -> Iterator[dict]:
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # The bot was killed mid-write; everything before is still usable.
+                return
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from telegram import Update
+
+from app import build_application
+from config import Config
+from db import Database
+from db_profile import DbProfiler
+from fake_telegram import FakeBotApi
+from loadtest import percentile
+from recorder import read_session
+from tracing import Trace
+
+
+# A recorded pause longer than this (the owner went away) is cut down when pacing.
+MAX_GAP = 5.0
+# Metrics compared against a previous report; all of them are "lower is better".
+COMPARED = (
+    ("seconds", "wall s"),
+    ("handler_p50_ms", "handler p50 ms"),
+    ("handler_p99_ms", "handler p99 ms"),
+    ("db_calls", "DB calls"),
+    ("db_statements", "SQL statements"),
+    ("api_total", "Bot API calls"),
+)
+# Polling and startup calls: not caused by the updates, left out of the comparison.
+STARTUP_METHODS = {"getMe", "getUpdates", "deleteWebhook"}
+
+
+def _message_of(update: dict) -> dict | None:
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]
+    return (update.get("callback_query") or {}).get("message")
+
+
+async def replay(session: Path, *, db_path: Path | None = None, speed: float = 0.0, latency: float = 0.0) -> dict:
+    """Feed a recorded session through a fresh :func:`build_application` and measure it.
+
+    Runs against :class:`FakeBotApi` and a throwaway copy of the session's database
+    snapshot, so the recording and the real database stay untouched. ``speed`` 0 sends
+    updates back to back; 1 keeps the recorded pauses (capped at :data:`MAX_GAP`).
+    """
+    header, events = read_session(session)
+    updates = [event for event in events if event["kind"] == "update"]
+    recorded = Counter(event["method"] for event in events if event["kind"] == "api" and event["method"] not in STARTUP_METHODS)
+    source = db_path or session.parent / header["db"]
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = Path(tmp) / "replay.db"
+        shutil.copyfile(source, copy)
+        api = FakeBotApi(latency=latency).start()
+        config = Config(
+            telegram_token=f"{100000001}:fake",
+            db_path=str(copy),
+            timezone="Europe/Moscow",
+            allowed_user_id=header.get("user_id"),
+            webapp_url="",
+            export_dir=tmp,
+            sync_http_host="127.0.0.1",
+            sync_http_port=0,
+            sync_http_token="",
+            backup_interval_hours=0,
+            maintenance_time="",
+            trace_slow_ms=0,
+            telegram_api_url=api.url,
+            # Measure the handlers, not the per-chat pacing.
+            tg_rate_chat=0,
+        )
+        db = Database(str(copy))
+        # A session recorded by an older version may predate tables the current code needs.
+        db.init_schema()
+        app = build_application(config, db)
+        profiler = DbProfiler(threshold=float("inf"))
+        profiler.instrument(db)
+        routes: dict[str, list[float]] = {}
+
+        def on_trace(trace: Trace, ended: float) -> None:
+            routes.setdefault(trace.route, []).append((ended - trace.started) * 1000)
+
+        app.bot_data["tracer"].add_listener(on_trace)
+        await app.initialize()
+        await app.start()
+        durations: list[float] = []
+        started = time.perf_counter()
+        try:
+            previous_t = updates[0]["t"] if updates else 0.0
+            for event in updates:
+                if speed > 0:
+                    await asyncio.sleep(min(event["t"] - previous_t, MAX_GAP) / speed)
+                previous_t = event["t"]
+                message = _message_of(event["update"])
+                if message is not None:
+                    api.remember(message)
+                update = Update.de_json(event["update"], app.bot)
+                began = time.perf_counter()
+                await app.process_update(update)
+                durations.append((time.perf_counter() - began) * 1000)
+        finally:
+            elapsed = time.perf_counter() - started
+            await app.stop()
+            await app.shutdown()
+            api.stop()
+            db.close()
+
+    methods, _ = profiler.snapshot()
+    calls = {method: count for method, count in api.calls.items() if method not in STARTUP_METHODS}
+    return {
+        "session": session.name,
+        "updates": len(durations),
+        "seconds": elapsed,
+        "handler_p50_ms": percentile(durations, 50),
+        "handler_p99_ms": percentile(durations, 99),
+        "db_calls": sum(stats.calls for _, stats in methods),
+        "db_statements": sum(stats.statements for _, stats in methods),
+        "db_methods": {name: [stats.calls, stats.statements] for name, stats in methods},
+        "api_total": sum(calls.values()),
+        "api_calls": calls,
+        "api_recorded": dict(recorded),
+        "routes": {route: (len(values), statistics.median(values)) for route, values in routes.items()},
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['session']}: {report['updates']} updates in {report['seconds']:.2f}s")
+    print(f"handler ms  p50 {report['handler_p50_ms']:7.1f}  p99 {report['handler_p99_ms']:7.1f}")
+    print(f"DB: {report['db_calls']} calls, {report['db_statements']} SQL statements")
+    print(f"{'Bot API method':<22} {'replay':>7} {'recorded':>9}")
+    for method in sorted(set(report["api_calls"]) | set(report["api_recorded"])):
+        print(f"{method:<22} {report['api_calls'].get(method, 0):>7} {report['api_recorded'].get(method, 0):>9}")
+    print(f"{'route':<28} {'n':>5} {'median ms':>10}")
+    for route, (count, median) in sorted(report["routes"].items(), key=lambda item: -item[1][1]):
+        print(f"{route:<28} {count:>5} {median:>10.1f}")
+
+
+def print_comparison(report: dict, baseline: dict) -> None:
+    print(f"\nvs {baseline['session']}:")
+    for key, label in COMPARED:
+        before, after = baseline[key], report[key]
+        change = f"{(after - before) / before:+.0%}" if before else "—"
+        print(f"{label:<16} {before:>10.1f} -> {after:>10.1f}  {change}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded bot session against the fake Bot API")
+    parser.add_argument("session", type=Path, help="session-*.jsonl written with RECORD_DIR set")
+    parser.add_argument("--db", type=Path, help="start from this database instead of the session snapshot")
+    parser.add_argument("--speed", type=float, default=0.0, help="0: back to back, 1: recorded pauses")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fake Bot API latency per call")
+    parser.add_argument("--compare", type=Path, help="report from an earlier --json run")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if args.json and args.compare is not None:
+        parser.error("--compare prints a table; run it without --json")
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    report = asyncio.run(replay(args.session, db_path=args.db, speed=args.speed, latency=args.latency_ms / 1000))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    if args.compare is not None:
+        print_comparison(report, json.loads(args.compare.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+
+
+TRACKED_STATUSES = ("full", "partial", "none")
+
+
+@dataclass
+class StatsFrame:
+    """Per-day metric columns over a contiguous calendar range.
+
+    Every column is a float64 array with one slot per calendar day starting at
+    ``start``; NaN marks a day without a value (no daily row or field not set).
+    ``status`` holds the persisted completion status ("" for days without a row).
+    """
+
+    start: date
+    columns: dict[str, np.ndarray]
+    status: np.ndarray
+    present: np.ndarray
+
+    @classmethod
+    def from_rows(
+        cls,
+        start: date,
+        end: date,
+        day_indices: list[int],
+        status: list[str],
+        values: dict[str, list[float]],
+    ) -> "StatsFrame":
+        span = max(0, (end - start).days + 1)
+        idx = np.asarray(day_indices, dtype=np.int64)
+        columns: dict[str, np.ndarray] = {}
+        for name, items in values.items():
+            col = np.full(span, np.nan)
+            if len(idx):
+                col[idx] = np.asarray(items, dtype=np.float64)
+            columns[name] = col
+        status_col = np.full(span, "", dtype="U8")
+        present = np.zeros(span, dtype=bool)
+        if len(idx):
+            status_col[idx] = status
+            present[idx] = True
+        return cls(start=start, columns=columns, status=status_col, present=present)
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=len(self) - 1)
+
+    def index_of(self, day: date) -> int:
+        return (day - self.start).days
+
+    @property
+    def tracked(self) -> np.ndarray:
+        return np.isin(self.status, TRACKED_STATUSES)
+
+    def _bounds(self, start: date | None, end: date | None) -> tuple[int, int]:
+        lo = 0 if start is None else min(max(0, self.index_of(start)), len(self))
+        hi = len(self) if end is None else min(max(0, self.index_of(end) + 1), len(self))
+        return lo, max(lo, hi)
+
+    def percentile(
+        self,
+        name: str,
+        q: float | list[float],
+        start: date | None = None,
+        end: date | None = None,
+        *,
+        tracked_only: bool = False,
+    ) -> np.ndarray | float | None:
+        """``np.percentile`` of the set values of ``name`` in ``[start, end]`` (whole frame by default).
+
+        ``tracked_only`` keeps days with a tracked completion status. None when no day has a value.
+        """
+        lo, hi = self._bounds(start, end)
+        values = self.columns[name][lo:hi]
+        keep = ~np.isnan(values)
+        if tracked_only:
+            keep &= self.tracked[lo:hi]
+        values = values[keep]
+        if not len(values):
+            return None
+        result = np.percentile(values, q)
+        return float(result) if np.ndim(result) == 0 else result
+
+    def positive(self, name: str, start: date | None = None, end: date | None = None) -> np.ndarray:
+        """Per-day ``value > 0`` flags of ``name`` in ``[start, end]``; unset days are False."""
+        lo, hi = self._bounds(start, end)
+        return np.nan_to_num(self.columns[name][lo:hi], nan=0.0) > 0
+
+    def values_between(self, name: str, start: date, end: date, fill: float = 0.0) -> np.ndarray:
+        """Column values for ``[start, end]``; days outside the frame or unset become ``fill``."""
+        span = (end - start).days + 1
+        if span <= 0:
+            return np.zeros(0)
+        out = np.full(span, fill, dtype=np.float64)
+        offset = self.index_of(start)
+        lo = max(0, offset)
+        hi = min(len(self), offset + span)
+        if lo < hi:
+            chunk = self.columns[name][lo:hi]
+            out[lo - offset : hi - offset] = np.where(np.isnan(chunk), fill, chunk)
+        return out
+
+
+def run_lengths(active: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Start indices and lengths of consecutive ``True`` runs."""
+    flags = np.concatenate(([False], np.asarray(active, dtype=bool), [False]))
+    edges = np.flatnonzero(flags[1:] != flags[:-1])
+    starts = edges[0::2]
+    return starts, edges[1::2] - starts
+
+
+def best_streak(active: np.ndarray) -> int:
+    """Length of the longest ``True`` run."""
+    _, lengths = run_lengths(active)
+    return int(lengths.max()) if len(lengths) else 0
+
+
+def current_streak(active: np.ndarray) -> int:
+    """Length of the run that ends at the last element."""
+    active = np.asarray(active, dtype=bool)
+    if not len(active) or not active[-1]:
+        return 0
+    gaps = np.flatnonzero(~active)
+    return int(len(active) - 1 - gaps[-1]) if len(gaps) else int(len(active))
+
+
+def rolling_max(values: np.ndarray, window: int) -> float:
+    """Largest sum over any ``window`` consecutive values (whole sum when shorter)."""
+    if not len(values):
+        return 0
+    if window <= 1:
+        return float(values.max())
+    if len(values) <= window:
+        return float(values.sum())
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    return float((csum[window:] - csum[:-window]).max())
+
+
+def category_shares(totals: dict[str, float], grand: float, limit: int = 4) -> list[tuple[str, float, int]]:
+    """Top categories by total with their rounded percentage of ``grand``."""
+    if grand <= 0:
+        return []
+    names = list(totals)
+    amounts = np.asarray([totals[name] for name in names], dtype=np.float64)
+    order = np.argsort(-amounts, kind="stable")
+    shares = np.rint(amounts / grand * 100).astype(int)
+    return [(names[i], float(amounts[i]), int(shares[i])) for i in order[:limit] if amounts[i] > 0]
@@ -0,0 +1,459 @@
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from typing import Iterable
+
+import numpy as np
+
+from stats_engine import TRACKED_STATUSES, StatsFrame, run_lengths
+
+
+# Metrics with range max support (the stats view asks for the top shooting and spending
+# day). Expenses only count tracked days (status full/partial/none), matching how the
+# stats view sums them.
+TREE_METRICS = {
+    "shots": False,
+    "expense": True,
+}
+# Metrics with a RunIndex of active (positive) days. Only the shooting block shows a
+# streak; another activity metric needs nothing but its name here.
+RUN_METRICS = ("shots",)
+# Per metric and scope (all days, tracked days): running sum, set-count, positive-count.
+SERIES_KINDS = ("sum", "set", "pos")
+
+
+def _capacity(n: int) -> int:
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+class FenwickTree:
+    """Binary indexed tree over several float series at once, one column each.
+
+    Point updates (a delta row for every series) and prefix sums of one series are
+    O(log n). Slots past the last written day hold zeros, so adding days only bumps
+    ``len``; capacity doubles when it runs out, without recomputing the tree.
+    """
+
+    def __init__(self, values: np.ndarray):
+        n, width = values.shape
+        capacity = _capacity(max(1, n))
+        prefix = np.zeros((capacity + 1, width))
+        np.cumsum(values, axis=0, out=prefix[1 : n + 1])
+        prefix[n + 1 :] = prefix[n]
+        nodes = np.arange(1, capacity + 1)
+        # One row per series, so a prefix read walks a single row.
+        self._tree = np.zeros((width, capacity + 1))
+        self._tree[:, 1:] = (prefix[nodes] - prefix[nodes - (nodes & -nodes)]).T
+        self._n = n
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def capacity(self) -> int:
+        return self._tree.shape[1] - 1
+
+    def grow(self, n: int) -> None:
+        capacity = self.capacity
+        if n > capacity:
+            tree = np.zeros((self._tree.shape[0], _capacity(n) + 1))
+            tree[:, : capacity + 1] = self._tree
+            # Only the power-of-two nodes above the old capacity cover old slots, all of them.
+            node = capacity * 2
+            while node < tree.shape[1]:
+                tree[:, node] = self._tree[:, capacity]
+                node *= 2
+            self._tree = tree
+        self._n = max(self._n, n)
+
+    def add(self, index: int, delta: np.ndarray) -> None:
+        node = index + 1
+        size = self._tree.shape[1]
+        while node < size:
+            self._tree[:, node] += delta
+            node += node & -node
+
+    def prefix(self, count: int, series: int) -> float:
+        """Sum of the first ``count`` slots of one series."""
+        row = self._tree[series]
+        total = 0.0
+        while count > 0:
+            total += row[count]
+            count -= count & -count
+        return float(total)
+
+
+class SegmentTree:
+    """Leftmost arg-max over a float array.
+
+    Point updates and inclusive range queries are O(log n). NaN entries never win.
+    Slots past the end hold NaN, so growing only rebuilds when the capacity doubles.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self._n = len(values)
+        self._build(self._key(values), _capacity(max(1, self._n)))
+
+    def _build(self, keys: np.ndarray, size: int) -> None:
+        self._size = size
+        self._keys = np.full(size, -np.inf)
+        self._keys[: len(keys)] = keys
+        self._tree = np.zeros(2 * size, dtype=np.int64)
+        self._tree[size:] = np.arange(size)
+        lo, hi = size // 2, size
+        while lo >= 1:
+            left = self._tree[2 * lo : 2 * hi : 2]
+            right = self._tree[2 * lo + 1 : 2 * hi : 2]
+            self._tree[lo:hi] = np.where(self._keys[right] > self._keys[left], right, left)
+            lo, hi = lo // 2, lo
+
+    @staticmethod
+    def _key(values):
+        values = np.asarray(values, dtype=np.float64)
+        return np.where(np.isnan(values), -np.inf, values)
+
+    def _pick(self, a: int, b: int) -> int:
+        ka, kb = self._keys[a], self._keys[b]
+        if kb > ka or (kb == ka and b < a):
+            return b
+        return a
+
+    def grow(self, n: int) -> None:
+        if n > self._size:
+            self._build(self._keys, _capacity(n))
+        self._n = max(self._n, n)
+
+    def update(self, index: int, value: float) -> None:
+        self._keys[index] = self._key([value])[0]
+        node = (index + self._size) // 2
+        while node >= 1:
+            self._tree[node] = self._pick(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def query(self, lo: int, hi: int) -> tuple[float, int] | None:
+        """Best value and its index within ``[lo, hi]``; ``None`` if every entry is NaN."""
+        lo = max(0, lo)
+        hi = min(self._n - 1, hi)
+        if lo > hi:
+            return None
+        best = lo
+        left, right = lo + self._size, hi + self._size + 1
+        while left < right:
+            if left & 1:
+                best = self._pick(best, self._tree[left])
+                left += 1
+            if right & 1:
+                right -= 1
+                best = self._pick(best, self._tree[right])
+            left //= 2
+            right //= 2
+        if self._keys[best] == -np.inf:
+            return None
+        return float(self._keys[best]), int(best)
+
+
+class RunIndex:
+    """Sorted runs of consecutive active days, keyed by date ordinal.
+
+    Flipping a day merges or splits at most one run (bisect + list insert), current
+    streak and last active day are O(log n), the all-time best is cached.
+    """
+
+    def __init__(self, days: Iterable[int] = ()):
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        for day in sorted(set(days)):
+            if self._ends and self._ends[-1] == day - 1:
+                self._ends[-1] = day
+            else:
+                self._starts.append(day)
+                self._ends.append(day)
+        self._best: int | None = None
+
+    @classmethod
+    def from_mask(cls, start: date, active: np.ndarray) -> "RunIndex":
+        index = cls()
+        starts, lengths = run_lengths(active)
+        base = start.toordinal()
+        index._starts = [base + int(s) for s in starts]
+        index._ends = [base + int(s + n - 1) for s, n in zip(starts, lengths)]
+        return index
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def _run_at(self, day: int) -> int:
+        i = bisect_right(self._starts, day) - 1
+        return i if i >= 0 and self._ends[i] >= day else -1
+
+    def set(self, day: int, active: bool) -> None:
+        starts, ends = self._starts, self._ends
+        i = bisect_right(starts, day) - 1
+        inside = i >= 0 and ends[i] >= day
+        if active:
+            if inside:
+                return
+            join_left = i >= 0 and ends[i] == day - 1
+            join_right = i + 1 < len(starts) and starts[i + 1] == day + 1
+            if join_left and join_right:
+                ends[i] = ends.pop(i + 1)
+                starts.pop(i + 1)
+            elif join_left:
+                ends[i] = day
+            elif join_right:
+                i += 1
+                starts[i] = day
+            else:
+                i += 1
+                starts.insert(i, day)
+                ends.insert(i, day)
+            if self._best is not None:
+                self._best = max(self._best, ends[i] - starts[i] + 1)
+            return
+        if not inside:
+            return
+        run_start, run_end = starts[i], ends[i]
+        if run_start == run_end:
+            starts.pop(i)
+            ends.pop(i)
+        elif day == run_start:
+            starts[i] = day + 1
+        elif day == run_end:
+            ends[i] = day - 1
+        else:
+            ends[i] = day - 1
+            starts.insert(i + 1, day + 1)
+            ends.insert(i + 1, run_end)
+        if self._best == run_end - run_start + 1:
+            self._best = None
+
+    def current(self, day: int, grace: int = 0) -> int:
+        """Length of the run through ``day`` (counted up to ``day``).
+
+        With ``grace`` the run may end up to that many days earlier and still count,
+        e.g. a habit done yesterday but not yet today.
+        """
+        for offset in range(grace + 1):
+            i = self._run_at(day - offset)
+            if i >= 0:
+                return day - offset - self._starts[i] + 1
+        return 0
+
+    def best(self, start: int | None = None, end: int | None = None) -> int:
+        """Longest run, clipped to ``[start, end]`` when bounds are given."""
+        if not self._starts:
+            return 0
+        if (start is None or start <= self._starts[0]) and (end is None or end >= self._ends[-1]):
+            if self._best is None:
+                self._best = max(e - s + 1 for s, e in zip(self._starts, self._ends))
+            return self._best
+        lo = 0 if start is None else bisect_left(self._ends, start)
+        hi = len(self._starts) if end is None else bisect_right(self._starts, end)
+        best = 0
+        for s, e in zip(self._starts[lo:hi], self._ends[lo:hi]):
+            if start is not None:
+                s = max(s, start)
+            if end is not None:
+                e = min(e, end)
+            best = max(best, e - s + 1)
+        return best
+
+    def last_active(self, until: int | None = None) -> int | None:
+        """Latest active day (not after ``until``)."""
+        if until is None:
+            return self._ends[-1] if self._ends else None
+        i = bisect_right(self._starts, until) - 1
+        if i < 0:
+            return None
+        return min(self._ends[i], until)
+
+
+class StatsIndex:
+    """Fenwick and segment trees over the daily metric series.
+
+    Holds the full-history :class:`StatsFrame` (views into buffers with spare capacity)
+    and one :class:`FenwickTree` with, for every column, running sums, set-counts and
+    positive-counts over all days and over tracked days only, so any ``[start, end]``
+    sum or count is O(log n) and so is rewriting a day. Max for ``TREE_METRICS`` goes
+    through segment trees in O(log n). ``runs`` keeps a :class:`RunIndex` per
+    ``RUN_METRICS`` entry (habit streaks live in the database). Writes only mark dates
+    dirty; the owner re-reads those days and feeds them to :meth:`update_day`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._dirty: set[str] = set()
+        self.frame: StatsFrame | None = None
+        self._names: list[str] = []
+        self._values = np.zeros((0, 0))
+        self._status = np.zeros(0, dtype="U8")
+        self._present = np.zeros(0, dtype=bool)
+        self._sums: FenwickTree | None = None
+        self._series: dict[tuple[str, str, bool], int] = {}
+        self._trees: dict[str, SegmentTree] = {}
+        self.runs: dict[str, RunIndex] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.frame is not None
+
+    @property
+    def start(self) -> date | None:
+        return self.frame.start if self.frame is not None else None
+
+    @property
+    def end(self) -> date | None:
+        return self.frame.end if self.frame is not None else None
+
+    def mark_dirty(self, date_str: str) -> None:
+        with self._lock:
+            self._dirty.add(date_str)
+
+    def take_dirty(self) -> set[str]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def reset(self) -> None:
+        self.frame = None
+        self._sums = None
+        self._series = {}
+        self._trees = {}
+        self.runs = {}
+
+    def build(self, frame: StatsFrame) -> None:
+        n = len(frame)
+        capacity = _capacity(max(1, n))
+        self._names = list(frame.columns)
+        width = len(self._names)
+        self._values = np.full((capacity, width), np.nan)
+        for column, name in enumerate(self._names):
+            self._values[:n, column] = frame.columns[name]
+        self._status = np.full(capacity, "", dtype=frame.status.dtype)
+        self._status[:n] = frame.status
+        self._present = np.zeros(capacity, dtype=bool)
+        self._present[:n] = frame.present
+        self._view(frame.start, n)
+        tracked = self.frame.tracked
+        self._series = {
+            (name, kind, only_tracked): (only_tracked * len(SERIES_KINDS) + k) * width + column
+            for column, name in enumerate(self._names)
+            for k, kind in enumerate(SERIES_KINDS)
+            for only_tracked in (False, True)
+        }
+        self._sums = FenwickTree(self._contributions(self._values[:n], tracked))
+        self._trees = {}
+        for name, only_tracked in TREE_METRICS.items():
+            if name not in frame.columns:
+                continue
+            values = self.frame.columns[name]
+            self._trees[name] = SegmentTree(np.where(tracked, values, np.nan) if only_tracked else values)
+        self.runs = {
+            name: RunIndex.from_mask(frame.start, np.nan_to_num(self.frame.columns[name]) > 0)
+            for name in RUN_METRICS
+            if name in frame.columns
+        }
+
+    def _view(self, start: date, n: int) -> None:
+        self.frame = StatsFrame(
+            start=start,
+            columns={name: self._values[:n, column] for column, name in enumerate(self._names)},
+            status=self._status[:n],
+            present=self._present[:n],
+        )
+
+    @staticmethod
+    def _contributions(values: np.ndarray, tracked) -> np.ndarray:
+        """Series rows for ``values`` (days x columns): all-days sum/set/pos, then tracked-only."""
+        is_set = ~np.isnan(values)
+        positive = is_set & (np.nan_to_num(values) > 0)
+        sums = np.where(is_set, values, 0.0)
+        scope = np.asarray(tracked, dtype=bool)[:, None]
+        return np.hstack((sums, is_set, positive, sums * scope, is_set & scope, positive & scope)).astype(np.float64)
+
+    def grow_to(self, end: date) -> None:
+        """Extend the covered range with empty days up to ``end``."""
+        frame = self.frame
+        extra = (end - frame.end).days
+        if extra <= 0:
+            return
+        n = len(frame) + extra
+        if n > len(self._status):
+            spare = _capacity(n) - len(self._status)
+            self._values = np.concatenate((self._values, np.full((spare, len(self._names)), np.nan)))
+            self._status = np.concatenate((self._status, np.full(spare, "", dtype=self._status.dtype)))
+            self._present = np.concatenate((self._present, np.zeros(spare, dtype=bool)))
+        self._sums.grow(n)
+        for tree in self._trees.values():
+            tree.grow(n)
+        self._view(frame.start, n)
+
+    def update_day(self, day_frame: StatsFrame) -> None:
+        """Replace one day with a freshly loaded single-day frame."""
+        day = day_frame.start
+        if day > self.frame.end:
+            self.grow_to(day)
+        i = self.frame.index_of(day)
+        if i < 0:
+            raise ValueError(f"{day} is before the indexed range")
+        old_values = self._values[i : i + 1].copy()
+        old_tracked = self._status[i] in TRACKED_STATUSES
+        self._values[i] = [day_frame.columns[name][0] for name in self._names]
+        self._status[i] = day_frame.status[0]
+        self._present[i] = day_frame.present[0]
+        new_tracked = self._status[i] in TRACKED_STATUSES
+        delta = self._contributions(self._values[i : i + 1], [new_tracked]) - self._contributions(old_values, [old_tracked])
+        if delta.any():
+            self._sums.add(i, delta[0])
+        for name, tree in self._trees.items():
+            value = self._values[i, self._names.index(name)]
+            if TREE_METRICS[name] and not new_tracked:
+                value = np.nan
+            tree.update(i, value)
+        for name, runs in self.runs.items():
+            runs.set(day.toordinal(), bool(day_frame.columns[name][0] > 0))
+
+    def _bounds(self, start: date, end: date) -> tuple[int, int] | None:
+        frame = self.frame
+        lo = max(0, frame.index_of(start))
+        hi = min(len(frame) - 1, frame.index_of(end))
+        if lo > hi:
+            return None
+        return lo, hi
+
+    def _series_range(self, name: str, kind: str, start: date, end: date, tracked: bool) -> float:
+        bounds = self._bounds(start, end)
+        if bounds is None:
+            return 0.0
+        lo, hi = bounds
+        column = self._series[(name, kind, tracked)]
+        return self._sums.prefix(hi + 1, column) - self._sums.prefix(lo, column)
+
+    def range_sum(self, name: str, start: date, end: date, *, tracked: bool = False) -> float:
+        return self._series_range(name, "sum", start, end, tracked)
+
+    def range_count(
+        self,
+        name: str,
+        start: date,
+        end: date,
+        *,
+        tracked: bool = False,
+        positive: bool = False,
+    ) -> int:
+        return int(round(self._series_range(name, "pos" if positive else "set", start, end, tracked)))
+
+    def range_max(self, name: str, start: date, end: date) -> tuple[float, str] | None:
+        bounds = self._bounds(start, end)
+        if bounds is None:
+            return None
+        found = self._trees[name].query(*bounds)
+        if found is None:
+            return None
+        value, idx = found
+        return value, (self.frame.start + timedelta(days=idx)).isoformat()
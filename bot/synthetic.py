@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import argparse
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from db import Database
+from menus import (
+    CODE_MODE_OPTIONS,
+    CODE_TOPIC_OPTIONS,
+    DAY_STATUS_OPTIONS,
+    ENERGY_OPTIONS,
+    EXPENSE_OPTIONS,
+    FOOD_GARNISH_OPTIONS,
+    FOOD_OIL_OPTIONS,
+    FOOD_PROTEIN_OPTIONS,
+    FOOD_SWEET_OPTIONS,
+    MOOD_OPTIONS,
+    PROCRASTINATION_OPTIONS,
+    REST_TIME_OPTIONS,
+    REST_TYPE_OPTIONS,
+    SLEEP_REGIME_OPTIONS,
+)
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Habit name -> (chance to do it after a done day, after a missed day): streaky, like real habits.
+HABITS = {
+    "Зарядка": (0.8, 0.3),
+    "Без сахара": (0.85, 0.2),
+    "Витамины": (0.92, 0.5),
+    "Растяжка": (0.6, 0.15),
+    "Без телефона в кровати": (0.55, 0.1),
+}
+REVIEW_WORDS = (
+    "нормальный день", "устал после учёбы", "продуктивно", "много ML", "долго спал", "гулял с кентами",
+    "тренировка зашла", "болит спина", "залип в YouTube", "закрыл задачу по алгосам", "читал вечером",
+    "поругался с собой", "отличная усталость", "сбился режим", "хорошо поел",
+)
+REGRET_WORDS = (
+    "поздно лёг", "не дочитал", "пропустил тренировку", "много сладкого", "сидел в телефоне",
+    "не сделал английский", "потратил лишнего", "ничего",
+)
+
+
+def _values(options: list[tuple[str, str]]) -> list[str]:
+    """Stored values behind menu buttons: the part of the callback data after the last prefix."""
+    return [data.split(":", 2)[-1] for _, data in options if not data.startswith("clear:")]
+
+
+def _codes(options: list[tuple[str, str]]) -> list[str]:
+    return [data.split(":", 1)[1] for _, data in options]
+
+
+def _minutes(rnd: random.Random, chance: float, choices: tuple[int, ...]) -> int | None:
+    if rnd.random() < 0.1:
+        return None
+    return rnd.choice(choices) if rnd.random() < chance else 0
+
+
+def _phrase(rnd: random.Random, words: tuple[str, ...]) -> str:
+    return ", ".join(rnd.sample(words, rnd.randint(1, 3)))
+
+
+def _meals(rnd: random.Random, weekend: bool) -> list[tuple[str, list[tuple[str, float]]]]:
+    protein = _codes(FOOD_PROTEIN_OPTIONS)
+    garnish = _codes(FOOD_GARNISH_OPTIONS)
+    sweet = _codes(FOOD_SWEET_OPTIONS)
+    oil = _codes(FOOD_OIL_OPTIONS)
+    meals = [
+        (f"{rnd.randint(7, 9) + weekend:02d}:{rnd.randint(0, 59):02d}", [(rnd.choice(garnish[2:4]), 1), (rnd.choice(protein[:5]), rnd.choice([1, 2, 3]))]),
+        (f"1{rnd.randint(3, 5)}:{rnd.randint(0, 59):02d}", [(rnd.choice(protein[5:]), 1), (rnd.choice(garnish), 1), (rnd.choice(oil), 1)]),
+        (f"{rnd.randint(19, 21)}:{rnd.randint(0, 59):02d}", [(rnd.choice(protein), 1), (rnd.choice(garnish), rnd.choice([1, 2]))]),
+    ]
+    if rnd.random() < 0.6:
+        meals.insert(2, (f"1{rnd.randint(6, 8)}:{rnd.randint(0, 59):02d}", [(rnd.choice(sweet), rnd.choice([1, 1, 2]))]))
+    # Skipped meals and days where only part of the food got logged.
+    return [meal for meal in meals if rnd.random() < 0.9]
+
+
+def generate_history(db_path: Path, years: float, *, seed: int = 42, end: date | None = None) -> dict[str, int]:
+    """Fill a database with ``years`` of synthetic days ending at ``end`` (today by default).
+
+    Writes ``daily``, ``food_log`` (shipped catalog portions, with snapshots),
+    ``session_log``, ``expense_log`` and ``habit_log`` with weekday/weekend patterns,
+    streaky habits, a drifting weight and occasional sick days and gaps. Deterministic
+    for a given ``seed``. Returns the number of rows written per table.
+    """
+    db = Database(str(db_path))
+    db.init_schema()
+    db.seed_from_csv(str(BASE_DIR / "data/food_items.csv"), str(BASE_DIR / "data/portions.csv"))
+    for name in HABITS:
+        db.add_habit(name)
+    rnd = random.Random(seed)
+    end = end or date.today()
+    days = int(365 * years)
+
+    moods = _values(MOOD_OPTIONS)
+    energies = _values(ENERGY_OPTIONS)
+    statuses = _values(DAY_STATUS_OPTIONS)
+    rest_times = _values(REST_TIME_OPTIONS)
+    rest_types = _values(REST_TYPE_OPTIONS)
+    regimes = _values(SLEEP_REGIME_OPTIONS)
+    code_modes = _values(CODE_MODE_OPTIONS)
+    code_topics = _values(CODE_TOPIC_OPTIONS)
+    anti_reasons = _values(PROCRASTINATION_OPTIONS)
+    expense_categories = [label for label, _ in EXPENSE_OPTIONS]
+
+    daily_rows: list[dict] = []
+    food_rows: list[tuple[str, str, str, float]] = []
+    session_rows: list[tuple] = []
+    expense_rows: list[tuple] = []
+    habit_rows: list[tuple[str, str]] = []
+    habit_state = {name: rnd.random() < 0.5 for name in HABITS}
+    weight = rnd.uniform(68.0, 82.0)
+
+    for offset in range(days):
+        day = end - timedelta(days=days - 1 - offset)
+        day_str = day.isoformat()
+        weekend = day.weekday() >= 5
+        weight += rnd.gauss(-0.002, 0.15)
+        if rnd.random() < 0.03:
+            # A gap: the bot was not opened that day.
+            continue
+        if rnd.random() < 0.04:
+            daily_rows.append(
+                {"date": day_str, "day_status": rnd.choice(statuses), "sleep_hours": f"{rnd.gauss(9.0, 1.2):.1f}", "mood": rnd.choice(moods[4:])}
+            )
+            continue
+        training = rnd.choices(["Верх", "Ноги", "Фулл", "Отдых", "Пропустил"], weights=[3, 3, 1, 3 + 2 * weekend, 1])[0]
+        steps = max(500, int(rnd.gauss(11000 if weekend else 8000, 3000)))
+        code_minutes = _minutes(rnd, 0.7, (30, 60, 90, 120, 180))
+        row = {
+            "date": day_str,
+            "training": training,
+            "cardio_min": rnd.choice([0, 0, 10, 20, 30]) if training != "Пропустил" else 0,
+            "steps_count": steps if rnd.random() < 0.9 else None,
+            "english_min": _minutes(rnd, 0.6, (15, 30, 45, 60)),
+            "ml_min": _minutes(rnd, 0.3 if weekend else 0.7, (30, 60, 90, 120, 180, 240)),
+            "algo_min": code_minutes,
+            "uni_min": 0 if weekend else _minutes(rnd, 0.6, (60, 90, 120, 180)),
+            "code_mode": rnd.choice(code_modes) if code_minutes else None,
+            "code_topic": rnd.choice(code_topics) if code_minutes else None,
+            "reading_pages": rnd.choice([0, 0, 10, 20, 30, 50]),
+            "rest_time": rnd.choice(rest_times[2:] if weekend else rest_times[:3]),
+            "rest_type": rnd.choice(rest_types),
+            "sleep_bed": str(rnd.choice([11, 12, 12, 1, 1, 2, 3])),
+            "sleep_hours": f"{rnd.gauss(7.6 if weekend else 7.0, 1.0):.1f}",
+            "nap_hours": rnd.choice([0, 0, 0, 0.5, 1.0]),
+            "sleep_regime": rnd.choice(regimes),
+            "productivity": rnd.choice([25, 50, 50, 75, 75, 100]) if not weekend else rnd.choice([0, 25, 50]),
+            "mood": rnd.choice(moods),
+            "energy": rnd.choice(energies),
+            "weight": round(weight, 1) if rnd.random() < 0.4 else None,
+            "review": _phrase(rnd, REVIEW_WORDS) if rnd.random() < 0.5 else None,
+            "regret": _phrase(rnd, REGRET_WORDS) if rnd.random() < 0.3 else None,
+            "active_kcal": round(rnd.uniform(150, 900)) if rnd.random() < 0.8 else None,
+            "shots_count": rnd.choice([0, 0, 0, 1, 2, 3]),
+        }
+        daily_rows.append(row)
+
+        if rnd.random() < 0.85:
+            for time_str, items in _meals(rnd, weekend):
+                food_rows.extend((day_str, time_str, code, quantity) for code, quantity in items)
+        if code_minutes:
+            session_rows.append((day_str, "20:00", "Код", f"{row['code_mode']}/{row['code_topic']}", 0, ""))
+        for _ in range(rnd.choice([0, 0, 0, 1, 2])):
+            session_rows.append((day_str, f"{rnd.randint(10, 22)}:00", "Анти", rnd.choice(anti_reasons), 0, ""))
+        for _ in range(rnd.choice([0, 1, 1, 2, 3])):
+            category = rnd.choices(expense_categories, weights=[10, 1, 3, 2 + 3 * weekend, 1, 2])[0]
+            amount = round(rnd.lognormvariate(6.0, 0.9), 2)
+            expense_rows.append((day_str, f"{rnd.randint(9, 22)}:{rnd.randint(0, 59):02d}", category, amount, ""))
+        for name, (keep, start) in HABITS.items():
+            habit_state[name] = rnd.random() < (keep if habit_state[name] else start)
+            if habit_state[name]:
+                habit_rows.append((day_str, name))
+
+    db.import_history(daily_rows, food_rows, session_rows, expense_rows, habit_rows)
+    db.set_state("active_day", end.isoformat())
+    db.close()
+    return {
+        "daily": len(daily_rows),
+        "food_log": len(food_rows),
+        "session_log": len(session_rows),
+        "expense_log": len(expense_rows),
+        "habit_log": len(habit_rows),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fill a LifeOS database with synthetic history")
+    parser.add_argument("db", type=Path)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.db.exists():
+        parser.error(f"{args.db} already exists; synthetic data goes into a fresh database")
+    counts = generate_history(args.db, args.years, seed=args.seed)
+    print("  ".join(f"{table}: {rows}" for table, rows in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
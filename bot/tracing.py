@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator
+
+from telegram.request import HTTPXRequest
+
+from db import Database
+
+
+LOGGER = logging.getLogger("lifeos-bot.trace")
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WATERFALL_WIDTH = 24
+
+
+@dataclass
+class Span:
+    name: str
+    started: float
+    ended: float
+    depth: int
+    # Inside a span of the same kind (a DB method called by another one); not counted twice.
+    nested: bool = False
+
+    @property
+    def kind(self) -> str:
+        return self.name.split(".", 1)[0]
+
+
+@dataclass
+class Trace:
+    route: str
+    update_id: int | None = None
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    failed: bool = False
+
+
+@dataclass
+class RouteStats:
+    count: int = 0
+    errors: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(HISTOGRAM_BUCKETS))
+    # Time per span kind ("db", "tg", "render"), outermost spans only.
+    kinds: dict[str, float] = field(default_factory=dict)
+
+
+_TRACE: ContextVar[Trace | None] = ContextVar("lifeos_trace", default=None)
+_OPEN: ContextVar[tuple[int, str | None]] = ContextVar("lifeos_open_span", default=(0, None))
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block as ``name`` ("db.get_state", "tg.sendMessage", ...) in the current trace.
+
+    Outside a traced update this does nothing, so it is safe in jobs and the sync server.
+    """
+    trace = _TRACE.get()
+    if trace is None:
+        yield
+        return
+    depth, parent_kind = _OPEN.get()
+    kind = name.split(".", 1)[0]
+    token = _OPEN.set((depth + 1, kind))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append(Span(name, started, time.perf_counter(), depth, parent_kind == kind))
+        _OPEN.reset(token)
+
+
+class TracingRequest(HTTPXRequest):
+    """Bot API transport that records every call as a ``tg.<method>`` span."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listeners: list[Callable[[str, object, int, int, float], None]] = []
+
+    def add_listener(self, callback: Callable[[str, object, int, int, float], None]) -> None:
+        """Register ``callback(method, chat_id, status, response_size, seconds)`` for every call.
+
+        ``status`` is 0 when the request failed without a response.
+        """
+        self._listeners.append(callback)
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs) -> tuple[int, bytes]:
+        name = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status, payload = 0, b""
+        try:
+            with span("tg." + name):
+                status, payload = await super().do_request(url, method, request_data, **kwargs)
+            return status, payload
+        finally:
+            if self._listeners:
+                chat_id = request_data.parameters.get("chat_id") if request_data is not None else None
+                elapsed = time.perf_counter() - started
+                for callback in self._listeners:
+                    callback(name, chat_id, status, len(payload), elapsed)
+
+
+class Tracer:
+    """Per-update span tracing with per-route aggregates.
+
+    :meth:`wrap` runs a handler inside a fresh :class:`Trace` named by
+    ``route(update, context)``; DB methods (after :meth:`instrument`), Bot API calls
+    (through :class:`TracingRequest`) and explicit :func:`span` blocks add spans to it.
+    Updates slower than ``slow`` seconds are logged as a waterfall.
+    """
+
+    def __init__(self, route: Callable[..., str], slow: float = 0.7):
+        self.route = route
+        self.slow = slow
+        self.routes: dict[str, RouteStats] = {}
+        self.since = datetime.now()
+        self._listeners: list[Callable[[Trace, float], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback: Callable[[Trace, float], None]) -> None:
+        """Register ``callback(trace, ended)`` for every finished update (load tests, replay)."""
+        self._listeners.append(callback)
+
+    def instrument(self, db: Database) -> None:
+        for name, _ in inspect.getmembers(Database, inspect.isfunction):
+            if not name.startswith("_"):
+                setattr(db, name, self._wrap_db(name, getattr(db, name)))
+
+    def wrap(self, callback: Callable) -> Callable:
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            trace = Trace(self.route(update, context), getattr(update, "update_id", None))
+            token = _TRACE.set(trace)
+            try:
+                return await callback(update, context)
+            except Exception:
+                trace.failed = True
+                raise
+            finally:
+                _TRACE.reset(token)
+                self._finish(trace, time.perf_counter())
+
+        return wrapper
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes.clear()
+            self.since = datetime.now()
+
+    def snapshot(self) -> list[tuple[str, RouteStats]]:
+        """Routes by total time, slowest first."""
+        with self._lock:
+            routes = [
+                (name, RouteStats(stats.count, stats.errors, stats.total, stats.max, list(stats.buckets), dict(stats.kinds)))
+                for name, stats in self.routes.items()
+            ]
+        return sorted(routes, key=lambda item: item[1].total, reverse=True)
+
+    def prometheus(self) -> str:
+        """Route aggregates in the Prometheus text format."""
+        lines = ["# TYPE lifeos_update_seconds histogram"]
+        routes = self.snapshot()
+        for name, stats in routes:
+            label = _label(name)
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'lifeos_update_seconds_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'lifeos_update_seconds_bucket{{route="{label}",le="+Inf"}} {stats.count}')
+            lines.append(f'lifeos_update_seconds_sum{{route="{label}"}} {stats.total:.6f}')
+            lines.append(f'lifeos_update_seconds_count{{route="{label}"}} {stats.count}')
+        lines.append("# TYPE lifeos_update_seconds_max gauge")
+        for name, stats in routes:
+            lines.append(f'lifeos_update_seconds_max{{route="{_label(name)}"}} {stats.max:.6f}')
+        lines.append("# TYPE lifeos_update_errors_total counter")
+        for name, stats in routes:
+            lines.append(f'lifeos_update_errors_total{{route="{_label(name)}"}} {stats.errors}')
+        lines.append("# TYPE lifeos_span_seconds_total counter")
+        for name, stats in routes:
+            for kind, seconds in sorted(stats.kinds.items()):
+                lines.append(f'lifeos_span_seconds_total{{route="{_label(name)}",kind="{_label(kind)}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def _wrap_db(self, name: str, method):
+        span_name = "db." + name
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if _TRACE.get() is None:
+                return method(*args, **kwargs)
+            with span(span_name):
+                return method(*args, **kwargs)
+
+        return wrapper
+
+    def _finish(self, trace: Trace, ended: float) -> None:
+        elapsed = ended - trace.started
+        kinds = kind_totals(trace)
+        with self._lock:
+            stats = self.routes.setdefault(trace.route, RouteStats())
+            stats.count += 1
+            stats.errors += trace.failed
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            for index, bound in enumerate(HISTOGRAM_BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[index] += 1
+                    break
+            for kind, seconds in kinds.items():
+                stats.kinds[kind] = stats.kinds.get(kind, 0.0) + seconds
+        if self.slow and elapsed >= self.slow:
+            LOGGER.warning("%s", waterfall(trace, ended, kinds))
+        for callback in self._listeners:
+            callback(trace, ended)
+
+
+def kind_totals(trace: Trace) -> dict[str, float]:
+    kinds: dict[str, float] = {}
+    for item in trace.spans:
+        if not item.nested:
+            kinds[item.kind] = kinds.get(item.kind, 0.0) + item.ended - item.started
+    return kinds
+
+
+def waterfall(trace: Trace, ended: float, kinds: dict[str, float] | None = None) -> str:
+    """Compact text waterfall: one line per span, offset and duration in ms plus a bar."""
+    elapsed = max(ended - trace.started, 1e-9)
+    if kinds is None:
+        kinds = kind_totals(trace)
+    totals = " ".join(f"{kind} {seconds * 1000:.0f}ms" for kind, seconds in sorted(kinds.items()))
+    lines = [f"slow update {trace.route}{' (error)' if trace.failed else ''}: {elapsed * 1000:.0f}ms [{totals}]"]
+    for item in sorted(trace.spans, key=lambda s: (s.started, s.depth)):
+        offset = item.started - trace.started
+        duration = item.ended - item.started
+        start_col = int(offset / elapsed * WATERFALL_WIDTH)
+        width = max(1, round(duration / elapsed * WATERFALL_WIDTH))
+        bar = (" " * start_col + "█" * width)[:WATERFALL_WIDTH].ljust(WATERFALL_WIDTH)
+        lines.append(f"  {offset * 1000:>6.1f} {duration * 1000:>7.1f}ms |{bar}| {'  ' * item.depth}{item.name}")
+    return "\n".join(lines)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")